@@ -0,0 +1,397 @@
+# remote_async_client.py
+import asyncio
+
+from remote_client import RemoteClientBase, call_log, free_names, log
+from remote_codec import DEFAULT_CODEC
+from remote_delta import DEFAULT_EPSILON, DEFAULT_KEYFRAME_INTERVAL, DEFAULT_POSITION_RANGE
+from remote_handles import AsyncRemoteHandle
+from remote_pubsub import DEFAULT_STREAM_RATE, StateSubscription
+from remote_protocol import (FLAG_BATCH, FLAG_CALL, FLAG_CONTROL, FLAG_SCRIPT, FLAG_STREAM, encode_control, pack_frame,
+                             recv_frame_async)
+from remote_pure import DEFAULT_PURE_CACHE_SIZE
+
+
+class AsyncRemoteClient(RemoteClientBase):
+    """asyncio counterpart of RemoteClient.
+
+    Any number of coroutines can await calls on one connection at once. Each
+    request is written as soon as it is made and a single reader task hands
+    replies to their waiters by request id, so calls are pipelined and may
+    complete out of order. The connection always stays on the socket; the
+    shared memory transport is only offered by the blocking client.
+
+    A call that times out or is cancelled stops waiting straight away, but
+    the server still runs it; its late reply is dropped.
+    """
+
+    def __init__(self, server_ip="127.0.0.1", server_port=65432, logging=False, remote_prefix="FUN.",
+                 codec="tagged", arrays=False, unix_path=None, timeout=None, world=None, local_functions=True,
+                 pure_cache_size=DEFAULT_PURE_CACHE_SIZE, lazy_sync=False):
+        super().__init__(server_ip, server_port, logging, remote_prefix, codec, arrays, unix_path, world,
+                         local_functions, pure_cache_size, lazy_sync)
+        # Default per-call timeout in seconds; None waits forever
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self._pending = {}
+        self._streams = {}
+        self._reader_task = None
+        # Why the reader stopped; later requests fail with it instead of waiting forever
+        self._reader_error = None
+
+    async def connect(self):
+        """Establish connection to the PyBullet server"""
+        try:
+            if self.LOGGING:
+                log.info("Connecting to PyBullet server at %s...", self._server_label())
+            if self.UNIX_PATH:
+                self.reader, self.writer = await asyncio.open_unix_connection(self.UNIX_PATH)
+            else:
+                self.reader, self.writer = await asyncio.open_connection(self.SERVER_IP, self.SERVER_PORT)
+        except OSError as e:
+            log.error("Connection error: %s", e)
+            return False
+        self._reader_error = None
+        self._reader_task = asyncio.create_task(self._read_replies())
+        if self.LOGGING:
+            log.info("Connected to server.")
+        if self.requested_codec != DEFAULT_CODEC.name:
+            await self.negotiate_codec()
+        return True
+
+    async def negotiate_codec(self):
+        """Ask the server to switch this connection to the requested codec"""
+        flags, payload = await self._roundtrip(encode_control(self._hello_message()), FLAG_CONTROL)
+        self._apply_hello(flags, payload)
+
+    async def close(self):
+        """Close the connection to the server"""
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+            self._reader_task = None
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+            self.writer = None
+            if self.LOGGING:
+                log.info("Closing connection to server.")
+
+    async def _read_replies(self):
+        """Route every reply frame to the coroutine waiting on its request id"""
+        error = ConnectionAbortedError("Server closed the connection")
+        try:
+            while True:
+                frame = await recv_frame_async(self.reader)
+                if frame is None:
+                    break
+                reply_id, flags, payload = frame
+                if flags & FLAG_STREAM:
+                    handler = self._streams.get(reply_id)
+                    if handler is not None:
+                        handler(*self._decode_stream(payload))
+                    continue
+                waiter = self._pending.pop(reply_id, None)
+                if waiter is None or waiter.done():
+                    if self.LOGGING:
+                        call_log.debug("Discarding stale reply for request %s", reply_id)
+                    continue
+                waiter.set_result((flags, payload))
+        except ConnectionError as e:
+            # ProtocolError is a ConnectionError too; keep its message
+            error = e if isinstance(e, ConnectionAbortedError) else ConnectionAbortedError(str(e))
+        finally:
+            # Nothing more will arrive: fail everyone still waiting, and everyone who asks later
+            self._reader_error = error
+            for waiter in self._pending.values():
+                if not waiter.done():
+                    waiter.set_exception(error)
+            self._pending.clear()
+
+    async def _roundtrip(self, payload, flags=0, timeout=None, on_stream=None):
+        """Send one request frame and await the reply with the same id"""
+        if self.writer is None:
+            raise ConnectionAbortedError("Not connected")
+        if self._reader_task is None or self._reader_task.done():
+            raise ConnectionAbortedError(str(self._reader_error or "Not connected"))
+        release = self._take_handle_releases() if not flags & FLAG_CONTROL else None
+        if release is not None:
+            # Nobody waits for this one; its reply is dropped as stale
+            self.writer.write(pack_frame(next(self._request_ids), *self._address(*release)))
+        request_id = next(self._request_ids)
+        waiter = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = waiter
+        if on_stream is not None:
+            self._streams[request_id] = on_stream
+        try:
+            # One write call per frame keeps concurrent senders from interleaving
+            self.writer.write(pack_frame(request_id, *self._address(payload, flags)))
+            await self.writer.drain()
+            return await asyncio.wait_for(waiter, self.timeout if timeout is None else timeout)
+        finally:
+            self._pending.pop(request_id, None)
+            self._streams.pop(request_id, None)
+
+    async def execute_remote_function(self, remote_call_str, timeout=None):
+        """Execute a remote function and return the result.
+
+        Raises asyncio.TimeoutError if no reply arrives within `timeout`
+        seconds (default: the client's timeout). Pure functions are
+        evaluated locally, as with RemoteClient.
+        """
+        answered, result = self._evaluate_source_locally(remote_call_str)
+        if answered:
+            return result
+        payload, request_flags = self._encode_request(remote_call_str)
+        await self._push_variables(self._variables_read_by(remote_call_str, request_flags & FLAG_CALL))
+        self._note_writes_by(remote_call_str)
+        if self.LOGGING:
+            call_log.debug("Sending: %s", remote_call_str)
+        flags, payload = await self._roundtrip(payload, request_flags, timeout=timeout)
+        return self._decode_reply(flags, payload)
+
+    async def call(self, name, /, *args, timeout=None, **kwargs):
+        """Call a remote function by name; see RemoteClient.submit_call"""
+        answered, result = self._evaluate_locally(name, args, kwargs)
+        if answered:
+            return result
+        await self._push_variables(self._variables_read_by_call(name, args))
+        self._note_writes_by_call(name, args)
+        payload, request_flags, label = self._encode_call(name, args, kwargs)
+        if self.LOGGING:
+            call_log.debug("Sending: %s", label)
+        flags, payload = await self._roundtrip(payload, request_flags, timeout)
+        return self._decode_reply(flags, payload)
+
+    async def execute_remote_functions(self, remote_call_strs, timeout=None):
+        """Issue several remote calls concurrently and return their results in order"""
+        return await asyncio.gather(*(self.execute_remote_function(call, timeout)
+                                      for call in remote_call_strs))
+
+    async def register_observation(self, body_ids, name="default", joint_states=True, contacts=True,
+                                   physicsClientId=None):
+        """See RemoteClient.register_observation"""
+        return await self.call("register_observation", list(body_ids), name=name, joint_states=joint_states,
+                               contacts=contacts, physicsClientId=physicsClientId)
+
+    async def step_and_observe(self, steps=1, name="default"):
+        """See RemoteClient.step_and_observe"""
+        return await self.call("step_and_observe", steps, name=name, as_arrays=self.arrays)
+
+    async def subscribe(self, body_ids, rate=DEFAULT_STREAM_RATE, joint_states=True, contacts=False,
+                        on_frame=None, physicsClientId=None, delta=False, epsilon=DEFAULT_EPSILON,
+                        keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, quantize=False,
+                        position_range=DEFAULT_POSITION_RANGE):
+        """See RemoteClient.subscribe; frames are read as they arrive.
+
+        on_frame is called from the reader task and must not block.
+        """
+        self._require_binary_codec("State subscriptions")
+        encoding = self._stream_encoding(delta, epsilon, keyframe_interval, quantize, position_range)
+        subscription = StateSubscription(next(self._request_ids), on_frame, delta)
+        self._streams[subscription.stream_id] = subscription._receive
+        try:
+            subscription.layout = await self.call("subscribe_state", subscription.stream_id, list(body_ids), rate,
+                                                  joint_states, contacts, physicsClientId, encoding)
+        except BaseException:
+            self._streams.pop(subscription.stream_id, None)
+            raise
+        return subscription
+
+    async def unsubscribe(self, subscription):
+        """See RemoteClient.unsubscribe"""
+        self._streams.pop(subscription.stream_id, None)
+        return await self.call("unsubscribe_state", subscription.stream_id)
+
+    async def subscription_stats(self):
+        """See RemoteClient.subscription_stats"""
+        return await self.call("subscription_stats")
+
+    async def create_world(self, select=True):
+        """See RemoteClient.create_world"""
+        world_id = int(await self.call("create_world"))
+        if select:
+            self.world = world_id
+        return world_id
+
+    async def destroy_world(self, world_id=None):
+        """See RemoteClient.destroy_world"""
+        if world_id is None:
+            world_id = self.world
+        result = await self.call("destroy_world", world_id)
+        self._forget_synced(world_id)
+        if world_id == self.world:
+            self.world = None
+        return result
+
+    async def list_worlds(self):
+        """See RemoteClient.list_worlds"""
+        return await self.call("list_worlds")
+
+    async def save_snapshot(self, name):
+        """See RemoteClient.save_snapshot"""
+        return await self.call("save_snapshot", name)
+
+    async def restore_snapshot(self, name, sync=True):
+        """See RemoteClient.restore_snapshot"""
+        restored = await self.call("restore_snapshot", name, return_variables=self._restore_request(sync))
+        self._restored(restored)
+        return True
+
+    async def drop_snapshot(self, name):
+        """See RemoteClient.drop_snapshot"""
+        return await self.call("drop_snapshot", name)
+
+    async def list_snapshots(self):
+        """See RemoteClient.list_snapshots"""
+        return await self.call("list_snapshots")
+
+    async def call_handle(self, name, /, *args, **kwargs):
+        """See RemoteClient.call_handle; returns an AsyncRemoteHandle"""
+        self._require_binary_codec("Remote handles")
+        return AsyncRemoteHandle(self, await self.call("make_handle", name, args, kwargs))
+
+    async def retain_handle(self, handle_id):
+        """See RemoteClient.retain_handle"""
+        self._require_binary_codec("Remote handles")
+        return AsyncRemoteHandle(self, await self.call("retain_handle", handle_id))
+
+    async def handle_stats(self):
+        """See RemoteClient.handle_stats"""
+        return await self.call("handle_stats")
+
+    async def make_vec_env(self, source, num_envs, num_workers=None):
+        """See RemoteClient.make_vec_env"""
+        if not isinstance(source, str):
+            source = "\n".join(line.rstrip("\n") for line in source)
+        return await self.call("make_vec_env", source, num_envs, num_workers)
+
+    async def reset_all(self, env_id):
+        """See RemoteClient.reset_all"""
+        return await self.call("reset_all", env_id)
+
+    async def step_all(self, env_id, actions):
+        """See RemoteClient.step_all"""
+        return await self.call("step_all", env_id, actions)
+
+    async def close_vec_env(self, env_id):
+        """See RemoteClient.close_vec_env"""
+        return await self.call("close_vec_env", env_id)
+
+    async def start_realtime(self, rate=240.0, physicsClientId=None, set_time_step=True):
+        """See RemoteClient.start_realtime"""
+        return await self.call("start_realtime", rate, physicsClientId, set_time_step)
+
+    async def stop_realtime(self):
+        """See RemoteClient.stop_realtime"""
+        return await self.call("stop_realtime")
+
+    async def realtime_stats(self):
+        """See RemoteClient.realtime_stats"""
+        return await self.call("realtime_stats")
+
+    async def call_batch(self, remote_call_strs, return_exceptions=False, timeout=None):
+        """Run several remote calls in one round trip; see RemoteClient.call_batch"""
+        calls = list(remote_call_strs)
+        await self._push_variables(self._variables_read_by_batch(calls))
+        for call in calls:
+            self._note_writes_by(call)
+        flags, payload = await self._roundtrip(self._encode_batch(calls), FLAG_BATCH, timeout)
+        return self._decode_batch(calls, flags, payload, return_exceptions)
+
+    async def run_script(self, source, export=(), on_output=None, timeout=None):
+        """Run a script on the server; see RemoteClient.run_script.
+
+        on_output is called from the reader task and must not block.
+        """
+        source = self._script_text(source)
+        await self._push_variables(free_names(source, "exec"))
+        self._note_script_writes(source, export)
+        flags, payload = await self._roundtrip(self._encode_script(source, export), FLAG_SCRIPT, timeout,
+                                               on_output or self._print_output)
+        return self._decode_reply(flags, payload)
+
+    async def substitute_remote_functions(self, command, bound):
+        """Substitute remote function calls with their results"""
+        while True:
+            current_calls = self.find_remote_calls(command)
+            if not current_calls:
+                break
+
+            call_to_process = current_calls[0]
+            result = await self.execute_remote_function(call_to_process)
+            command = command.replace(call_to_process, self._substitution_for(result, bound), 1)
+
+        return command
+
+    async def sync_variable(self, var_name, value):
+        """See RemoteClient.sync_variable"""
+        request = self._sync_request(var_name, value)
+        if request is not None:
+            payload, flags, plan = request
+            try:
+                version = self._decode_reply(*await self._roundtrip(payload, flags))
+            except ConnectionAbortedError:
+                if not plan[1]:
+                    raise
+                payload, flags, plan = self._sync_request(var_name, value, full=True)
+                version = self._decode_reply(*await self._roundtrip(payload, flags))
+            self._finish_sync(plan, version)
+        self._mark_clean(var_name)
+
+    async def _push_variables(self, names):
+        """See RemoteClient._push_variables"""
+        for var_name in self._stale_variables(names):
+            try:
+                await self.sync_variable(var_name, self.local_namespace[var_name])
+            except ConnectionAbortedError as e_sync:
+                log.error("Server error during sync of '%s': %s", var_name, e_sync)
+
+    async def flush(self):
+        """See RemoteClient.flush"""
+        await self._push_variables(list(self._clean))
+
+    async def execute_line(self, line, idx=1):
+        """Execute a single line of code"""
+        stripped_line = line.strip()
+        if not stripped_line or stripped_line.startswith("#"):
+            return
+
+        # Placeholders are tracked per line so concurrent lines do not clash
+        bound = []
+        command_after_subs = None
+        try:
+            if self.LOGGING:
+                call_log.debug("[Line %d] Original: %s", idx, stripped_line)
+
+            command_after_subs = await self.substitute_remote_functions(stripped_line, bound)
+            if self.LOGGING:
+                call_log.debug("[Line %d] Substituted: %s", idx, command_after_subs)
+
+            sync = self._evaluate_line(command_after_subs, idx)
+            if sync is not None:
+                var_name, value = sync
+                self._mark_dirty(var_name)
+                try:
+                    if not self.lazy_sync:
+                        await self.sync_variable(var_name, value)
+                except ConnectionAbortedError as e_sync:
+                    log.error("[Line %d] Server error during sync of '%s': %s", idx, var_name, e_sync)
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._report_line_error(e, idx, stripped_line, command_after_subs)
+        finally:
+            self._release_placeholders(bound)
+
+    async def execute_script(self, lines):
+        """Execute multiple lines of code, in order"""
+        for idx, line in enumerate(lines, 1):
+            await self.execute_line(line, idx)
@@ -1,47 +1,236 @@
 import socket
+import contextlib
 import re
+import select
 import sys
 import os
+import itertools
+import json
+import ast
+import functools
+import logging
 
+from remote_codec import CODECS, CodecError, DEFAULT_CODEC, codec_for_peer, np
+from remote_delta import DEFAULT_EPSILON, DEFAULT_KEYFRAME_INTERVAL, DEFAULT_POSITION_RANGE
+from remote_handles import RemoteHandle
+from remote_log import ensure_logging
+from remote_protocol import (FLAG_BATCH, FLAG_CALL, FLAG_CONTROL, FLAG_ERROR, FLAG_SCRIPT, FLAG_STREAM,
+                             FLAG_WORLD, ProtocolError, SocketTransport, decode_control, encode_control,
+                             prefix_world)
+from remote_pubsub import DEFAULT_STREAM_RATE, StateSubscription
+from remote_pure import DEFAULT_PURE_CACHE_SIZE, PureFunctions
+from remote_shm import ShmTransport
+from remote_sync import SyncState, plan_update
 
-class RemoteClient:
-    def __init__(self, server_ip="127.0.0.1", server_port=65432, logging=True, remote_prefix="FUN."):
+log = logging.getLogger("remote.client")
+# Per-call and per-line records, written only for clients created with logging=True
+call_log = logging.getLogger("remote.client.calls")
+
+# Prefix of the local names that hold decoded remote results while a line runs
+RESULT_PLACEHOLDER_PREFIX = "__remote_result_"
+
+# Requests allowed on the wire before submitting blocks to collect a reply
+DEFAULT_MAX_IN_FLIGHT = 64
+
+
+# Remote functions the server exposes under their own names rather than the remote prefix
+SERVER_FUNCTIONS = ("set_shared_variable", "get_shared_variable", "update_shared_variable",
+                    "list_shared_variables", "register_observation", "step_and_observe",
+                    "start_realtime", "stop_realtime", "realtime_stats", "subscribe_state", "unsubscribe_state",
+                    "subscription_stats", "create_world", "destroy_world",
+                    "list_worlds", "save_snapshot", "restore_snapshot", "drop_snapshot", "list_snapshots",
+                    "make_handle", "handle_getattr", "handle_getitem", "handle_call", "handle_fetch",
+                    "retain_handle", "release_handles", "handle_stats",
+                    "make_vec_env", "reset_all", "step_all", "close_vec_env")
+
+
+@functools.lru_cache(maxsize=16)
+def remote_call_start(remote_prefix):
+    """Pattern matching where a remote call begins.
+
+    A call only begins where a name could, so `myFUN.x(...)`, `env.FUN.x(...)`
+    and `my_step_all(...)` are left alone.
+    """
+    names = "|".join(re.escape(name) for name in sorted(SERVER_FUNCTIONS, key=len, reverse=True))
+    return re.compile(rf"(?<![\w.])(?:{re.escape(remote_prefix)}|(?:{names})\()")
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_remote_call(remote_call_str, remote_prefix):
+    """Split a call's source into (name, arg specs, kwarg specs), or None.
+
+    Only calls whose arguments are literals or plain names qualify; each
+    spec is (is_name, literal value or name). Anything else (attribute
+    constants, nested calls, expressions, *args) returns None and the call
+    is sent as source instead.
+    """
+    try:
+        node = ast.parse(remote_call_str, mode='eval').body
+    except SyntaxError:
+        return None
+    if not isinstance(node, ast.Call):
+        return None
+    if isinstance(node.func, ast.Name) and node.func.id in SERVER_FUNCTIONS:
+        name = node.func.id
+    elif isinstance(node.func, ast.Attribute) and f"{ast.unparse(node.func.value)}." == remote_prefix:
+        name = node.func.attr
+    else:
+        return None
+
+    def spec(arg):
+        if isinstance(arg, ast.Name):
+            return True, arg.id
+        return False, ast.literal_eval(arg)
+
+    try:
+        if any(isinstance(arg, ast.Starred) for arg in node.args) or any(kw.arg is None for kw in node.keywords):
+            return None
+        args = tuple(spec(arg) for arg in node.args)
+        kwargs = tuple((kw.arg, spec(kw.value)) for kw in node.keywords)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return None
+    return name, args, kwargs
+
+
+# Server functions that read the shared variable named by their first argument,
+# and ones that read every shared variable
+READS_NAMED_VARIABLE = frozenset({"get_shared_variable"})
+READS_ALL_VARIABLES = frozenset({"list_shared_variables", "save_snapshot"})
+# Server functions that write the shared variable named by their first argument
+WRITES_NAMED_VARIABLE = frozenset({"set_shared_variable", "update_shared_variable", "store_shared_variable"})
+
+
+@functools.lru_cache(maxsize=1024)
+def free_names(source, mode="eval"):
+    """Names a piece of source reads, for deciding which variables to sync before it runs.
+
+    Every name loaded anywhere counts, including ones bound inside the
+    source (comprehension variables, lambda arguments, script locals); at
+    worst that syncs a variable the server did not strictly need.
+    """
+    try:
+        tree = ast.parse(source, mode=mode)
+    except (SyntaxError, ValueError):
+        return frozenset()
+    return frozenset(node.id for node in ast.walk(tree)
+                     if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load))
+
+
+def format_remote_call(remote_prefix, name, args, kwargs):
+    """Source text for a call, for the eval path used with the text codec"""
+    arguments = [repr(arg) for arg in args] + [f"{key}={value!r}" for key, value in kwargs.items()]
+    prefix = "" if name in SERVER_FUNCTIONS else remote_prefix
+    return f"{prefix}{name}({', '.join(arguments)})"
+
+
+class PendingCall:
+    """A request that has been sent but whose reply may not have been read yet"""
+
+    def __init__(self, client, request_id, label):
+        self.client = client
+        self.request_id = request_id
+        self.label = label
+        self._collected = False
+
+    def done(self):
+        """True once the reply has been received (it may still be unread by result())"""
+        return self.request_id in self.client._completed
+
+    def result(self):
+        """Wait for the reply and return the decoded result"""
+        self._collected = True
+        flags, payload = self.client._wait_for(self.request_id)
+        return self.client._decode_reply(flags, payload)
+
+    def __del__(self):
+        if not self._collected:
+            try:
+                self.client._forget_request(self.request_id)
+            except Exception:
+                pass  # half-built call, or the client is being torn down too
+
+
+class ResolvedCall:
+    """A call answered on the client; looks like a PendingCall that has already completed"""
+    request_id = None
+
+    def __init__(self, value, label):
+        self.value = value
+        self.label = label
+
+    def done(self):
+        return True
+
+    def result(self):
+        return self.value
+
+
+class RemoteClientBase:
+    """Connection settings, wire encoding and line rewriting shared by the sync and async clients"""
+
+    def __init__(self, server_ip="127.0.0.1", server_port=65432, logging=False, remote_prefix="FUN.",
+                 codec="tagged", arrays=False, unix_path=None, world=None, local_functions=True,
+                 pure_cache_size=DEFAULT_PURE_CACHE_SIZE, lazy_sync=False):
         self.SERVER_IP = server_ip
         self.SERVER_PORT = server_port
+        # Connect over a unix domain socket at this path instead of TCP
+        self.UNIX_PATH = unix_path
+        # Trace every call and line at DEBUG level; checked before any record is built
         self.LOGGING = logging
+        if logging:
+            ensure_logging("DEBUG")
         self.REMOTE_PREFIX = remote_prefix
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec {codec!r}, expected one of {sorted(CODECS)}")
+        self.requested_codec = codec
+        self.codec = DEFAULT_CODEC
+        # Ask for array-shaped results as NumPy arrays (needs NumPy and a binary codec)
+        self.requested_arrays = arrays and np is not None
+        self.arrays = False
+        # Id of the server-side world requests go to; None is the server's default world
+        self.world = world
+        # Pure math functions (quaternions, transforms) are answered here without a round trip
+        self.pure = PureFunctions(pure_cache_size) if local_functions else None
         self.local_namespace = {}
-        self.socket = None
+        # What was last sent for each (world, variable), so unchanged values are not sent again
+        self._synced = {}
+        # Push assigned variables only when a remote call reads them, instead of on assignment.
+        # Opt-in: the server's shared variables then lag behind the client's until something reads them
+        self.lazy_sync = lazy_sync
+        # Assigned client variables and the worlds that hold their current value
+        self._clean = {}
+        # Ids of handles dropped on this side, released on the server with the next request
+        self._handle_releases = []
+        self._request_ids = itertools.count(1)
+        self._placeholder_ids = itertools.count()
 
-    def connect(self):
-        """Establish connection to the PyBullet server"""
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            if self.LOGGING:
-                print(f"Connecting to PyBullet server at {self.SERVER_IP}:{self.SERVER_PORT}...")
-            self.socket.connect((self.SERVER_IP, self.SERVER_PORT))
-            if self.LOGGING:
-                print("Connected to server.")
-            return True
-        except socket.error as e:
-            print(f"Connection error: {e}")
-            return False
+    def _server_label(self):
+        if self.UNIX_PATH:
+            return self.UNIX_PATH
+        return f"{self.SERVER_IP}:{self.SERVER_PORT}"
 
-    def close(self):
-        """Close the connection to the server"""
-        if self.socket:
-            self.socket.close()
-            if self.LOGGING:
-                print("Closing connection to server.")
+    def _hello_message(self):
+        return {"op": "hello", "codecs": [self.requested_codec, DEFAULT_CODEC.name],
+                "arrays": self.requested_arrays}
+
+    def _apply_hello(self, flags, payload):
+        """Adopt the settings from the server's hello reply and return the reply"""
+        if not flags & FLAG_CONTROL:
+            raise ProtocolError("Server did not answer the codec handshake")
+        reply = decode_control(payload)
+        self.arrays = bool(reply.get("arrays"))
+        self.codec = codec_for_peer(CODECS.get(reply.get("codec"), DEFAULT_CODEC), self.arrays)
+        if self.LOGGING:
+            log.info("Using '%s' codec (arrays: %s).", self.codec.name, self.arrays)
+        return reply
 
     def find_remote_calls(self, command):
         """Find all remote function calls in the command"""
         calls = []
+        call_start = remote_call_start(self.REMOTE_PREFIX)
         i = 0
         while i < len(command):
-            if (command.startswith(self.REMOTE_PREFIX, i) or
-                command.startswith("set_shared_variable(", i) or
-                command.startswith("get_shared_variable(", i)):
+            if call_start.match(command, i):
                 start = i
                 depth = 0
                 
@@ -70,19 +259,823 @@ class RemoteClient:
                 i += 1
         return calls
 
-    def execute_remote_function(self, remote_call_str):
-        """Execute a remote function and return the result"""
-        if self.LOGGING:
-            print(f"Client sending: {remote_call_str}")
-        self.socket.sendall(remote_call_str.encode('utf-8'))
-        response_data = self.socket.recv(8192)
-        decoded_response = response_data.decode('utf-8')
+    def _address(self, payload, flags):
+        """Tag a request with the selected world, if any"""
+        if self.world is None or flags & FLAG_CONTROL:
+            return payload, flags
+        return prefix_world(self.world, payload), flags | FLAG_WORLD
+
+    def _encode_command(self, remote_call_str):
+        if self.codec is DEFAULT_CODEC:
+            return remote_call_str.encode('utf-8')
+        return self.codec.encode(remote_call_str)
+
+    def _structured_call(self, remote_call_str):
+        """[name, args, kwargs] for a call the server can dispatch without eval, or None"""
+        if self.codec is DEFAULT_CODEC:
+            return None
+        return self._resolve_call(remote_call_str)
+
+    def _resolve_call(self, remote_call_str):
+        """[name, args, kwargs] of a call whose arguments are literals or client variables, or None"""
+        shape = parse_remote_call(remote_call_str, self.REMOTE_PREFIX)
+        if shape is None:
+            return None
+        name, arg_specs, kwarg_specs = shape
+        try:
+            # Names refer to client variables, which mirror the server's shared variables
+            args = [self.local_namespace[value] if is_name else value for is_name, value in arg_specs]
+            kwargs = {key: self.local_namespace[value] if is_name else value
+                      for key, (is_name, value) in kwarg_specs}
+        except KeyError:
+            return None
+        return [name, args, kwargs]
+
+    def _evaluate_locally(self, name, args, kwargs, label=None):
+        """(True, result) for a pure call answered without the server, else (False, None).
+
+        Results take the same form as decoded replies: repr() text with the
+        text codec, Python values otherwise.
+        """
+        if self.pure is None or name not in self.pure:
+            return False, None
+        answered, result = self.pure.evaluate(name, args, kwargs)
+        if answered:
+            if self.LOGGING:
+                label = label or format_remote_call(self.REMOTE_PREFIX, name, args, kwargs)
+                call_log.debug("Computed locally: %s", label)
+            if self.codec is DEFAULT_CODEC:
+                result = repr(result)
+        return answered, result
+
+    def _evaluate_source_locally(self, remote_call_str):
+        """_evaluate_locally for a call given as source"""
+        if self.pure is None:
+            return False, None
+        call = self._resolve_call(remote_call_str)
+        if call is None:
+            return False, None
+        return self._evaluate_locally(*call, remote_call_str)
+
+    def _encode_request(self, remote_call_str):
+        """Payload and frame flags for one remote call given as source"""
+        call = self._structured_call(remote_call_str)
+        if call is not None:
+            try:
+                return self.codec.encode(call), FLAG_CALL
+            except CodecError:
+                pass  # e.g. a local value the codec cannot carry; let the server eval the source
+        return self._encode_command(remote_call_str), 0
+
+    def _encode_call(self, name, args, kwargs):
+        """Payload, frame flags and log label for a call given by name"""
+        label = format_remote_call(self.REMOTE_PREFIX, name, args, kwargs)
+        if self.codec is DEFAULT_CODEC:
+            return self._encode_command(label), 0, label
+        return self.codec.encode([name, list(args), kwargs]), FLAG_CALL, label
+
+    def _digest_encoding(self, value):
+        """The bytes a variable's content hash is taken over: its encoding on this connection"""
+        if self.codec is not DEFAULT_CODEC:
+            try:
+                return self.codec.encode(value)
+            except CodecError:
+                pass
+        return DEFAULT_CODEC.encode(value)
+
+    def _sync_request(self, var_name, value, full=False):
+        """(payload, flags, plan) that mirror a client variable to the server, or None.
+
+        A value whose content hash matches what this client last sent is
+        not sent again. Lists and dicts that changed in only some elements
+        go as a delta against the server's version; `full` sends the whole
+        value regardless. Writes this client makes on the server by other
+        means (set_shared_variable, script exports, restores) drop what it
+        last sent; see _note_writes_by. Changes made on the server by other
+        clients are not seen here, so re-assigning the value this client
+        last sent is skipped even then.
+        """
+        key = (self.world, var_name)
+        state = None if full else self._synced.get(key)
+        change, digest, kind, items = plan_update(state, value, self._digest_encoding)
+        if change is None:
+            if self.LOGGING:
+                call_log.debug("Skipping sync of unchanged '%s'", var_name)
+            return None
+        args = [var_name, change, state.version if state is not None else None, digest]
+        plan = (key, change[0] != "value", digest, kind, items)
+        if self.codec is not DEFAULT_CODEC:
+            try:
+                return self.codec.encode(["update_shared_variable", args, {}]), FLAG_CALL, plan
+            except CodecError:
+                pass
+        # The text protocol, and values the codec cannot carry, go as source for eval()
+        source = f"update_shared_variable({', '.join(repr(arg) for arg in args)})"
+        return self._encode_command(source), 0, plan
+
+    def _finish_sync(self, plan, version):
+        """Remember what the server now holds after a sync request succeeded"""
+        key, _, digest, kind, items = plan
+        self._synced[key] = SyncState(int(version), digest, kind, items)
+
+    def _forget_synced(self, world):
+        """Drop sync state for a world whose variables changed behind this client's back"""
+        for key in [key for key in self._synced if key[0] == world]:
+            del self._synced[key]
+        for worlds in self._clean.values():
+            worlds.discard(world)
+
+    def _written(self, var_name):
+        """Note that a request writes a shared variable of the selected world on the server.
+
+        What was last synced no longer says what the server holds, so the
+        next assignment is sent in full; until then the written value is
+        current there, and is not overwritten with the client's older one.
+        """
+        self._synced.pop((self.world, var_name), None)
+        if var_name in self._clean:
+            self._clean[var_name].add(self.world)
+
+    def _note_writes_by_call(self, name, args):
+        if name in WRITES_NAMED_VARIABLE and args and isinstance(args[0], str):
+            self._written(args[0])
+
+    def _note_writes_by(self, source, mode="eval"):
+        """Note the shared variables that source run on the server may write"""
+        if WRITES_NAMED_VARIABLE.isdisjoint(free_names(source, mode)):
+            return
+        call = self._resolve_call(source) if mode == "eval" else None
+        if call is not None and call[0] in WRITES_NAMED_VARIABLE and call[1] and isinstance(call[1][0], str):
+            self._written(call[1][0])
+        else:
+            # Cannot tell which ones: send every variable in full next time
+            for key in [key for key in self._synced if key[0] == self.world]:
+                del self._synced[key]
+
+    def _note_script_writes(self, source, export):
+        self._note_writes_by(source, "exec")
+        for var_name in export:
+            self._written(var_name)
+
+    def _restore_request(self, sync):
+        # Values only come back over binary codecs; the text codec gets the names
+        return sync and self.codec is not DEFAULT_CODEC
+
+    def _restored(self, restored):
+        """Bring the client up to date after the selected world was restored from a snapshot.
+
+        `restored` is what the server's restore_snapshot returned: the
+        restored variables, or their names. The server's values win: they
+        count as current for the world, so they are not overwritten with
+        the client's pre-restore values. Client variables the snapshot
+        does not have are pushed again when something reads them.
+        """
+        world = self.world
+        for key in [key for key in self._synced if key[0] == world]:
+            del self._synced[key]
+        if isinstance(restored, str):
+            restored = ast.literal_eval(restored)
+        if isinstance(restored, dict):
+            self.local_namespace.update(restored)
+        for var_name, worlds in self._clean.items():
+            if var_name in restored:
+                worlds.add(world)
+            else:
+                worlds.discard(world)
+        if isinstance(restored, dict):
+            for var_name in restored:
+                # The local value changed too, so every other world is now behind
+                self._clean[var_name] = {world}
+
+    def _mark_dirty(self, var_name):
+        """Note that a client variable was assigned and no world has its new value yet"""
+        self._clean[var_name] = set()
+
+    def _mark_clean(self, var_name):
+        if var_name in self._clean:
+            self._clean[var_name].add(self.world)
+
+    def _stale_variables(self, names):
+        """Client variables among `names` whose current value the selected world lacks"""
+        world = self.world
+        return [name for name in names if name in self._clean and world not in self._clean[name]]
+
+    def _variables_read_by_call(self, name, args):
+        """Shared variables a call by name reads, given its argument values"""
+        if name in READS_ALL_VARIABLES:
+            return list(self._clean)
+        if name in READS_NAMED_VARIABLE and args and isinstance(args[0], str):
+            return [args[0]]
+        return []
+
+    def _variables_read_by(self, remote_call_str, structured):
+        """Shared variables a call given as source reads on the server.
+
+        A structured call carries its arguments' values, so only the server
+        functions it names can read variables; source evaluated on the
+        server reads every free name too.
+        """
+        names = [] if structured else list(free_names(remote_call_str))
+        call = self._resolve_call(remote_call_str)
+        if call is not None:
+            names += self._variables_read_by_call(call[0], call[1])
+        return names
+
+    def _variables_read_by_batch(self, calls):
+        names = set()
+        for call in calls:
+            names.update(self._variables_read_by(call, False))
+        return names
+
+    def _require_binary_codec(self, feature):
+        if self.codec is DEFAULT_CODEC:
+            raise ValueError(f"{feature} need a binary codec")
+
+    def _stream_encoding(self, delta, epsilon, keyframe_interval, quantize, position_range):
+        """FrameEncoder options to subscribe with, or None for plain frames"""
+        if not delta:
+            return None
+        if np is None:
+            raise RuntimeError("Delta-encoded subscriptions need NumPy")
+        return {"epsilon": epsilon, "keyframe_interval": keyframe_interval, "quantize": quantize,
+                "position_range": position_range}
+
+    def _release_handle(self, handle_id):
+        # Called from handle finalizers, so it only queues the id
+        self._handle_releases.append(handle_id)
+
+    def _take_handle_releases(self):
+        """Payload and flags of a release_handles request for the queued ids, or None"""
+        if not self._handle_releases:
+            return None
+        handle_ids, self._handle_releases = self._handle_releases, []
+        payload, flags, _ = self._encode_call("release_handles", (handle_ids,), {})
+        return payload, flags
+
+    def _decode_reply(self, flags, payload):
+        if flags & FLAG_ERROR:
+            raise ConnectionAbortedError(f"Server error: {payload.decode('utf-8')}")
+        if self.codec is DEFAULT_CODEC:
+            decoded_response = payload.decode('utf-8')
+            if decoded_response.startswith("ERROR executing command:"):
+                raise ConnectionAbortedError(f"Server error: {decoded_response}")
+        else:
+            decoded_response = self.codec.decode(payload) if payload else None
         if self.LOGGING:
-            print(f"Client received: {decoded_response}")
-        if decoded_response.startswith("ERROR executing command:"):
-            raise ConnectionAbortedError(f"Server error: {decoded_response}")
+            call_log.debug("Received: %s", decoded_response)
         return decoded_response
 
+    def _encode_batch(self, calls):
+        if self.LOGGING:
+            call_log.debug("Sending batch of %d calls", len(calls))
+        if self.codec is DEFAULT_CODEC:
+            return json.dumps(calls).encode('utf-8')
+        entries = []
+        for call in calls:
+            structured = self._structured_call(call)
+            entries.append(call if structured is None else structured)
+        try:
+            return self.codec.encode(entries)
+        except CodecError:
+            return self.codec.encode(calls)
+
+    def _decode_batch(self, calls, flags, payload, return_exceptions):
+        if flags & FLAG_ERROR:
+            raise ConnectionAbortedError(f"Server error: {payload.decode('utf-8')}")
+        if self.codec is DEFAULT_CODEC:
+            outcomes = json.loads(payload.decode('utf-8'))
+        else:
+            outcomes = self.codec.decode(payload)
+
+        results = []
+        for call, (ok, value) in zip(calls, outcomes):
+            if ok:
+                results.append(value)
+                continue
+            error = ConnectionAbortedError(f"Server error in batched call {call!r}: {value}")
+            if not return_exceptions:
+                raise error
+            results.append(error)
+        if self.LOGGING:
+            call_log.debug("Received %d batched results", len(results))
+        return results
+
+    def _script_text(self, source):
+        if not isinstance(source, str):
+            # Lines as returned by readlines(), with or without their newlines
+            source = "\n".join(line.rstrip("\n") for line in source)
+        return source
+
+    def _encode_script(self, source, export):
+        source = self._script_text(source)
+        request = {"source": source, "export": list(export)}
+        if self.LOGGING:
+            call_log.debug("Sending script (%d lines)", source.count("\n") + 1)
+        if self.codec is DEFAULT_CODEC:
+            return json.dumps(request).encode('utf-8')
+        return self.codec.encode(request)
+
+    def _decode_stream(self, payload):
+        """(kind, value) from a FLAG_STREAM frame"""
+        if self.codec is DEFAULT_CODEC:
+            kind, value = json.loads(payload.decode('utf-8'))
+        else:
+            kind, value = self.codec.decode(payload)
+        return kind, value
+
+    def _print_output(self, kind, value):
+        """Default handler for script output: echo it locally"""
+        if kind == "stdout":
+            sys.stdout.write(value)
+            sys.stdout.flush()
+        elif self.LOGGING:
+            call_log.debug("Received streamed %s: %r", kind, value)
+
+    def _substitution_for(self, result, bound):
+        """Text that stands in for a remote call's result in the line's source"""
+        if self.codec is DEFAULT_CODEC:
+            return result.strip()
+        # Binary results are already Python objects: reference them by name
+        # instead of round-tripping them through repr()
+        name = f"{RESULT_PLACEHOLDER_PREFIX}{next(self._placeholder_ids)}"
+        self.local_namespace[name] = result
+        bound.append(name)
+        return name
+
+    def _release_placeholders(self, bound):
+        for name in bound:
+            self.local_namespace.pop(name, None)
+        bound.clear()
+
+    def _evaluate_line(self, command_after_subs, idx):
+        """Run a substituted line locally.
+
+        Returns (var_name, value) when the line assigned a variable that has
+        to be mirrored to the server, otherwise None.
+        """
+        if '=' in command_after_subs and command_after_subs.count('=') == 1:
+            parts = command_after_subs.split('=', 1)
+            var_name = parts[0].strip()
+            expression_str_to_eval = parts[1].strip()
+
+            evaluated_rhs = eval(expression_str_to_eval, globals(), self.local_namespace)
+            self.local_namespace[var_name] = evaluated_rhs
+            if self.LOGGING:
+                call_log.debug("[Line %d] Client var set, syncing to server: %s = %r", idx, var_name, evaluated_rhs)
+            return var_name, evaluated_rhs
+
+        try:
+            result = eval(command_after_subs, globals(), self.local_namespace)
+            if self.LOGGING and result is not None:
+                call_log.debug("[Line %d] Client eval result: %r", idx, result)
+        except SyntaxError:
+            exec(command_after_subs, globals(), self.local_namespace)
+            if self.LOGGING:
+                call_log.debug("[Line %d] Client executed as statement.", idx)
+        return None
+
+    def _report_line_error(self, error, idx, stripped_line, command_after_subs):
+        if isinstance(error, ConnectionAbortedError):
+            log.error("[Line %d] SERVER EXECUTION FAILED for line: %s\n  Error details: %s", idx, stripped_line, error)
+        else:
+            log.error("[Line %d] Client error processing line: %s\n  Original line: %s\n"
+                      "  Line after substitutions (if any): %s", idx, error, stripped_line,
+                      command_after_subs if command_after_subs is not None else 'N/A')
+
+
+class RemoteClient(RemoteClientBase):
+    def __init__(self, server_ip="127.0.0.1", server_port=65432, logging=False, remote_prefix="FUN.",
+                 codec="tagged", arrays=False, shared_memory=True, unix_path=None,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, world=None, local_functions=True,
+                 pure_cache_size=DEFAULT_PURE_CACHE_SIZE, lazy_sync=False):
+        super().__init__(server_ip, server_port, logging, remote_prefix, codec, arrays, unix_path, world,
+                         local_functions, pure_cache_size, lazy_sync)
+        # Switch to shared memory rings when the server reports it is on this host
+        self.requested_shared_memory = shared_memory
+        self.socket = None
+        self.transport = None
+        # Pipelining state: ids sent but not yet answered, and replies read ahead of their caller
+        self.max_in_flight = max_in_flight
+        self._in_flight = set()
+        self._completed = {}
+        # Requests whose replies nobody waits for (handle releases)
+        self._unwaited = set()
+        self._placeholders = []
+        # Handlers for stream frames of requests still running, by request id
+        self._streams = {}
+
+    def connect(self):
+        """Establish connection to the PyBullet server"""
+        if self.UNIX_PATH:
+            family, address = socket.AF_UNIX, self.UNIX_PATH
+        else:
+            family, address = socket.AF_INET, (self.SERVER_IP, self.SERVER_PORT)
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            if self.LOGGING:
+                log.info("Connecting to PyBullet server at %s...", self._server_label())
+            self.socket.connect(address)
+            self.transport = SocketTransport(self.socket)
+            if self.LOGGING:
+                log.info("Connected to server.")
+            if self.requested_codec != DEFAULT_CODEC.name:
+                self.negotiate_codec()
+            return True
+        except socket.error as e:
+            log.error("Connection error: %s", e)
+            return False
+
+    def negotiate_codec(self):
+        """Ask the server to switch this connection to the requested codec"""
+        flags, payload = self._roundtrip(encode_control(self._hello_message()), FLAG_CONTROL)
+        reply = self._apply_hello(flags, payload)
+        if reply.get("local") and self.requested_shared_memory:
+            self.attach_shared_memory()
+
+    def attach_shared_memory(self):
+        """Move this connection onto shared memory rings created by the server"""
+        flags, payload = self._roundtrip(encode_control({"op": "shm"}), FLAG_CONTROL)
+        if not flags & FLAG_CONTROL:
+            raise ProtocolError("Server did not answer the shared memory request")
+        self.transport = ShmTransport.attach_pair(self.socket, decode_control(payload))
+        if self.LOGGING:
+            log.info("Using shared memory transport.")
+
+    def close(self):
+        """Close the connection to the server"""
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+        if self.socket:
+            self.socket.close()
+            if self.LOGGING:
+                log.info("Closing connection to server.")
+
+    def _send(self, payload, flags=0):
+        """Send one request frame and return its request id without waiting for the reply"""
+        # Bound the pipeline so neither side can block forever on a full socket buffer
+        while len(self._in_flight) >= self.max_in_flight:
+            self._read_reply()
+        if self._handle_releases and not flags & FLAG_CONTROL:
+            # Piggyback queued releases on the connection ahead of this request
+            release = self._take_handle_releases()
+            if release is not None:
+                self._unwaited.add(self._send(*release))
+        request_id = next(self._request_ids)
+        self.transport.send_frame(request_id, *self._address(payload, flags))
+        self._in_flight.add(request_id)
+        return request_id
+
+    def _read_reply(self):
+        """Read one reply frame and file it under its request id"""
+        frame = self.transport.recv_frame()
+        if frame is None:
+            raise ConnectionAbortedError("Server closed the connection")
+        reply_id, reply_flags, reply_payload = frame
+        if reply_flags & FLAG_STREAM:
+            # Intermediate output; the request stays in flight until its reply
+            handler = self._streams.get(reply_id)
+            if handler is not None:
+                handler(*self._decode_stream(reply_payload))
+            return
+        if reply_id not in self._in_flight:
+            if self.LOGGING:
+                call_log.debug("Discarding stale reply for request %s", reply_id)
+            return
+        self._in_flight.discard(reply_id)
+        if reply_id in self._unwaited:
+            self._unwaited.discard(reply_id)
+            return
+        self._completed[reply_id] = (reply_flags, reply_payload)
+
+    def _wait_for(self, request_id):
+        """Read replies, in whatever order the server sends them, until `request_id` is answered"""
+        while request_id not in self._completed:
+            if request_id not in self._in_flight:
+                raise KeyError(f"Request {request_id} is not pending")
+            self._read_reply()
+        return self._completed.pop(request_id)
+
+    def _forget_request(self, request_id):
+        """Drop the reply of a request nobody will collect, whether it has arrived or not"""
+        if self._completed.pop(request_id, None) is None and request_id in self._in_flight:
+            self._unwaited.add(request_id)
+
+    def _roundtrip(self, payload, flags=0):
+        """Send one request frame and wait for the reply with the same id"""
+        return self._wait_for(self._send(payload, flags))
+
+    def register_observation(self, body_ids, name="default", joint_states=True, contacts=True,
+                             physicsClientId=None):
+        """Declare which bodies step_and_observe reports on; returns the joint layout"""
+        return self.call("register_observation", list(body_ids), name=name, joint_states=joint_states,
+                         contacts=contacts, physicsClientId=physicsClientId)
+
+    def step_and_observe(self, steps=1, name="default"):
+        """Step the simulation `steps` times and return the registered observation in one round trip.
+
+        The observation is a dict of base_positions, base_orientations,
+        joint_positions, joint_velocities, joint_torques and contact_counts.
+        With arrays=True each one arrives as a NumPy array.
+        """
+        return self.call("step_and_observe", steps, name=name, as_arrays=self.arrays)
+
+    def subscribe(self, body_ids, rate=DEFAULT_STREAM_RATE, joint_states=True, contacts=False, on_frame=None,
+                  physicsClientId=None, delta=False, epsilon=DEFAULT_EPSILON,
+                  keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, quantize=False,
+                  position_range=DEFAULT_POSITION_RANGE):
+        """Have the server push the state of some bodies instead of polling for it.
+
+        After each step (and each request) in the world the server sends a
+        frame with the bodies' base poses and, optionally, joint states and
+        contact counts, at most `rate` times per second. Returns a
+        StateSubscription; its `latest` frame is updated as frames are read,
+        which happens while this client waits for replies and in poll().
+        If frames arrive faster than they are read, older ones are skipped.
+        Needs a binary codec and the socket transport (shared_memory=False).
+
+        With `delta` the server sends a full keyframe every
+        `keyframe_interval` frames and otherwise only what moved by more
+        than `epsilon`; `quantize` also packs poses into 16 bits, positions
+        within +-`position_range` metres (see remote_delta.FrameEncoder).
+        Frames are rebuilt here into full NumPy arrays, so this needs NumPy.
+        """
+        self._require_binary_codec("State subscriptions")
+        if not isinstance(self.transport, SocketTransport):
+            raise RuntimeError("State subscriptions need the socket transport; connect with shared_memory=False")
+        encoding = self._stream_encoding(delta, epsilon, keyframe_interval, quantize, position_range)
+        # Frames are tagged with an id no request will ever use
+        subscription = StateSubscription(next(self._request_ids), on_frame, delta)
+        self._streams[subscription.stream_id] = subscription._receive
+        try:
+            subscription.layout = self.call("subscribe_state", subscription.stream_id, list(body_ids), rate,
+                                            joint_states, contacts, physicsClientId, encoding)
+        except BaseException:
+            self._streams.pop(subscription.stream_id, None)
+            raise
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop a subscription; frames still on their way are dropped"""
+        self._streams.pop(subscription.stream_id, None)
+        return self.call("unsubscribe_state", subscription.stream_id)
+
+    def subscription_stats(self):
+        """Frames published, sent and conflated on the server, by subscription"""
+        return self.call("subscription_stats")
+
+    def poll(self, timeout=0.0):
+        """Read frames that have arrived, waiting up to `timeout` seconds for the first.
+
+        Pushed subscription frames are only read while the client is
+        reading anyway, so a loop that does not otherwise talk to the
+        server calls this to stay current. Returns whether anything was read.
+        """
+        if not isinstance(self.transport, SocketTransport):
+            return False
+        read = False
+        while select.select([self.socket], [], [], timeout)[0]:
+            self._read_reply()
+            read = True
+            timeout = 0.0
+        return read
+
+    def create_world(self, select=True):
+        """Start a new isolated world on the server and return its id.
+
+        Each world has its own physics client and shared variables. With
+        `select` this client's requests go to the new world from now on;
+        set `world` to switch between worlds. Worlds left idle for the
+        server's idle timeout are evicted.
+        """
+        # int() also covers the text codec, where results arrive as repr() text
+        world_id = int(self.call("create_world"))
+        if select:
+            self.world = world_id
+        return world_id
+
+    def destroy_world(self, world_id=None):
+        """Destroy a world (by default the selected one) and free its physics client"""
+        if world_id is None:
+            world_id = self.world
+        result = self.call("destroy_world", world_id)
+        self._forget_synced(world_id)
+        if world_id == self.world:
+            self.world = None
+        return result
+
+    def list_worlds(self):
+        """Describe every world on the server"""
+        return self.call("list_worlds")
+
+    def save_snapshot(self, name):
+        """Snapshot the world's physics state and shared variables on the server.
+
+        Returns the snapshot's size in bytes. Snapshots live in a
+        byte-budgeted LRU on the server, optionally spilling to disk.
+        """
+        return self.call("save_snapshot", name)
+
+    def restore_snapshot(self, name, sync=True):
+        """Return the world to a snapshot in one call, e.g. to reset an episode.
+
+        The bodies in the scene must be the ones that existed when the
+        snapshot was taken. With `sync` the restored shared variables are
+        sent back and copied into this client's namespace (binary codecs
+        only); without it only the physics state and server side change,
+        and the server keeps its restored values until the client assigns
+        those variables again.
+        """
+        restored = self.call("restore_snapshot", name, return_variables=self._restore_request(sync))
+        self._restored(restored)
+        return True
+
+    def drop_snapshot(self, name):
+        """Delete a snapshot on the server"""
+        return self.call("drop_snapshot", name)
+
+    def list_snapshots(self):
+        """The world's snapshot names and the server's snapshot cache statistics"""
+        return self.call("list_snapshots")
+
+    def call_handle(self, name, /, *args, **kwargs):
+        """Call a remote function but keep its result on the server; returns a RemoteHandle.
+
+        Useful for large results such as getCameraImage's pixel buffers or
+        long contact lists: attributes, slices and method calls on the
+        handle run on the server and only send back what they produce, and
+        fetch() transfers the whole value. The server keeps handles within a
+        byte budget, evicting the least recently used. Needs a binary codec.
+        """
+        self._require_binary_codec("Remote handles")
+        return RemoteHandle(self, self.call("make_handle", name, args, kwargs))
+
+    def retain_handle(self, handle_id):
+        """A new reference to a handle by id, e.g. one created by another client"""
+        self._require_binary_codec("Remote handles")
+        return RemoteHandle(self, self.call("retain_handle", handle_id))
+
+    def handle_stats(self):
+        """Number and total size of the results the server holds for handles"""
+        return self.call("handle_stats")
+
+    def make_vec_env(self, source, num_envs, num_workers=None):
+        """Start `num_envs` copies of an environment on the server's worker processes; returns its id.
+
+        `source` is a script (text or list of lines) defining reset(), which
+        returns an observation, and step(action), which returns
+        (observation, reward, done). Each copy gets FUN bound to its own
+        physics client and ENV_INDEX set to its position. The copies are
+        spread over `num_workers` processes, by default one per core.
+        """
+        if not isinstance(source, str):
+            source = "\n".join(line.rstrip("\n") for line in source)
+        return self.call("make_vec_env", source, num_envs, num_workers)
+
+    def reset_all(self, env_id):
+        """Reset every copy and return their observations, one row per copy.
+
+        The rows arrive as a NumPy array on clients created with
+        arrays=True, and as nested lists otherwise.
+        """
+        return self.call("reset_all", env_id)
+
+    def step_all(self, env_id, actions):
+        """Step every copy with its row of `actions`.
+
+        Returns (observations, rewards, dones) with one row per copy: NumPy
+        arrays on clients created with arrays=True, lists otherwise. Copies
+        whose episode ended are reset straight away.
+        """
+        return self.call("step_all", env_id, actions)
+
+    def close_vec_env(self, env_id):
+        """Stop the worker processes of a vectorized environment"""
+        return self.call("close_vec_env", env_id)
+
+    def start_realtime(self, rate=240.0, physicsClientId=None, set_time_step=True):
+        """Have the server step the simulation itself at `rate` Hz.
+
+        Steps follow a wall-clock schedule on the server, so round-trip
+        jitter no longer leaks into simulated time. Commands sent meanwhile
+        run between steps.
+        """
+        return self.call("start_realtime", rate, physicsClientId, set_time_step)
+
+    def stop_realtime(self):
+        """Stop server-side stepping and return its final statistics"""
+        return self.call("stop_realtime")
+
+    def realtime_stats(self):
+        """Steps taken, achieved rate, overruns and lateness of server-side stepping"""
+        return self.call("realtime_stats")
+
+    def submit_remote_function(self, remote_call_str):
+        """Send a remote call without waiting for it; returns a PendingCall.
+
+        Many calls can be in flight on the connection at once. Replies are
+        matched by request id, so they may be collected in any order.
+        Pure functions such as getQuaternionFromEuler are evaluated on the
+        client instead and come back already resolved.
+        """
+        answered, result = self._evaluate_source_locally(remote_call_str)
+        if answered:
+            return ResolvedCall(result, remote_call_str)
+        payload, flags = self._encode_request(remote_call_str)
+        self._push_variables(self._variables_read_by(remote_call_str, flags & FLAG_CALL))
+        self._note_writes_by(remote_call_str)
+        if self.LOGGING:
+            call_log.debug("Sending: %s", remote_call_str)
+        request_id = self._send(payload, flags)
+        return PendingCall(self, request_id, remote_call_str)
+
+    def submit_call(self, name, /, *args, **kwargs):
+        """Send a call to a remote function by name without waiting; returns a PendingCall.
+
+        `name` is a pybullet function name such as "getQuaternionFromEuler",
+        or "set_shared_variable"/"get_shared_variable". With a binary codec
+        the server looks the function up in a table and calls it directly.
+        """
+        answered, result = self._evaluate_locally(name, args, kwargs)
+        if answered:
+            return ResolvedCall(result, name)
+        self._push_variables(self._variables_read_by_call(name, args))
+        self._note_writes_by_call(name, args)
+        payload, flags, label = self._encode_call(name, args, kwargs)
+        if self.LOGGING:
+            call_log.debug("Sending: %s", label)
+        return PendingCall(self, self._send(payload, flags), label)
+
+    def call(self, name, /, *args, **kwargs):
+        """Call a remote function by name and return the result; see submit_call"""
+        return self.submit_call(name, *args, **kwargs).result()
+
+    def execute_remote_function(self, remote_call_str):
+        """Execute a remote function and return the result.
+
+        With the text codec the result is the repr() string sent by the server;
+        with a binary codec it is the decoded Python value.
+        """
+        return self.submit_remote_function(remote_call_str).result()
+
+    def execute_remote_functions(self, remote_call_strs):
+        """Pipeline several remote calls and return their results in order.
+
+        All calls are sent before any reply is awaited, so the cost is about
+        one round trip plus server execution time rather than one round trip
+        per call. A failing call raises after the replies of the calls before
+        it have been collected.
+        """
+        pending = [self.submit_remote_function(call) for call in remote_call_strs]
+        try:
+            return [call.result() for call in pending]
+        finally:
+            # Drain the remaining replies so they do not linger in the pipeline,
+            # without letting a failure here replace the error being raised
+            for call in pending:
+                if call.request_id in self._in_flight or call.request_id in self._completed:
+                    with contextlib.suppress(Exception):
+                        self._wait_for(call.request_id)
+
+    def call_batch(self, remote_call_strs, return_exceptions=False):
+        """Run several remote calls in one round trip and return their results in order.
+
+        Each call is a `FUN.*` string or a call to one of SERVER_FUNCTIONS,
+        such as `get_shared_variable(...)`. The server runs them in order with
+        no other client's calls in between. A failed call raises ConnectionAbortedError, or with
+        return_exceptions=True the exception is put in its slot instead.
+        """
+        calls = list(remote_call_strs)
+        self._push_variables(self._variables_read_by_batch(calls))
+        for call in calls:
+            self._note_writes_by(call)
+        flags, payload = self._roundtrip(self._encode_batch(calls), FLAG_BATCH)
+        return self._decode_batch(calls, flags, payload, return_exceptions)
+
+    def run_script(self, source, export=(), on_output=None):
+        """Upload a script, run it on the server and return its final value.
+
+        `source` is the script text or a list of lines. The server compiles
+        it once and runs it next to the engine, so a loop of a thousand
+        steps costs one round trip instead of one per call. The script can
+        use FUN and the shared variables, and call emit(value) to send back
+        intermediate results. Its print() output and emitted values are
+        passed to on_output(kind, value) as they arrive, with kind "stdout"
+        or "result"; by default output is echoed locally. The return value
+        is that of the script's last line if it is an expression. Names in
+        `export` are copied into the shared variable store afterwards.
+        """
+        source = self._script_text(source)
+        self._push_variables(free_names(source, "exec"))
+        self._note_script_writes(source, export)
+        request_id = self._send(self._encode_script(source, export), FLAG_SCRIPT)
+        self._streams[request_id] = on_output or self._print_output
+        try:
+            flags, payload = self._wait_for(request_id)
+        finally:
+            self._streams.pop(request_id, None)
+        return self._decode_reply(flags, payload)
+
     def substitute_remote_functions(self, command):
         """Substitute remote function calls with their results"""
         while True:
@@ -92,64 +1085,75 @@ class RemoteClient:
 
             call_to_process = current_calls[0]
             try:
-                result_str = self.execute_remote_function(call_to_process)
-                command = command.replace(call_to_process, result_str.strip(), 1)
+                result = self.execute_remote_function(call_to_process)
+                replacement = self._substitution_for(result, self._placeholders)
+                command = command.replace(call_to_process, replacement, 1)
             except (SyntaxError, ConnectionAbortedError):
                 raise
 
         return command
 
+    def sync_variable(self, var_name, value):
+        """Mirror a client variable to the server's shared variables, sending only what changed"""
+        request = self._sync_request(var_name, value)
+        if request is not None:
+            payload, flags, plan = request
+            try:
+                version = self._decode_reply(*self._roundtrip(payload, flags))
+            except ConnectionAbortedError:
+                if not plan[1]:
+                    raise
+                # The server's copy is not the one the delta was made against: send it whole
+                payload, flags, plan = self._sync_request(var_name, value, full=True)
+                version = self._decode_reply(*self._roundtrip(payload, flags))
+            self._finish_sync(plan, version)
+        self._mark_clean(var_name)
+
+    def _push_variables(self, names):
+        """Sync the variables among `names` that the selected world does not have yet.
+
+        A variable that fails to sync is logged and left dirty, so the
+        request that reads it still goes out and reports its own error.
+        """
+        for var_name in self._stale_variables(names):
+            try:
+                self.sync_variable(var_name, self.local_namespace[var_name])
+            except ConnectionAbortedError as e_sync:
+                log.error("Server error during sync of '%s': %s", var_name, e_sync)
+
+    def flush(self):
+        """Push every assigned variable the selected world does not have the current value of"""
+        self._push_variables(list(self._clean))
+
     def execute_line(self, line, idx=1):
         """Execute a single line of code"""
         stripped_line = line.strip()
         if not stripped_line or stripped_line.startswith("#"):
             return
 
+        command_after_subs = None
         try:
             if self.LOGGING:
-                print(f"\n[Line {idx}] Original: {stripped_line}")
+                call_log.debug("[Line %d] Original: %s", idx, stripped_line)
 
             command_after_subs = self.substitute_remote_functions(stripped_line)
             if self.LOGGING:
-                print(f"[Line {idx}] Substituted: {command_after_subs}")
-
-            if '=' in command_after_subs and command_after_subs.count('=') == 1:
-                parts = command_after_subs.split('=', 1)
-                var_name = parts[0].strip()
-                expression_str_to_eval = parts[1].strip()
+                call_log.debug("[Line %d] Substituted: %s", idx, command_after_subs)
 
-                evaluated_rhs = eval(expression_str_to_eval, globals(), self.local_namespace)
-                self.local_namespace[var_name] = evaluated_rhs
-                if self.LOGGING:
-                    print(f"[Line {idx}] Client var set: {var_name} = {evaluated_rhs!r}")
-
-                server_set_command = f"set_shared_variable('{var_name}', {repr(evaluated_rhs)})"
-                if self.LOGGING:
-                    print(f"[Line {idx}] Syncing to server: {server_set_command}")
+            sync = self._evaluate_line(command_after_subs, idx)
+            if sync is not None:
+                var_name, value = sync
+                self._mark_dirty(var_name)
                 try:
-                    self.execute_remote_function(server_set_command)
+                    if not self.lazy_sync:
+                        self.sync_variable(var_name, value)
                 except ConnectionAbortedError as e_sync:
-                    if self.LOGGING:
-                        print(f"[Line {idx}] Server error during sync of '{var_name}': {e_sync}")
-            else:
-                try:
-                    result = eval(command_after_subs, globals(), self.local_namespace)
-                    if self.LOGGING and result is not None:
-                        print(f"[Line {idx}] Client eval result: {result!r}")
-                except SyntaxError:
-                    exec(command_after_subs, globals(), self.local_namespace)
-                    if self.LOGGING:
-                        print(f"[Line {idx}] Client executed as statement.")
-
-        except ConnectionAbortedError as e_server:
-            if self.LOGGING:
-                print(f"[Line {idx}] SERVER EXECUTION FAILED for line: {stripped_line}")
-                print(f"  Error details: {e_server}")
-        except Exception as e_client:
-            if self.LOGGING:
-                print(f"[Line {idx}] Client error processing line: {e_client}")
-                print(f"  Original line: {stripped_line}")
-                print(f"  Line after substitutions (if any): {command_after_subs if 'command_after_subs' in locals() else 'N/A'}")
+                    log.error("[Line %d] Server error during sync of '%s': %s", idx, var_name, e_sync)
+
+        except Exception as e:
+            self._report_line_error(e, idx, stripped_line, command_after_subs)
+        finally:
+            self._release_placeholders(self._placeholders)
 
     def execute_script(self, lines):
         """Execute multiple lines of code"""
@@ -172,7 +1176,7 @@ def main():
         script_lines = f.readlines()
 
     # Create client and execute script
-    client = RemoteClient()
+    client = RemoteClient(logging=True)
     try:
         if client.connect():
             client.execute_script(script_lines)
@@ -0,0 +1,202 @@
+# remote_code_cache.py
+import ast
+import functools
+import re
+from collections import OrderedDict
+
+DEFAULT_CODE_CACHE_SIZE = 1024
+DEFAULT_SCRIPT_CACHE_SIZE = 64
+
+# Names the lifted literals are bound to while a parameterized command runs
+LITERAL_NAME_PREFIX = "__remote_literal_"
+
+# Quick guess at the string and number literals of a command. It cannot see
+# context: digits and quotes inside f-strings or prefixed strings, or the
+# parts of implicitly concatenated strings, look like literals too. So each
+# template it makes is checked against the parser once (see CodeCache).
+_LITERAL = re.compile(r"""
+    (?<![\w.])
+    (?:
+        '(?:[^'\\\n]|\\.)*'
+      | "(?:[^"\\\n]|\\.)*"
+      | 0[xXoObB][0-9a-fA-F_]+
+      | (?:\d[\d_]*(?:\.[\d_]*)?|\.\d[\d_]*)(?:[eE][+-]?\d+)?[jJ]?
+    )
+    (?![\w'"])
+""", re.VERBOSE)
+
+# Literal types the parser-based templates lift out
+_LIFTED_TYPES = (str, bytes, int, float, complex)
+
+# Marks a template that does not compile, so its commands are cached as written
+_UNPARAMETERIZED = object()
+# Marks a quick template that misreads its commands, so they are templated with the parser
+_MISREAD = object()
+
+
+@functools.lru_cache(maxsize=4096)
+def _literal_value(token):
+    # Literal values are immutable, so one parsed value can be shared by every call
+    return ast.literal_eval(token)
+
+
+def _literals(tree):
+    """String and number constants of an expression, in source order.
+
+    Each constant is a whole literal as the parser saw it, prefixes and
+    implicit concatenation included. f-strings are left alone, since the
+    text and numbers inside them are not expressions of their own.
+    """
+    found = []
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, ast.JoinedStr):
+            continue
+        if isinstance(node, ast.Constant):
+            if type(node.value) in _LIFTED_TYPES:
+                found.append(node)
+            continue
+        stack.extend(ast.iter_child_nodes(node))
+    found.sort(key=lambda node: (node.lineno, node.col_offset))
+    return found
+
+
+def _same_values(first, second):
+    # 1, 1.0 and True are equal but not interchangeable
+    return len(first) == len(second) and all(
+        type(a) is type(b) and a == b for a, b in zip(first, second))
+
+
+class CodeCache:
+    """Bounded LRU cache of compiled command code objects.
+
+    Keyed by command text. With `parameterize`, string and number literals
+    are first lifted out into names, so commands that differ only in their
+    literal arguments (joint indices, target positions) share one compiled
+    template and the literals are bound when it runs. Commands the template
+    form cannot compile fall back to being cached by their exact text.
+
+    Templates come from a regular expression, which is fast but can
+    mistake text inside f-strings, prefixed strings and concatenated
+    strings for literals. The first command of each template is also
+    templated with the parser; if the two disagree, commands with that
+    template are always templated with the parser.
+    """
+
+    def __init__(self, maxsize=DEFAULT_CODE_CACHE_SIZE, parameterize=True):
+        self.maxsize = maxsize
+        self.parameterize = parameterize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def _quick_template(self, command_str):
+        literals = []
+
+        def lift(match):
+            literals.append(match.group())
+            return f"{LITERAL_NAME_PREFIX}{len(literals) - 1}"
+
+        template = _LITERAL.sub(lift, command_str)
+        try:
+            return template, [_literal_value(token) for token in literals]
+        except (SyntaxError, ValueError):
+            return template, None
+
+    def _template(self, command_str):
+        """(template, literal values) of a command; (command, []) when it does not parse"""
+        try:
+            tree = ast.parse(command_str, mode="eval")
+        except (SyntaxError, ValueError):
+            return command_str, []
+        nodes = _literals(tree)
+        if not nodes:
+            return command_str, []
+        # Node offsets count UTF-8 bytes from the start of their line
+        source = command_str.encode("utf-8")
+        line_starts = [0]
+        for line in source.splitlines(keepends=True):
+            line_starts.append(line_starts[-1] + len(line))
+        parts = []
+        end = 0
+        for index, node in enumerate(nodes):
+            start = line_starts[node.lineno - 1] + node.col_offset
+            parts.append(source[end:start])
+            parts.append(f"{LITERAL_NAME_PREFIX}{index}".encode("ascii"))
+            end = line_starts[node.end_lineno - 1] + node.end_col_offset
+        parts.append(source[end:])
+        return b"".join(parts).decode("utf-8"), [node.value for node in nodes]
+
+    def _lookup(self, key, source):
+        code = self._entries.get(key)
+        if code is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return code
+        self.misses += 1
+        code = self._compile(source)
+        self._store(key, code)
+        return code
+
+    def _compile(self, source):
+        return compile(source, "<remote>", "eval")
+
+    def _store(self, key, value):
+        if self.maxsize > 0:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def lookup(self, command_str):
+        """Return (code, literal bindings) for an eval()-able command"""
+        if self.parameterize:
+            template, values = self._quick_template(command_str)
+            if values != []:
+                checked = self._entries.get((None, template))
+                if checked is None:
+                    parsed = self._template(command_str)
+                    misread = values is None or parsed[0] != template or not _same_values(parsed[1], values)
+                    self._store((None, template), _MISREAD if misread else True)
+                    if misread:
+                        template, values = parsed
+                else:
+                    self._entries.move_to_end((None, template))
+                    if checked is _MISREAD:
+                        template, values = self._template(command_str)
+            if values and self._entries.get((True, template)) is not _UNPARAMETERIZED:
+                try:
+                    code = self._lookup((True, template), template)
+                    bindings = {f"{LITERAL_NAME_PREFIX}{i}": value for i, value in enumerate(values)}
+                    return code, bindings
+                except (SyntaxError, ValueError):
+                    # Cache the command as written instead
+                    self._store((True, template), _UNPARAMETERIZED)
+        return self._lookup((False, command_str), command_str), {}
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries),
+                "maxsize": self.maxsize, "parameterize": self.parameterize}
+
+
+class ScriptCache(CodeCache):
+    """Bounded LRU cache of compiled scripts, keyed by their source.
+
+    Entries are (body, tail) code objects: when a script ends with an
+    expression, the tail evaluates it so its value can be returned, like
+    the last line in an interactive session; otherwise tail is None.
+    """
+
+    def __init__(self, maxsize=DEFAULT_SCRIPT_CACHE_SIZE):
+        super().__init__(maxsize, parameterize=False)
+
+    def _compile(self, source):
+        tree = ast.parse(source, "<remote script>", "exec")
+        tail = None
+        if tree.body and isinstance(tree.body[-1], ast.Expr):
+            tail = compile(ast.Expression(tree.body.pop().value), "<remote script>", "eval")
+        return compile(tree, "<remote script>", "exec"), tail
@@ -0,0 +1,352 @@
+# remote_codec.py
+import struct
+import pickle
+from array import array
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; array transport is disabled without it
+    np = None
+
+
+class CodecError(ValueError):
+    """Raised when a payload cannot be encoded or decoded"""
+
+
+class TextCodec:
+    """Original wire format: values travel as their repr() text"""
+    name = "text"
+
+    def encode(self, value):
+        if np is not None:
+            # repr() of a large ndarray elides elements, so send plain lists instead
+            value = _arrays_to_lists(value)
+        return repr(value).encode('utf-8')
+
+    def decode(self, payload):
+        # Text payloads are handed back as-is; callers decide how to parse them
+        return bytes(payload).decode('utf-8')
+
+
+class PickleCodec:
+    """Pickle protocol 5. Only use this between trusted peers.
+
+    With `arrays=False` (a peer that did not negotiate arrays) NumPy arrays
+    and scalars are sent as nested lists and plain numbers, so the peer
+    can unpickle them without NumPy.
+    """
+    name = "pickle"
+
+    def __init__(self, arrays=True):
+        self.arrays = arrays
+
+    def encode(self, value):
+        if np is not None and not self.arrays:
+            value = _arrays_to_lists(value)
+        return pickle.dumps(value, protocol=5)
+
+    def decode(self, payload):
+        return pickle.loads(payload)
+
+
+# Tags for the compact tagged format
+_NONE = b'N'
+_TRUE = b'T'
+_FALSE = b'F'
+_INT = b'i'
+_BIGINT = b'I'
+_FLOAT = b'd'
+_STR = b's'
+_BYTES = b'b'
+_LIST = b'l'
+_TUPLE = b't'
+_DICT = b'm'
+# Homogeneous numeric sequences are packed as raw machine arrays
+_FLOAT_LIST = b'D'
+_FLOAT_TUPLE = b'E'
+_INT_LIST = b'Q'
+_INT_TUPLE = b'R'
+# NumPy array: dtype, shape and a raw C-contiguous buffer aligned to 8 bytes
+_NDARRAY = b'A'
+_ARRAY_ALIGNMENT = 8
+
+_U32 = struct.Struct("!I")
+_I64 = struct.Struct("!q")
+_F64 = struct.Struct("!d")
+_U64 = struct.Struct("!Q")
+_INT64_MIN = -(1 << 63)
+_INT64_MAX = (1 << 63) - 1
+_LITTLE_ENDIAN = array('H', [1]).tobytes() == b'\x01\x00'
+
+
+class TaggedCodec:
+    """Compact binary format: a one-byte type tag followed by the value.
+
+    Numeric lists and tuples (joint states, poses, pixel buffers) are packed
+    as contiguous little-endian float64/int64 arrays instead of element by
+    element. NumPy arrays travel as their raw buffer and are decoded as
+    arrays viewing the received payload, without a copy; with
+    `arrays=False` (a peer that did not negotiate arrays) they are sent as
+    nested lists instead.
+    """
+    name = "tagged"
+
+    def __init__(self, arrays=True):
+        self.arrays = arrays
+
+    def encode(self, value):
+        out = bytearray()
+        self._encode(value, out)
+        return out
+
+    def decode(self, payload):
+        view = memoryview(payload)
+        value, offset = self._decode(view, 0)
+        if offset != len(view):
+            raise CodecError(f"{len(view) - offset} trailing bytes after tagged value")
+        return value
+
+    def _encode(self, value, out):
+        kind = type(value)
+        if value is None:
+            out += _NONE
+        elif kind is bool:
+            out += _TRUE if value else _FALSE
+        elif kind is int:
+            if _INT64_MIN <= value <= _INT64_MAX:
+                out += _INT
+                out += _I64.pack(value)
+            else:
+                raw = value.to_bytes((value.bit_length() + 8) // 8, 'big', signed=True)
+                out += _BIGINT
+                out += _U32.pack(len(raw))
+                out += raw
+        elif kind is float:
+            out += _FLOAT
+            out += _F64.pack(value)
+        elif kind is str:
+            raw = value.encode('utf-8')
+            out += _STR
+            out += _U32.pack(len(raw))
+            out += raw
+        elif kind in (bytes, bytearray, memoryview):
+            raw = bytes(value)
+            out += _BYTES
+            out += _U32.pack(len(raw))
+            out += raw
+        elif kind is list or kind is tuple:
+            if not self._encode_numeric(value, kind is list, out):
+                out += _LIST if kind is list else _TUPLE
+                out += _U32.pack(len(value))
+                for item in value:
+                    self._encode(item, out)
+        elif np is not None and kind is np.ndarray:
+            if self.arrays:
+                self._encode_ndarray(value, out)
+            else:
+                self._encode(value.tolist(), out)
+        elif np is not None and isinstance(value, np.generic):
+            self._encode(value.item(), out)
+        elif kind is dict:
+            out += _DICT
+            out += _U32.pack(len(value))
+            for key, item in value.items():
+                self._encode(key, out)
+                self._encode(item, out)
+        else:
+            raise CodecError(f"Cannot encode value of type {kind.__name__}")
+
+    def _encode_numeric(self, value, is_list, out):
+        """Pack a non-empty sequence of only floats or only ints as a raw array"""
+        if len(value) < 2:
+            return False
+        first = type(value[0])
+        if first is float and all(type(x) is float for x in value):
+            packed = array('d', value)
+            tag = _FLOAT_LIST if is_list else _FLOAT_TUPLE
+        elif first is int and all(type(x) is int for x in value):
+            try:
+                packed = array('q', value)
+            except OverflowError:
+                return False
+            tag = _INT_LIST if is_list else _INT_TUPLE
+        else:
+            return False
+        if not _LITTLE_ENDIAN:
+            packed.byteswap()
+        out += tag
+        out += _U32.pack(len(value))
+        out += packed.tobytes()
+        return True
+
+    def _encode_ndarray(self, value, out):
+        if value.dtype.hasobject:
+            raise CodecError("Cannot encode NumPy arrays of Python objects")
+        if not value.flags.c_contiguous:
+            value = value.copy(order='C')
+        dtype = value.dtype.str.encode('ascii')
+        out += _NDARRAY
+        out += bytes((len(dtype),))
+        out += dtype
+        out += bytes((value.ndim,))
+        for dim in value.shape:
+            out += _U64.pack(dim)
+        out += _U64.pack(value.nbytes)
+        # Pad so the data starts aligned relative to the start of the payload
+        pad = -(len(out) + 1) % _ARRAY_ALIGNMENT
+        out += bytes((pad,))
+        out += bytes(pad)
+        out += memoryview(value.reshape(-1)).cast('B')
+
+    def _decode_ndarray(self, view, offset):
+        if np is None:
+            raise CodecError("Received a NumPy array but NumPy is not installed")
+        dtype_len = view[offset]
+        dtype = np.dtype(bytes(view[offset + 1:offset + 1 + dtype_len]).decode('ascii'))
+        offset += 1 + dtype_len
+        ndim = view[offset]
+        offset += 1
+        shape = tuple(_U64.unpack_from(view, offset + 8 * i)[0] for i in range(ndim))
+        offset += 8 * ndim
+        nbytes = _U64.unpack_from(view, offset)[0]
+        offset += 8
+        offset += 1 + view[offset]
+        end = offset + nbytes
+        if end > len(view):
+            raise CodecError("Truncated tagged array")
+        # frombuffer shares memory with the received payload instead of copying it
+        array_value = np.frombuffer(view, dtype=dtype, count=nbytes // dtype.itemsize, offset=offset)
+        return array_value.reshape(shape), end
+
+    def _decode(self, view, offset):
+        try:
+            tag = bytes(view[offset:offset + 1])
+            offset += 1
+            if tag == _NONE:
+                return None, offset
+            if tag == _TRUE:
+                return True, offset
+            if tag == _FALSE:
+                return False, offset
+            if tag == _INT:
+                return _I64.unpack_from(view, offset)[0], offset + 8
+            if tag == _FLOAT:
+                return _F64.unpack_from(view, offset)[0], offset + 8
+            if tag in (_STR, _BYTES, _BIGINT):
+                size = _U32.unpack_from(view, offset)[0]
+                offset += 4
+                raw = bytes(view[offset:offset + size])
+                if len(raw) != size:
+                    raise CodecError("Truncated tagged value")
+                offset += size
+                if tag == _STR:
+                    return raw.decode('utf-8'), offset
+                if tag == _BIGINT:
+                    return int.from_bytes(raw, 'big', signed=True), offset
+                return raw, offset
+            if tag in (_FLOAT_LIST, _FLOAT_TUPLE, _INT_LIST, _INT_TUPLE):
+                count = _U32.unpack_from(view, offset)[0]
+                offset += 4
+                packed = array('d' if tag in (_FLOAT_LIST, _FLOAT_TUPLE) else 'q')
+                end = offset + count * packed.itemsize
+                if end > len(view):
+                    raise CodecError("Truncated tagged array")
+                packed.frombytes(view[offset:end])
+                if not _LITTLE_ENDIAN:
+                    packed.byteswap()
+                items = packed.tolist()
+                return (items if tag in (_FLOAT_LIST, _INT_LIST) else tuple(items)), end
+            if tag in (_LIST, _TUPLE):
+                count = _U32.unpack_from(view, offset)[0]
+                offset += 4
+                items = []
+                for _ in range(count):
+                    item, offset = self._decode(view, offset)
+                    items.append(item)
+                return (items if tag == _LIST else tuple(items)), offset
+            if tag == _DICT:
+                count = _U32.unpack_from(view, offset)[0]
+                offset += 4
+                result = {}
+                for _ in range(count):
+                    key, offset = self._decode(view, offset)
+                    result[key], offset = self._decode(view, offset)
+                return result, offset
+            if tag == _NDARRAY:
+                return self._decode_ndarray(view, offset)
+        except (struct.error, IndexError) as e:
+            raise CodecError(f"Truncated tagged value: {e}") from None
+        raise CodecError(f"Unknown tag {tag!r} at offset {offset - 1}")
+
+
+# Smallest number of elements worth shipping as a raw array buffer
+ARRAY_MIN_SIZE = 16
+
+
+def pack_arrays(value):
+    """Convert array-shaped numeric lists and tuples inside a result to NumPy arrays.
+
+    Flat or rectangular sequences of numbers with at least ARRAY_MIN_SIZE
+    elements (pixel lists, depth buffers, Jacobians) become arrays; anything
+    else is walked recursively and left as is. Integer arrays are stored in
+    the smallest dtype that holds their range.
+    """
+    if np is None:
+        return value
+    kind = type(value)
+    if kind is not list and kind is not tuple:
+        return value
+    try:
+        candidate = np.asarray(value)
+    except ValueError:  # ragged nesting
+        candidate = None
+    if candidate is not None and candidate.dtype.kind in 'iuf' and candidate.size >= ARRAY_MIN_SIZE:
+        if candidate.dtype.kind in 'iu':
+            smallest = np.result_type(np.min_scalar_type(candidate.min()),
+                                      np.min_scalar_type(candidate.max()))
+            candidate = candidate.astype(smallest, copy=False)
+        return candidate
+    packed = [pack_arrays(item) for item in value]
+    return packed if kind is list else tuple(packed)
+
+
+def _arrays_to_lists(value):
+    if np is not None and isinstance(value, (np.ndarray, np.generic)):
+        return value.tolist()
+    if type(value) is tuple:
+        return tuple(_arrays_to_lists(item) for item in value)
+    if type(value) is list:
+        return [_arrays_to_lists(item) for item in value]
+    if type(value) is dict:
+        return {key: _arrays_to_lists(item) for key, item in value.items()}
+    return value
+
+
+CODECS = {
+    TextCodec.name: TextCodec(),
+    TaggedCodec.name: TaggedCodec(),
+    PickleCodec.name: PickleCodec(),
+}
+DEFAULT_CODEC = CODECS[TextCodec.name]
+# Binary codecs for peers that did not negotiate arrays
+_TAGGED_LISTS = TaggedCodec(arrays=False)
+_PICKLE_LISTS = PickleCodec(arrays=False)
+
+
+def negotiate_codec(offered):
+    """Pick the first codec the peer offered that we also support"""
+    for name in offered:
+        if name in CODECS:
+            return CODECS[name]
+    return DEFAULT_CODEC
+
+
+def codec_for_peer(codec, arrays):
+    """The codec to talk to a peer with, given whether it negotiated NumPy arrays"""
+    if arrays:
+        return codec
+    if codec is CODECS[TaggedCodec.name]:
+        return _TAGGED_LISTS
+    if codec is CODECS[PickleCodec.name]:
+        return _PICKLE_LISTS
+    return codec
@@ -0,0 +1,158 @@
+# remote_delta.py
+from remote_codec import np
+
+# Pose and joint changes no larger than this are not sent
+DEFAULT_EPSILON = 1e-4
+# Every this many frames the full state is sent, whatever changed
+DEFAULT_KEYFRAME_INTERVAL = 240
+# Quantized positions cover -range..+range metres in 16 bits (about 1 mm steps)
+DEFAULT_POSITION_RANGE = 32.0
+
+INT16_MAX = 32767
+# Quaternion components are in -1..1
+ORIENTATION_SCALE = 1.0 / INT16_MAX
+# Per-body pose fields, and per-joint/per-body fields diffed element by element
+POSE_FIELDS = ("base_positions", "base_orientations")
+ELEMENT_FIELDS = ("joint_positions", "joint_velocities", "joint_torques", "contact_counts")
+
+
+def _quantize(values, scale):
+    """(int16 array, scale), or (values, None) when a value is out of range"""
+    quantized = np.rint(values / scale)
+    if quantized.size and np.abs(quantized).max() > INT16_MAX:
+        return values, None
+    return quantized.astype(np.int16), scale
+
+
+def _dequantize(values, scale):
+    values = np.asarray(values)
+    if scale is None:
+        return values.astype(np.float64, copy=False)
+    return values * scale
+
+
+class FrameEncoder:
+    """Turns observation frames into keyframes and deltas for one subscriber.
+
+    A keyframe carries the whole state. In between, a frame carries only
+    the bodies whose position or orientation moved by more than `epsilon`
+    in any component, and only the joint and contact entries that changed
+    by more than `epsilon`. Changes are measured against the values the
+    client was last sent, so small drifts add up until they are sent
+    rather than being lost. Every `keyframe_interval` frames (None: only
+    the first) a keyframe is sent again.
+
+    With `quantize`, poses go as 16-bit fixed point: positions in steps of
+    position_range / 32767 metres and quaternion components in steps of
+    1 / 32767. Frames with a position outside +-position_range fall back
+    to floats. A frame is encoded when it is actually written, so frames
+    dropped by conflation never become the base of a delta.
+    """
+
+    def __init__(self, epsilon=DEFAULT_EPSILON, keyframe_interval=DEFAULT_KEYFRAME_INTERVAL, quantize=False,
+                 position_range=DEFAULT_POSITION_RANGE):
+        if np is None:
+            raise RuntimeError("Delta encoding needs NumPy")
+        self.epsilon = epsilon
+        self.keyframe_interval = keyframe_interval
+        self.quantize = quantize
+        self.position_scale = position_range / INT16_MAX
+        self.frames = 0
+        self.keyframes = 0
+        self._reference = None
+        self._since_keyframe = 0
+
+    def _thresholds(self):
+        if not self.quantize:
+            return self.epsilon, self.epsilon
+        # Below one quantization step a body would be resent without visibly moving
+        return max(self.epsilon, self.position_scale), max(self.epsilon, ORIENTATION_SCALE)
+
+    def encode(self, frame):
+        """The encoded form of an observation frame (a dict of arrays plus seq and time)"""
+        positions = np.asarray(frame["base_positions"], dtype=np.float64).reshape(-1, 3)
+        orientations = np.asarray(frame["base_orientations"], dtype=np.float64).reshape(-1, 4)
+        keyframe = (self._reference is None
+                    or (self.keyframe_interval is not None and self._since_keyframe >= self.keyframe_interval))
+        if keyframe:
+            self._reference = {}
+            self._since_keyframe = 0
+            self.keyframes += 1
+            rows = None
+        else:
+            position_epsilon, orientation_epsilon = self._thresholds()
+            moved = ((np.abs(positions - self._reference["base_positions"]) > position_epsilon).any(axis=1)
+                     | (np.abs(orientations - self._reference["base_orientations"]) > orientation_epsilon).any(axis=1))
+            rows = np.flatnonzero(moved).astype(np.int32)
+            positions = positions[rows]
+            orientations = orientations[rows]
+        self._since_keyframe += 1
+        self.frames += 1
+
+        scales = [None, None]
+        if self.quantize:
+            positions, scales[0] = _quantize(positions, self.position_scale)
+            orientations, scales[1] = _quantize(orientations, ORIENTATION_SCALE)
+        encoded = {"seq": frame["seq"], "time": frame["time"], "keyframe": keyframe, "bodies": rows,
+                   "base_positions": positions, "base_orientations": orientations, "scales": scales}
+
+        # Remember what the client will reconstruct, quantization error included
+        for name, values, scale in zip(POSE_FIELDS, (positions, orientations), scales):
+            if keyframe:
+                self._reference[name] = _dequantize(values, scale).copy()
+            else:
+                self._reference[name][rows] = _dequantize(values, scale)
+
+        changes = {}
+        for name in ELEMENT_FIELDS:
+            if name not in frame:
+                continue
+            values = np.asarray(frame[name])
+            if keyframe:
+                self._reference[name] = values.copy()
+                changes[name] = [None, values]
+                continue
+            indices = np.flatnonzero(np.abs(values - self._reference[name]) > self.epsilon).astype(np.int32)
+            self._reference[name][indices] = values[indices]
+            changes[name] = [indices, values[indices]]
+        encoded["changes"] = changes
+        return encoded
+
+    def stats(self):
+        return {"frames": self.frames, "keyframes": self.keyframes}
+
+
+class FrameDecoder:
+    """Rebuilds full observation frames from FrameEncoder output.
+
+    Deltas that arrive before the first keyframe cannot be applied and
+    decode to None.
+    """
+
+    def __init__(self):
+        if np is None:
+            raise RuntimeError("Delta decoding needs NumPy")
+        self._state = None
+
+    def decode(self, encoded):
+        """The full frame, as a dict of NumPy arrays plus seq and time, or None"""
+        if encoded["keyframe"]:
+            self._state = {}
+        elif self._state is None:
+            return None
+        rows = encoded["bodies"]
+        for name, scale in zip(POSE_FIELDS, encoded["scales"]):
+            values = _dequantize(encoded[name], scale)
+            if rows is None:
+                self._state[name] = values.reshape(-1, 3 if name == "base_positions" else 4).copy()
+            elif len(rows):
+                self._state[name][np.asarray(rows)] = values
+        for name, (indices, values) in encoded["changes"].items():
+            if indices is None:
+                self._state[name] = np.array(values)
+            elif len(indices):
+                self._state[name][np.asarray(indices)] = values
+        frame = {name: values.copy() for name, values in self._state.items()}
+        frame["seq"] = encoded["seq"]
+        frame["time"] = encoded["time"]
+        return frame
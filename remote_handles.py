@@ -0,0 +1,271 @@
+# remote_handles.py
+import functools
+import itertools
+import sys
+from collections import Counter, OrderedDict
+
+# Bytes of results the server keeps behind handles before evicting the least recently used
+DEFAULT_HANDLE_BUDGET = 256 << 20
+# Parts of a handle (attributes, slices, method results) up to this size are
+# sent back as values; larger ones become handles of their own
+DEFAULT_INLINE_BYTES = 64 << 10
+
+
+def _shallow_size(value):
+    nbytes = getattr(value, "nbytes", None)  # NumPy arrays
+    if isinstance(nbytes, int):
+        return nbytes
+    if isinstance(value, (bytes, bytearray, memoryview, str)):
+        return len(value)
+    return sys.getsizeof(value)
+
+
+def estimate_size(value):
+    """Rough number of bytes a value would take on the wire.
+
+    Cheap enough to run on every result: arrays and buffers count their
+    length, lists and tuples add up their items one level down, and
+    anything else is its sys.getsizeof().
+    """
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_shallow_size(item) for item in value)
+    return _shallow_size(value)
+
+
+def encode_key(key):
+    """A subscript in a form every binary codec can carry; see decode_key"""
+    if isinstance(key, slice):
+        return {"slice": [key.start, key.stop, key.step]}
+    if key is Ellipsis:
+        return {"ellipsis": None}
+    if isinstance(key, tuple):
+        return tuple(encode_key(part) for part in key)
+    return key
+
+
+def decode_key(key):
+    if isinstance(key, dict):
+        if "slice" in key:
+            return slice(*key["slice"])
+        if "ellipsis" in key:
+            return Ellipsis
+    if isinstance(key, (tuple, list)) and any(isinstance(part, dict) for part in key):
+        return tuple(decode_key(part) for part in key)
+    return key
+
+
+class Handle:
+    """A result held on the server and the owners that hold references to it"""
+    __slots__ = ("value", "nbytes", "owners")
+
+    def __init__(self, value, nbytes):
+        self.value = value
+        self.nbytes = nbytes
+        self.owners = Counter()
+
+
+class HandleTable:
+    """Server-side results that clients refer to by id instead of receiving them.
+
+    Each handle counts references per owner (a client session). It is
+    dropped when the last reference is released, when its owners
+    disconnect, or, once the table holds more than `max_bytes`, when it is
+    the least recently used; referring to an evicted handle is an error.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_HANDLE_BUDGET, inline_bytes=DEFAULT_INLINE_BYTES):
+        self.max_bytes = max_bytes
+        self.inline_bytes = inline_bytes
+        self.bytes = 0
+        self.evictions = 0
+        self._handles = OrderedDict()
+        self._ids = itertools.count(1)
+
+    def add(self, value, owner, nbytes=None):
+        """Hold `value` with one reference from `owner`; returns its descriptor"""
+        if nbytes is None:
+            nbytes = estimate_size(value)
+        handle_id = next(self._ids)
+        handle = Handle(value, nbytes)
+        handle.owners[owner] += 1
+        self._handles[handle_id] = handle
+        self.bytes += nbytes
+        # The handle just made always stays, even if it alone exceeds the budget
+        while self.bytes > self.max_bytes and len(self._handles) > 1:
+            _, old = self._handles.popitem(last=False)
+            self.bytes -= old.nbytes
+            self.evictions += 1
+        return self.describe(handle_id)
+
+    def describe(self, handle_id):
+        """What a client can know about a handle without fetching it"""
+        value = self._handles[handle_id].value
+        info = {"handle": handle_id, "type": type(value).__name__, "nbytes": self._handles[handle_id].nbytes}
+        try:
+            info["len"] = len(value)
+        except TypeError:
+            pass
+        shape = getattr(value, "shape", None)
+        if isinstance(shape, tuple):
+            info["shape"] = shape
+            info["dtype"] = str(getattr(value, "dtype", ""))
+        return info
+
+    def get(self, handle_id):
+        """The value behind a handle; KeyError if it was released or evicted"""
+        handle = self._handles[handle_id]
+        self._handles.move_to_end(handle_id)
+        return handle.value
+
+    def wrap(self, value, owner):
+        """["value", value] for small values, ["handle", descriptor] for large ones"""
+        nbytes = estimate_size(value)
+        if nbytes <= self.inline_bytes:
+            return ["value", value]
+        return ["handle", self.add(value, owner, nbytes)]
+
+    def retain(self, handle_id, owner):
+        self._handles[handle_id].owners[owner] += 1
+
+    def release(self, handle_id, owner):
+        """Drop one of `owner`'s references; returns whether the handle is gone"""
+        handle = self._handles.get(handle_id)
+        if handle is None or not handle.owners[owner]:
+            return handle is None
+        handle.owners[owner] -= 1
+        if +handle.owners:
+            return False
+        self._forget(handle_id)
+        return True
+
+    def release_owner(self, owner):
+        """Drop every reference `owner` holds"""
+        for handle_id in [handle_id for handle_id, handle in self._handles.items() if owner in handle.owners]:
+            handle = self._handles[handle_id]
+            del handle.owners[owner]
+            if not +handle.owners:
+                self._forget(handle_id)
+
+    def _forget(self, handle_id):
+        self.bytes -= self._handles.pop(handle_id).nbytes
+
+    def stats(self):
+        return {"handles": len(self._handles), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "evictions": self.evictions}
+
+
+class HandleBase:
+    """Client-side reference to a result held on the server.
+
+    The descriptor fields are plain attributes: `id`, `type` (the value's
+    type name), `nbytes`, and for arrays `shape` and `dtype`; len() works
+    for sized values. The server's reference is released by release(),
+    when the handle is garbage collected, or when the client disconnects.
+    """
+
+    def __init__(self, client, info):
+        self._client = client
+        self._released = False
+        self.id = info["handle"]
+        self.type = info["type"]
+        self.nbytes = info["nbytes"]
+        self._len = info.get("len")
+        if "shape" in info:
+            self.shape = tuple(info["shape"])
+            self.dtype = info["dtype"]
+
+    def _unwrap(self, reply):
+        kind, value = reply
+        if kind == "handle":
+            return type(self)(self._client, value)
+        return value
+
+    def __len__(self):
+        if self._len is None:
+            raise TypeError(f"Remote {self.type} has no len()")
+        return self._len
+
+    def release(self):
+        """Drop this reference; the server frees the value when no references are left"""
+        if not self._released:
+            self._released = True
+            self._client._release_handle(self.id)
+
+    def __del__(self):
+        try:
+            self.release()
+        except Exception:
+            pass  # half-built handle, or the client is being torn down too
+
+    def __repr__(self):
+        shape = f" shape={self.shape}" if "shape" in self.__dict__ else ""
+        return f"<{type(self).__name__} {self.id}: {self.type}{shape} {self.nbytes} bytes>"
+
+
+class RemoteHandle(HandleBase):
+    """Handle for RemoteClient.
+
+    Attribute access, indexing and slicing, and method calls run on the
+    server; results up to the server's inline size come back as values and
+    larger ones as further handles. fetch() brings the whole value over.
+    """
+
+    def attr(self, name):
+        reply = self._client.call("handle_getattr", self.id, name)
+        if reply[0] == "method":
+            return functools.partial(self.call_method, name)
+        return self._unwrap(reply)
+
+    def item(self, key):
+        return self._unwrap(self._client.call("handle_getitem", self.id, encode_key(key)))
+
+    def call_method(self, name, /, *args, **kwargs):
+        return self._unwrap(self._client.call("handle_call", self.id, name, args, kwargs))
+
+    def fetch(self):
+        """The whole value"""
+        return self._client.call("handle_fetch", self.id)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.attr(name)
+
+    def __getitem__(self, key):
+        return self.item(key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+
+class AsyncRemoteHandle(HandleBase):
+    """Handle for AsyncRemoteClient; the same operations as RemoteHandle, as coroutines.
+
+    Attributes and subscripts on the server go through attr() and item(),
+    since attribute access and indexing cannot be awaited.
+    """
+
+    async def attr(self, name):
+        reply = await self._client.call("handle_getattr", self.id, name)
+        if reply[0] == "method":
+            return functools.partial(self.call_method, name)
+        return self._unwrap(reply)
+
+    async def item(self, key):
+        return self._unwrap(await self._client.call("handle_getitem", self.id, encode_key(key)))
+
+    async def call_method(self, name, /, *args, **kwargs):
+        return self._unwrap(await self._client.call("handle_call", self.id, name, args, kwargs))
+
+    async def fetch(self):
+        """The whole value"""
+        return await self._client.call("handle_fetch", self.id)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
@@ -0,0 +1,122 @@
+# remote_log.py
+import atexit
+import collections
+import itertools
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+
+# Parent of every logger in the package; the server logs under remote.server,
+# the clients under remote.client
+ROOT_LOGGER = "remote"
+# Per-request records (commands, calls, variable syncs) go to these loggers at
+# DEBUG level, so they cost a level check when off and can be sampled when on
+HOT_LOGGERS = ("remote.server.requests", "remote.client.calls")
+
+# Records held for the writer thread before the oldest are dropped
+DEFAULT_RING_SIZE = 10000
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+_listener = None
+
+
+class RingQueue:
+    """Bounded queue for QueueHandler that drops the oldest record instead of blocking.
+
+    A caller logging faster than the writer can keep up never waits on
+    terminal or file I/O; it just loses old records, which are counted.
+    """
+
+    def __init__(self, maxsize=DEFAULT_RING_SIZE):
+        self._records = collections.deque(maxlen=maxsize)
+        self._ready = threading.Condition(threading.Lock())
+        self.dropped = 0
+
+    def put_nowait(self, record):
+        with self._ready:
+            if len(self._records) == self._records.maxlen:
+                self.dropped += 1
+            self._records.append(record)
+            self._ready.notify()
+
+    def get(self, block=True, timeout=None):
+        """Oldest record; like queue.Queue.get, raises queue.Empty if none comes in time"""
+        with self._ready:
+            if block and not self._ready.wait_for(lambda: self._records, timeout):
+                raise queue.Empty
+            if not self._records:
+                raise queue.Empty
+            return self._records.popleft()
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+
+class SampleFilter(logging.Filter):
+    """Lets through one in every `every` records below WARNING; warnings and errors always pass"""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = max(int(every), 1)
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or next(self._counter) % self.every == 0
+
+
+def configure_logging(level=logging.INFO, sample_every=1, stream=None, filename=None,
+                      ring_size=DEFAULT_RING_SIZE):
+    """Send the package's log records to `stream` (stderr) or `filename` through a writer thread.
+
+    `level` is a logging level or its name. Records are queued in a ring of
+    `ring_size` and written by a background thread. With `sample_every` N
+    above 1, only one in N per-request records is kept. Calling this again
+    replaces the previous configuration.
+    """
+    global _listener
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    root = logging.getLogger(ROOT_LOGGER)
+    shutdown_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    if filename:
+        target = logging.FileHandler(filename)
+    else:
+        target = logging.StreamHandler(stream or sys.stderr)
+    target.setFormatter(logging.Formatter(LOG_FORMAT))
+    ring = RingQueue(ring_size)
+    _listener = logging.handlers.QueueListener(ring, target)
+    _listener.start()
+    root.addHandler(logging.handlers.QueueHandler(ring))
+    root.setLevel(level)
+    # Records do not also go to the application's root logger
+    root.propagate = False
+
+    for name in HOT_LOGGERS:
+        logger = logging.getLogger(name)
+        for old in [f for f in logger.filters if isinstance(f, SampleFilter)]:
+            logger.removeFilter(old)
+        if sample_every > 1:
+            logger.addFilter(SampleFilter(sample_every))
+    return ring
+
+
+def ensure_logging(level=logging.INFO):
+    """configure_logging(level) unless the package's logging is already set up"""
+    if not logging.getLogger(ROOT_LOGGER).handlers:
+        configure_logging(level)
+
+
+def shutdown_logging():
+    """Write out every queued record and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
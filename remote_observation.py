@@ -0,0 +1,99 @@
+# remote_observation.py
+import pybullet as FUN
+
+try:
+    import numpy as np
+except ImportError:  # Observations are returned as lists without NumPy
+    np = None
+
+DEFAULT_OBSERVATION = "default"
+
+
+class Observation:
+    """A fixed set of bodies whose state is read back after stepping.
+
+    Joint indices are resolved once at registration; fixed joints are
+    skipped. Every field of an observation is a rectangular list of numbers,
+    which binary codecs pack as raw arrays, or a NumPy array on request.
+    """
+
+    def __init__(self, body_ids, joint_states=True, contacts=True, physicsClientId=0):
+        self.body_ids = [int(body_id) for body_id in body_ids]
+        self.joint_states = joint_states
+        self.contacts = contacts
+        self.physicsClientId = physicsClientId
+        self.joint_indices = []
+        for body_id in self.body_ids:
+            indices = []
+            if joint_states:
+                for joint in range(FUN.getNumJoints(body_id, physicsClientId=physicsClientId)):
+                    info = FUN.getJointInfo(body_id, joint, physicsClientId=physicsClientId)
+                    if info[2] != FUN.JOINT_FIXED:
+                        indices.append(joint)
+            self.joint_indices.append(indices)
+
+    def layout(self):
+        """Which entries of the joint arrays belong to which body"""
+        return {"body_ids": self.body_ids, "joint_indices": self.joint_indices,
+                "joint_states": self.joint_states, "contacts": self.contacts}
+
+    def collect(self, as_arrays=False):
+        cid = self.physicsClientId
+        positions = []
+        orientations = []
+        joint_positions = []
+        joint_velocities = []
+        joint_torques = []
+        contact_counts = []
+        for body_id, indices in zip(self.body_ids, self.joint_indices):
+            position, orientation = FUN.getBasePositionAndOrientation(body_id, physicsClientId=cid)
+            positions.append(list(position))
+            orientations.append(list(orientation))
+            if indices:
+                for state in FUN.getJointStates(body_id, indices, physicsClientId=cid):
+                    joint_positions.append(state[0])
+                    joint_velocities.append(state[1])
+                    joint_torques.append(state[3])
+            if self.contacts:
+                contact_counts.append(len(FUN.getContactPoints(bodyA=body_id, physicsClientId=cid)))
+
+        observation = {"base_positions": positions, "base_orientations": orientations}
+        if self.joint_states:
+            observation["joint_positions"] = joint_positions
+            observation["joint_velocities"] = joint_velocities
+            observation["joint_torques"] = joint_torques
+        if self.contacts:
+            observation["contact_counts"] = contact_counts
+        if as_arrays and np is not None:
+            observation = {key: np.asarray(value, dtype=np.int32 if key == "contact_counts" else np.float64)
+                           for key, value in observation.items()}
+        return observation
+
+
+def register_observation(registry, body_ids, name=DEFAULT_OBSERVATION, joint_states=True, contacts=True,
+                         physicsClientId=0):
+    """Declare the bodies step_and_observe reports on; returns the joint layout.
+
+    `registry` is the dict observations are kept in, one per world.
+    """
+    observation = Observation(body_ids, joint_states, contacts, physicsClientId)
+    registry[name] = observation
+    return observation.layout()
+
+
+def step_and_observe(registry, steps=1, name=DEFAULT_OBSERVATION, as_arrays=False):
+    """Advance the simulation `steps` times and return the registered observation.
+
+    The result has base_positions (bodies x 3), base_orientations
+    (bodies x 4) and, if enabled, joint_positions, joint_velocities and
+    joint_torques (all joints of all bodies, in layout order) and
+    contact_counts (one per body). With as_arrays each field is a NumPy
+    array; only ask for that when the client can decode them.
+    """
+    try:
+        observation = registry[name]
+    except KeyError:
+        raise NameError(f"No observation registered as {name!r}") from None
+    for _ in range(steps):
+        FUN.stepSimulation(physicsClientId=observation.physicsClientId)
+    return observation.collect(as_arrays)
@@ -0,0 +1,140 @@
+# remote_protocol.py
+import asyncio
+import struct
+import json
+
+# Every message on the wire is a fixed header followed by the payload:
+#   payload length (uint32) | request id (uint64) | flags (uint8)
+FRAME_HEADER = struct.Struct("!IQB")
+MAX_FRAME_SIZE = 1 << 30
+
+# Frame flags
+FLAG_ERROR = 0x01
+FLAG_CONTROL = 0x02  # JSON connection-management message, not a command
+FLAG_BATCH = 0x04    # list of commands run in order, answered by one list of outcomes
+FLAG_CALL = 0x08     # structured call [name, args, kwargs] instead of command source
+FLAG_SCRIPT = 0x10   # whole script run on the server, answered by stream frames then a result
+FLAG_STREAM = 0x20   # intermediate [kind, value] output for a request that is still running
+FLAG_WORLD = 0x40    # payload starts with the id of the world the request addresses
+
+# World id prefix of a FLAG_WORLD payload. Eight bytes, so array data in the
+# rest of the payload keeps its alignment.
+WORLD_ID = struct.Struct("!Q")
+
+
+class ProtocolError(ConnectionError):
+    """Raised when the peer sends a frame that violates the protocol"""
+
+
+def _recv_exactly(sock, size):
+    """Read exactly `size` bytes into a fresh buffer, or return None on a clean EOF"""
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            if received == 0:
+                return None
+            raise ProtocolError(f"Connection closed after {received} of {size} bytes")
+        received += n
+    return buf
+
+
+def pack_frame(request_id, payload, flags=0):
+    """Header and payload as one bytes object, for writers that must not interleave frames"""
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(payload)} bytes exceeds limit of {MAX_FRAME_SIZE}")
+    return FRAME_HEADER.pack(len(payload), request_id, flags) + bytes(payload)
+
+
+def send_frame(sock, request_id, payload, flags=0):
+    """Send one framed message"""
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(payload)} bytes exceeds limit of {MAX_FRAME_SIZE}")
+    header = FRAME_HEADER.pack(len(payload), request_id, flags)
+    # Small frames go out in one send; large ones avoid copying the payload
+    if len(payload) < 65536:
+        sock.sendall(header + payload)
+    else:
+        sock.sendall(header)
+        sock.sendall(payload)
+
+
+def recv_frame(sock):
+    """Receive one framed message as (request_id, flags, payload), or None if the peer closed"""
+    header = _recv_exactly(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    length, request_id, flags = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds limit of {MAX_FRAME_SIZE}")
+    if length == 0:
+        return request_id, flags, bytearray()
+    payload = _recv_exactly(sock, length)
+    if payload is None:
+        raise ProtocolError("Connection closed before frame payload arrived")
+    return request_id, flags, payload
+
+
+async def recv_frame_async(reader):
+    """asyncio version of recv_frame, reading from a StreamReader"""
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ProtocolError("Connection closed in the middle of a frame header") from None
+    length, request_id, flags = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds limit of {MAX_FRAME_SIZE}")
+    try:
+        payload = await reader.readexactly(length) if length else b""
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("Connection closed before frame payload arrived") from None
+    return request_id, flags, payload
+
+
+def prefix_world(world_id, payload):
+    """Payload addressed to a world; send it with FLAG_WORLD"""
+    return WORLD_ID.pack(world_id) + payload
+
+
+def split_world(payload):
+    """(world_id, rest of the payload) from a FLAG_WORLD payload"""
+    if len(payload) < WORLD_ID.size:
+        raise ProtocolError("Payload too short for a world id")
+    return WORLD_ID.unpack_from(payload)[0], memoryview(payload)[WORLD_ID.size:]
+
+
+class SocketTransport:
+    """Frame transport over a connected stream socket"""
+    name = "socket"
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def send_frame(self, request_id, payload, flags=0):
+        send_frame(self.sock, request_id, payload, flags)
+
+    def recv_frame(self):
+        return recv_frame(self.sock)
+
+    def close(self):
+        pass
+
+
+def encode_control(message):
+    """Serialize a control message (a small dict) for a FLAG_CONTROL frame"""
+    return json.dumps(message).encode('utf-8')
+
+
+def decode_control(payload):
+    """Parse the body of a FLAG_CONTROL frame"""
+    try:
+        message = json.loads(bytes(payload).decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ProtocolError(f"Malformed control message: {e}") from None
+    if not isinstance(message, dict):
+        raise ProtocolError("Control message must be a JSON object")
+    return message
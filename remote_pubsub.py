@@ -0,0 +1,234 @@
+# remote_pubsub.py
+import asyncio
+import logging
+import time
+
+from remote_delta import FrameDecoder
+from remote_protocol import FLAG_STREAM, pack_frame
+
+log = logging.getLogger("remote.server")
+
+# Frames per second a subscription gets unless it asks for another rate
+DEFAULT_STREAM_RATE = 60.0
+
+
+class ConflatingSender:
+    """Writes one subscription's frames to a client connection, newest first.
+
+    Runs on the event loop. While the connection is backed up (the
+    transport has paused writing), offered frames replace the one waiting
+    to go out instead of queueing behind it, so a slow subscriber gets the
+    latest state late rather than every state later and later.
+
+    Frames are encoded only when written: `encode(kind, value)` builds the
+    FLAG_STREAM payload, and with a FrameEncoder state frames are first
+    turned into keyframes and deltas against what was actually sent.
+    """
+
+    def __init__(self, writer, stream_id, encode, encoder=None):
+        self.writer = writer
+        self.stream_id = stream_id
+        self.encode = encode
+        self.encoder = encoder
+        self.sent = 0
+        self.conflated = 0
+        self._pending = None
+        self._flusher = None
+        self.closed = False
+
+    def offer(self, kind, value):
+        if self.closed:
+            return
+        if self._pending is not None:
+            self.conflated += 1
+        self._pending = (kind, value)
+        if self._flusher is None:
+            self._flusher = asyncio.ensure_future(self._flush())
+
+    async def _flush(self):
+        try:
+            while self._pending is not None:
+                await self.writer.drain()
+                (kind, value), self._pending = self._pending, None
+                try:
+                    if self.encoder is not None and kind == "state":
+                        kind, value = "delta", self.encoder.encode(value)
+                    payload = self.encode(kind, value)
+                except Exception as e:
+                    # Report it and end the subscription; Subscriptions.publish drops closed senders
+                    log.warning("Ending state subscription %s: cannot encode frame: %s", self.stream_id, e)
+                    payload = self.encode("error", f"{type(e).__name__}: {e}")
+                    self.closed = True
+                    self._pending = None
+                self.writer.write(pack_frame(self.stream_id, payload, FLAG_STREAM))
+                self.sent += 1
+        except ConnectionError:
+            self._pending = None  # the client is gone; handle_client cleans up
+        finally:
+            self._flusher = None
+
+    def close(self):
+        # A frame already offered (such as an error report) still goes out
+        self.closed = True
+
+
+class Subscription:
+    """A client's request for the state of some bodies at a fixed rate"""
+
+    def __init__(self, stream_id, observation, rate, sender, loop):
+        if rate <= 0:
+            raise ValueError(f"Subscription rate must be positive, got {rate}")
+        self.stream_id = stream_id
+        self.observation = observation
+        self.period = 1.0 / rate
+        self.sender = sender
+        self.loop = loop
+        self.next_due = 0.0
+        self.seq = 0
+
+    def publish(self, now, as_arrays):
+        frame = self.observation.collect(as_arrays)
+        self.seq += 1
+        frame["seq"] = self.seq
+        frame["time"] = now
+        self._deliver("state", frame)
+        self.next_due += self.period
+        if self.next_due <= now:
+            # Fell behind (or first frame): restart the schedule instead of bursting
+            self.next_due = now + self.period
+
+    def _on_loop(self, fn, *args):
+        try:
+            self.loop.call_soon_threadsafe(fn, *args)
+        except RuntimeError:
+            pass  # the event loop is shutting down
+
+    def _deliver(self, kind, value):
+        self._on_loop(self.sender.offer, kind, value)
+
+    def fail(self, error):
+        """Tell the client the subscription ended because of `error`"""
+        self._deliver("error", f"{type(error).__name__}: {error}")
+
+    def close(self):
+        self._on_loop(self.sender.close)
+
+
+class Subscriptions:
+    """Every state subscription on the server, by world.
+
+    Only used on the physics thread. publish() is called after each
+    real-time step and each request in a world; subscriptions that are due
+    collect their bodies' state and hand the encoded frame to their
+    sender on the event loop, so a slow client never holds up the engine.
+    """
+
+    def __init__(self):
+        self._by_world = {}
+
+    def __bool__(self):
+        return bool(self._by_world)
+
+    def add(self, world_id, session, subscription):
+        key = (session, subscription.stream_id)
+        self.remove(session, subscription.stream_id)
+        self._by_world.setdefault(world_id, {})[key] = subscription
+
+    def remove(self, session, stream_id):
+        """Drop a subscription; returns whether there was one"""
+        key = (session, stream_id)
+        for world_id, subscriptions in list(self._by_world.items()):
+            subscription = subscriptions.pop(key, None)
+            if subscription is not None:
+                subscription.close()
+                if not subscriptions:
+                    del self._by_world[world_id]
+                return True
+        return False
+
+    def drop_session(self, session):
+        for world_id, subscriptions in list(self._by_world.items()):
+            for key in [key for key in subscriptions if key[0] is session]:
+                self.remove(*key)
+
+    def drop_world(self, world_id):
+        for key in list(self._by_world.get(world_id, ())):
+            self.remove(*key)
+
+    def publish(self, world_id):
+        subscriptions = self._by_world.get(world_id)
+        if not subscriptions:
+            return
+        now = time.perf_counter()
+        for key, subscription in list(subscriptions.items()):
+            if subscription.sender.closed:
+                self.remove(*key)  # ended by its sender, e.g. on an encoding error
+                continue
+            if now < subscription.next_due:
+                continue
+            try:
+                subscription.publish(now, key[0].arrays)
+            except Exception as e:
+                log.warning("Ending state subscription %s of %s: %s", subscription.stream_id, key[0].addr, e)
+                subscription.fail(e)
+                self.remove(*key)
+
+    def stats(self, session):
+        """Sent and conflated frame counts of a session's subscriptions"""
+        stats = {}
+        for subscriptions in self._by_world.values():
+            for (owner, stream_id), subscription in subscriptions.items():
+                if owner is not session:
+                    continue
+                sender = subscription.sender
+                stats[stream_id] = {"seq": subscription.seq, "sent": sender.sent, "conflated": sender.conflated}
+                if sender.encoder is not None:
+                    stats[stream_id].update(sender.encoder.stats())
+        return stats
+
+
+class StateSubscription:
+    """Client end of a subscription: the newest state frame pushed by the server.
+
+    Each frame is the dict step_and_observe returns, plus `seq` (counting
+    every frame the server published) and `time` (server clock, seconds).
+    Frames go to on_frame(frame) as they are read and `latest` always
+    holds the newest one. RemoteClient reads frames while it waits for
+    replies and in poll(); AsyncRemoteClient reads them as they arrive.
+    Delta-encoded subscriptions are rebuilt into full frames of NumPy
+    arrays before any of that.
+    """
+
+    def __init__(self, stream_id, on_frame=None, delta=False):
+        self.stream_id = stream_id
+        self.on_frame = on_frame
+        self._decoder = FrameDecoder() if delta else None
+        # Joint layout of the subscribed bodies, as register_observation returns it
+        self.layout = None
+        self.latest = None
+        self.received = 0
+        # Frames published but never received because newer ones replaced them
+        self.skipped = 0
+        # Set when the server ended the subscription
+        self.error = None
+        self._last_seq = 0
+
+    def _receive(self, kind, value):
+        if kind == "error":
+            self.error = value
+            return
+        if kind == "delta":
+            value = self._decoder.decode(value)
+            if value is None:
+                return
+        self.skipped += max(value["seq"] - self._last_seq - 1, 0)
+        self._last_seq = value["seq"]
+        self.latest = value
+        self.received += 1
+        if self.on_frame is not None:
+            self.on_frame(value)
+
+    def take(self):
+        """The newest frame not taken yet, or None"""
+        frame, self.latest = self.latest, None
+        return frame
@@ -0,0 +1,173 @@
+# remote_pure.py
+import functools
+import math
+
+try:
+    import pybullet as FUN
+except ImportError:  # Clients without pybullet use the Python versions below
+    FUN = None
+
+# Results remembered per pure function
+DEFAULT_PURE_CACHE_SIZE = 1024
+
+
+def _quaternion(q):
+    x, y, z, w = (float(c) for c in q)
+    norm = math.sqrt(x * x + y * y + z * z + w * w)
+    return x / norm, y / norm, z / norm, w / norm
+
+
+def _multiply(a, b):
+    ax, ay, az, aw = a
+    bx, by, bz, bw = b
+    return (aw * bx + ax * bw + ay * bz - az * by,
+            aw * by + ay * bw + az * bx - ax * bz,
+            aw * bz + az * bw + ax * by - ay * bx,
+            aw * bw - ax * bx - ay * by - az * bz)
+
+
+def _canonical(q):
+    """The sign of a rotation's quaternion that Bullet reports, as when read back from its matrix"""
+    m = get_matrix_from_quaternion(q)
+    diagonal = (m[0], m[4], m[8])
+    if sum(diagonal) > 0:
+        largest = 3
+    elif diagonal[0] < diagonal[1]:
+        largest = 2 if diagonal[1] < diagonal[2] else 1
+    else:
+        largest = 2 if diagonal[0] < diagonal[2] else 0
+    return q if q[largest] >= 0 else tuple(-c for c in q)
+
+
+def _rotate(q, v):
+    x, y, z, _ = _multiply(_multiply(q, (v[0], v[1], v[2], 0.0)), (-q[0], -q[1], -q[2], q[3]))
+    return x, y, z
+
+
+def get_quaternion_from_euler(eulerAngles, physicsClientId=0):
+    """[x, y, z, w] for roll, pitch and yaw about the fixed X, Y and Z axes"""
+    if len(eulerAngles) != 3:
+        raise ValueError("Euler angles need 3 coordinates [roll, pitch, yaw]")
+    roll, pitch, yaw = (float(angle) / 2 for angle in eulerAngles)
+    cr, sr = math.cos(roll), math.sin(roll)
+    cp, sp = math.cos(pitch), math.sin(pitch)
+    cy, sy = math.cos(yaw), math.sin(yaw)
+    return _quaternion((sr * cp * cy - cr * sp * sy,
+                        cr * sp * cy + sr * cp * sy,
+                        cr * cp * sy - sr * sp * cy,
+                        cr * cp * cy + sr * sp * sy))
+
+
+def get_euler_from_quaternion(quaternion, physicsClientId=0):
+    """[roll, pitch, yaw] of an [x, y, z, w] quaternion"""
+    if len(quaternion) != 4:
+        raise ValueError("Quaternion needs 4 components [x, y, z, w]")
+    # Bullet does not normalize here, so neither do we
+    x, y, z, w = (float(c) for c in quaternion)
+    sarg = -2 * (x * z - w * y)
+    if sarg <= -0.99999:
+        return 0.0, -0.5 * math.pi, 2 * math.atan2(x, -y)
+    if sarg >= 0.99999:
+        return 0.0, 0.5 * math.pi, 2 * math.atan2(-x, y)
+    return (math.atan2(2 * (y * z + w * x), w * w - x * x - y * y + z * z),
+            math.asin(sarg),
+            math.atan2(2 * (x * y + w * z), w * w + x * x - y * y - z * z))
+
+
+def multiply_transforms(positionA, orientationA, positionB, orientationB, physicsClientId=0):
+    """(position, orientation) of transform A applied after transform B"""
+    a = _quaternion(orientationA)
+    offset = _rotate(a, positionB)
+    position = tuple(float(positionA[i]) + offset[i] for i in range(3))
+    return position, _canonical(_quaternion(_multiply(a, _quaternion(orientationB))))
+
+
+def invert_transform(position, orientation, physicsClientId=0):
+    """(position, orientation) of the inverse of a transform"""
+    x, y, z, w = _quaternion(orientation)
+    inverse = (-x, -y, -z, w)
+    offset = _rotate(inverse, position)
+    return (-offset[0], -offset[1], -offset[2]), _canonical(inverse)
+
+
+def get_matrix_from_quaternion(quaternion, physicsClientId=0):
+    """The 3x3 rotation matrix of a quaternion as 9 values, row-major"""
+    if len(quaternion) != 4:
+        raise ValueError("Quaternion needs 4 components [x, y, z, w]")
+    x, y, z, w = (float(c) for c in quaternion)
+    s = 2.0 / (x * x + y * y + z * z + w * w)
+    xs, ys, zs = x * s, y * s, z * s
+    wx, wy, wz = w * xs, w * ys, w * zs
+    xx, xy, xz = x * xs, x * ys, x * zs
+    yy, yz, zz = y * ys, y * zs, z * zs
+    return (1.0 - (yy + zz), xy - wz, xz + wy,
+            xy + wz, 1.0 - (xx + zz), yz - wx,
+            xz - wy, yz + wx, 1.0 - (xx + yy))
+
+
+# Engine functions whose result depends only on their arguments, with a
+# Python stand-in for clients that do not have pybullet installed
+PURE_FUNCTIONS = {
+    "getQuaternionFromEuler": get_quaternion_from_euler,
+    "getEulerFromQuaternion": get_euler_from_quaternion,
+    "multiplyTransforms": multiply_transforms,
+    "invertTransform": invert_transform,
+    "getMatrixFromQuaternion": get_matrix_from_quaternion,
+}
+
+
+def _freeze(value):
+    """A hashable equivalent of an argument, or TypeError"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if hasattr(value, "tolist"):  # NumPy arrays and scalars
+        return _freeze(value.tolist())
+    hash(value)
+    return value
+
+
+class PureFunctions:
+    """Evaluates pure engine functions on the client, remembering recent results.
+
+    pybullet's own implementation is used when it can be imported, so the
+    results are exactly what the server would send; otherwise the Python
+    versions in PURE_FUNCTIONS are. Those compute in double precision, so
+    where the engine works in single precision (multiplyTransforms,
+    invertTransform) they can differ from it in the last digits. Each function keeps an LRU cache of
+    `cache_size` results (None means unbounded, 0 disables caching).
+    """
+
+    def __init__(self, cache_size=DEFAULT_PURE_CACHE_SIZE, functions=PURE_FUNCTIONS):
+        self._functions = {}
+        for name, fallback in functions.items():
+            function = getattr(FUN, name, None) if FUN is not None else None
+            function = function or fallback
+            if function is not None:
+                self._functions[name] = functools.lru_cache(maxsize=cache_size)(function)
+
+    def __contains__(self, name):
+        return name in self._functions
+
+    def evaluate(self, name, args, kwargs):
+        """(True, result) when the call was answered locally, else (False, None).
+
+        Calls whose arguments are unhashable or rejected by the local
+        implementation are left to the server, which reports errors the
+        usual way.
+        """
+        function = self._functions.get(name)
+        if function is None:
+            return False, None
+        try:
+            args = tuple(_freeze(arg) for arg in args)
+            kwargs = {key: _freeze(value) for key, value in kwargs.items()}
+            return True, function(*args, **kwargs)
+        except Exception:
+            return False, None
+
+    def clear(self):
+        for function in self._functions.values():
+            function.cache_clear()
+
+    def stats(self):
+        return {name: function.cache_info()._asdict() for name, function in self._functions.items()}
@@ -0,0 +1,66 @@
+# remote_realtime.py
+import time
+
+import pybullet as FUN
+
+DEFAULT_RATE = 240.0
+# Falling further behind than this many steps drops them instead of catching up
+DEFAULT_MAX_LAG_STEPS = 5
+
+
+class RealTimeStepper:
+    """Advances the engine on a fixed wall-clock schedule.
+
+    Deadlines follow the schedule rather than the time the last step
+    happened to run, so jitter does not accumulate into drift. A step that
+    starts more than one period late counts as an overrun; when the stepper
+    falls more than max_lag steps behind, the missed steps are skipped and
+    the schedule restarts from now.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, physicsClientId=0, set_time_step=True,
+                 max_lag=DEFAULT_MAX_LAG_STEPS):
+        if rate <= 0:
+            raise ValueError(f"Stepping rate must be positive, got {rate}")
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.physicsClientId = physicsClientId
+        self.max_lag = max_lag
+        if set_time_step:
+            # Keep simulated time in step with wall-clock time
+            FUN.setTimeStep(self.period, physicsClientId=physicsClientId)
+        self.started = time.perf_counter()
+        self.next_deadline = self.started + self.period
+        self.steps = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.max_lateness = 0.0
+        self.total_lateness = 0.0
+
+    def due_in(self):
+        """Seconds until the next step is due; zero or less means now"""
+        return self.next_deadline - time.perf_counter()
+
+    def step(self):
+        now = time.perf_counter()
+        lateness = now - self.next_deadline
+        FUN.stepSimulation(physicsClientId=self.physicsClientId)
+        self.steps += 1
+        self.total_lateness += max(lateness, 0.0)
+        self.max_lateness = max(self.max_lateness, lateness)
+        if lateness > self.period:
+            self.overruns += 1
+        self.next_deadline += self.period
+        behind = time.perf_counter() - self.next_deadline
+        if behind > self.max_lag * self.period:
+            missed = int(behind / self.period)
+            self.skipped += missed
+            self.next_deadline += missed * self.period
+
+    def stats(self):
+        elapsed = time.perf_counter() - self.started
+        return {"rate": self.rate, "steps": self.steps, "elapsed": elapsed,
+                "achieved_rate": self.steps / elapsed if elapsed > 0 else 0.0,
+                "overruns": self.overruns, "skipped": self.skipped,
+                "max_lateness": self.max_lateness,
+                "mean_lateness": self.total_lateness / self.steps if self.steps else 0.0}
@@ -2,17 +2,88 @@
 import socket
 import traceback
 import io
+import os
+import stat
 import sys
+import argparse
+import asyncio
+import queue
+import threading
+import concurrent.futures
+import functools
+import time
 import json
 import ast
+import logging
+
+import pybullet as FUN
+
+from remote_code_cache import CodeCache, DEFAULT_CODE_CACHE_SIZE, ScriptCache
+from remote_codec import CodecError, DEFAULT_CODEC, codec_for_peer, negotiate_codec, np, pack_arrays
+from remote_delta import FrameEncoder
+from remote_handles import DEFAULT_HANDLE_BUDGET, HandleTable, decode_key
+from remote_log import configure_logging
+from remote_observation import DEFAULT_OBSERVATION, Observation, register_observation, step_and_observe
+from remote_realtime import DEFAULT_RATE, RealTimeStepper
+from remote_protocol import (FLAG_BATCH, FLAG_CALL, FLAG_CONTROL, FLAG_ERROR, FLAG_SCRIPT, FLAG_STREAM,
+                             FLAG_WORLD, ProtocolError, decode_control, encode_control, pack_frame,
+                             recv_frame_async, split_world)
+from remote_pubsub import DEFAULT_STREAM_RATE, ConflatingSender, Subscription, Subscriptions
+from remote_shm import ShmTransport
+from remote_snapshot import DEFAULT_SNAPSHOT_BUDGET, SnapshotCache
+from remote_sync import VersionConflict, apply_update
+from remote_vec_env import VecEnv
+from remote_world import DEFAULT_IDLE_TIMEOUT, DEFAULT_WORLD_ID, World, WorldEngine
+
+log = logging.getLogger("remote.server")
+# Per-request records; DEBUG, so off unless asked for with --log-level debug
+request_log = logging.getLogger("remote.server.requests")
 
 # Define destination
 SERVER_IP = "127.0.0.1" 
 SERVER_PORT = 65432
+# Unix domain socket path; None disables the unix listener
+SERVER_UNIX_PATH = None
 
 _shared_variables_store = {}
 _shared_variables_store = {}
 
+# Single thread that owns the physics engine; created by main()
+_physics = None
+
+# Worlds by id, and the one the request being executed belongs to. Both are
+# only used on the physics thread.
+_worlds = {}
+_world = None
+_next_world_id = DEFAULT_WORLD_ID + 1
+
+# Saved physics states and shared variables, keyed by (world id, name)
+_snapshots = SnapshotCache()
+
+# Results clients hold by handle, and the session of the request being
+# executed, which owns the handles it creates
+_handles = HandleTable()
+_session = None
+
+# State subscriptions, published after steps and requests in their world
+_subscriptions = Subscriptions()
+
+# Vectorized environments by id; their worlds live in worker processes.
+# Creating and closing them runs off the physics thread, hence the lock.
+_vec_envs = {}
+_next_vec_env_id = 1
+_vec_envs_lock = threading.Lock()
+
+# Compiled eval()-path commands and uploaded scripts; only touched on the physics thread
+_code_cache = CodeCache()
+_script_cache = ScriptCache()
+
+# Script output is sent once this much text is buffered or this long has passed
+SCRIPT_OUTPUT_CHUNK = 4096
+SCRIPT_OUTPUT_INTERVAL = 0.05
+# Output frames a script may have waiting to be written before it waits for the client
+SCRIPT_OUTPUT_BACKLOG = 8
+
 
 def _safe_parse(value_repr_str):
     try:
@@ -38,25 +109,69 @@ def set_shared_variable(name, value_arg):
     if not isinstance(name, str):
         raise TypeError(f"'name' must be a string, got {type(name)}")
  
-    # Type safety checking
-    value_repr_str_for_parse: str
+    # Values arriving through eval() are already Python objects; only text
+    # payloads need the repr round trip undone
     if isinstance(value_arg, str):
-        value_repr_str_for_parse = value_arg
+        value = _safe_parse(value_arg)
     else:
-        value_repr_str_for_parse = repr(value_arg)
+        value = value_arg
 
-    # Safe parsing the value
-    value = _safe_parse(value_repr_str_for_parse)
+    store_shared_variable(name, value)
+    return f"Variable '{name}' set to {value!r}"
+
+def store_shared_variable(name, value, digest=None):
+    # Structured calls carry the value itself, so it is stored as is; like
+    # update_shared_variable, they get the new version back rather than a
+    # message quoting the whole value
+    if not isinstance(name, str):
+        raise TypeError(f"'name' must be a string, got {type(name)}")
 
     # Set the variable name
-    _shared_variables_store[name] = value
+    _world.store[name] = value
+    # Mirror it into the evaluation globals so lambdas and comprehensions see it too
+    _world.globals[name] = value
+    version = bump_version(name, digest)
+
+    if request_log.isEnabledFor(logging.DEBUG):
+        request_log.debug("Set shared variable '%s' = %r (type: %s)", name, value, type(value).__name__)
+    return version
+
+def bump_version(name, digest=None):
+    """Record an assignment to a shared variable of the current world"""
+    version = _world.versions.get(name, (0, None))[0] + 1
+    _world.versions[name] = [version, digest]
+    return version
+
+
+def update_shared_variable(name, change, base_version=None, digest=None):
+    """Apply a client's change to a shared variable and return its new version.
+
+    `change` is ["value", value] or a list or dict delta from
+    remote_sync.plan_update. A delta only applies to the version it was
+    computed against; otherwise VersionConflict is raised and the client
+    sends the whole value instead. `digest` is the client's content hash of
+    the result, kept so others can tell whether their copy is current.
+    """
+    if not isinstance(name, str):
+        raise TypeError(f"'name' must be a string, got {type(name)}")
+    if change[0] == "value":
+        value = change[1]
+    else:
+        version = _world.versions.get(name, (0, None))[0]
+        if name not in _world.store or version != base_version:
+            raise VersionConflict(f"Shared variable '{name}' is at version {version}, not {base_version}")
+        value = apply_update(_world.store[name], change)
+    return store_shared_variable(name, value, digest)
+
+
+def list_shared_variables():
+    """[version, digest] of every shared variable in the current world"""
+    return {name: _world.versions.get(name, [0, None]) for name in _world.store}
 
-    print(f"Server: Set shared variable '{name}' = {value!r} (type: {type(value)})")
-    return f"Variable '{name}' set to {value!r}"
 
 def get_shared_variable(name):
-    # Pull shared variable information
-    global _shared_variables_store
+    # Pull shared variable information from the current world
+    store = _world.store
 
 
     # Check type safety (shouldn't ever trigger)
@@ -64,15 +179,991 @@ def get_shared_variable(name):
         raise TypeError(f"'name' must be a string, got {type(name)}")
 
     # Throw error if the variable isn't in the store
-    if name not in _shared_variables_store:
+    if name not in store:
         raise NameError(f"Shared variable '{name}' not found on server.")
 
     # Get the shared variable
-    value = _shared_variables_store[name]
-    print(f"Server: Get shared variable '{name}' -> {value!r} (type: {type(value)})")
+    value = store[name]
+    if request_log.isEnabledFor(logging.DEBUG):
+        request_log.debug("Get shared variable '%s' -> %r (type: %s)", name, value, type(value).__name__)
     return value
 
-def main():
+
+class PhysicsExecutor:
+    """Runs every engine and shared-variable call on one dedicated thread.
+
+    PyBullet is not thread-safe, so all client sessions funnel their work
+    through here, in submission order, while socket I/O for many clients
+    carries on in the event loop.
+
+    When RealTimeSteppers are attached this thread also steps their worlds
+    on schedule, and queued jobs are run in the gaps between steps;
+    `on_step(world_id)` is called after each of those steps.
+    """
+
+    def __init__(self, on_step=None):
+        self._queue = queue.SimpleQueue()
+        # Real-time steppers by world id; only used on the physics thread
+        self.steppers = {}
+        self.on_step = on_step
+        self._thread = threading.Thread(target=self._run, name="physics", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) and return a concurrent.futures.Future for its result"""
+        future = concurrent.futures.Future()
+        self._queue.put((fn, args, future))
+        return future
+
+    async def run(self, fn, *args):
+        """Await fn(*args) on the physics thread"""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _next_job(self):
+        """Wait for the next job, stepping the engine whenever a step falls due"""
+        stepped = False
+        while self.steppers:
+            world_id, stepper = min(self.steppers.items(), key=lambda item: item[1].next_deadline)
+            wait = stepper.due_in()
+            # A stepper that cannot keep up is always due; queued jobs still get a turn after each step
+            if wait > 0 or stepped:
+                try:
+                    return self._queue.get(timeout=max(wait, 0))
+                except queue.Empty:
+                    pass
+            stepped = True
+            try:
+                stepper.step()
+            except Exception as e:
+                log.error("Real-time stepping of world %s failed, stopping: %s", world_id, e)
+                del self.steppers[world_id]
+                continue
+            if self.on_step is not None:
+                self.on_step(world_id)
+        return self._queue.get()
+
+    def _run(self):
+        while True:
+            item = self._next_job()
+            if item is None:
+                break
+            fn, args, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def shutdown(self):
+        self._queue.put(None)
+        self._thread.join()
+
+
+def _client_id(physicsClientId):
+    """An explicit physics client id, or the current world's"""
+    if physicsClientId is not None:
+        return physicsClientId
+    return _world.client_id if _world.client_id is not None else 0
+
+
+def start_realtime(rate=DEFAULT_RATE, physicsClientId=None, set_time_step=True):
+    """Step the current world in the background at `rate` Hz until stop_realtime()"""
+    stepper = RealTimeStepper(rate, _client_id(physicsClientId), set_time_step)
+    _physics.steppers[_world.world_id] = stepper
+    log.info("Real-time stepping world %s at %s Hz", _world.world_id, rate)
+    return stepper.stats()
+
+
+def stop_realtime():
+    """Stop background stepping of the current world and return its final statistics"""
+    stepper = _physics.steppers.pop(_world.world_id, None)
+    return stepper.stats() if stepper is not None else None
+
+
+def realtime_stats():
+    """Statistics of the current world's background stepper, or None"""
+    stepper = _physics.steppers.get(_world.world_id)
+    return stepper.stats() if stepper is not None else None
+
+
+def register_world_observation(body_ids, name=DEFAULT_OBSERVATION, joint_states=True, contacts=True,
+                               physicsClientId=None):
+    """register_observation for the current world"""
+    return register_observation(_world.observations, body_ids, name, joint_states, contacts,
+                                _client_id(physicsClientId))
+
+
+def step_world_and_observe(steps=1, name=DEFAULT_OBSERVATION, as_arrays=False):
+    """step_and_observe for the current world"""
+    return step_and_observe(_world.observations, steps, name, as_arrays)
+
+
+def subscribe_state(stream_id, body_ids, rate=DEFAULT_STREAM_RATE, joint_states=True, contacts=False,
+                    physicsClientId=None, encoding=None):
+    """Push the state of `body_ids` to this client at up to `rate` frames per second.
+
+    Frames are FLAG_STREAM frames with the client-chosen `stream_id`,
+    published after real-time steps and after requests in the current
+    world. A client that reads slower than that gets the newest frame
+    rather than a growing backlog. `encoding`, a dict of FrameEncoder
+    options, switches to keyframes and deltas. Returns the joint layout,
+    as register_observation does.
+    """
+    session = _session
+    if session.writer is None:
+        raise RuntimeError("State subscriptions need the socket transport; connect with shared_memory=False")
+    observation = Observation(body_ids, joint_states, contacts, _client_id(physicsClientId))
+    encoder = FrameEncoder(**encoding) if encoding is not None else None
+    sender = ConflatingSender(session.writer, stream_id, functools.partial(encode_stream, session), encoder)
+    subscription = Subscription(stream_id, observation, rate, sender, session.loop)
+    _subscriptions.add(_world.world_id, session, subscription)
+    log.info("Client %s subscribed to %d bodies of world %s at %s Hz", session.addr, len(observation.body_ids),
+             _world.world_id, rate)
+    return observation.layout()
+
+
+def unsubscribe_state(stream_id):
+    """Stop a subscription of this client; returns whether there was one"""
+    return _subscriptions.remove(_session, stream_id)
+
+
+def subscription_stats():
+    """Frames published, sent and conflated per subscription of this client"""
+    return _subscriptions.stats(_session)
+
+
+def create_world():
+    """Start a new isolated world with its own physics client and variables; returns its id"""
+    global _next_world_id
+    client_id = FUN.connect(FUN.DIRECT)
+    if client_id < 0:
+        raise RuntimeError("Could not start a physics client for the new world")
+    world_id = _next_world_id
+    _next_world_id += 1
+    engine = WorldEngine(client_id)
+    _worlds[world_id] = World(world_id, engine, client_id, {}, {'FUN': engine, **SERVER_FUNCTIONS},
+                              build_dispatch_table(engine))
+    log.info("Created world %s (physics client %s)", world_id, client_id)
+    return world_id
+
+
+def destroy_world(world_id):
+    """Disconnect a world's physics client and drop its variables"""
+    if world_id == DEFAULT_WORLD_ID:
+        raise ValueError("The default world cannot be destroyed")
+    try:
+        world = _worlds.pop(world_id)
+    except KeyError:
+        raise NameError(f"No world with id {world_id}") from None
+    _physics.steppers.pop(world_id, None)
+    _snapshots.drop_world(world_id)
+    _subscriptions.drop_world(world_id)
+    FUN.disconnect(physicsClientId=world.client_id)
+    log.info("Destroyed world %s", world_id)
+    return True
+
+
+def list_worlds():
+    """Describe every world on the server"""
+    return [world.describe() for world in _worlds.values()]
+
+
+def evict_idle_worlds(timeout):
+    """Destroy worlds that have had no requests for `timeout` seconds.
+
+    The default world and worlds with a real-time stepper running are kept.
+    """
+    idle = [world.world_id for world in _worlds.values()
+            if world.world_id != DEFAULT_WORLD_ID and world.world_id not in _physics.steppers
+            and world.idle_for() > timeout]
+    for world_id in idle:
+        log.info("Evicting world %s after %gs idle", world_id, timeout)
+        destroy_world(world_id)
+    return idle
+
+
+def save_snapshot(name):
+    """Snapshot the current world's physics state and shared variables under `name`; returns its size"""
+    nbytes = _snapshots.save((_world.world_id, name), _world.engine, _world.store)
+    if request_log.isEnabledFor(logging.DEBUG):
+        request_log.debug("Saved snapshot '%s' of world %s (%d bytes)", name, _world.world_id, nbytes)
+    return nbytes
+
+
+def restore_snapshot(name, return_variables=False):
+    """Return the current world to a snapshot, shared variables included.
+
+    Returns the restored variables, or with return_variables=False just
+    their names, so a client knows which of its variables the server now
+    holds its own values for.
+    """
+    try:
+        variables = _snapshots.restore((_world.world_id, name), _world.engine)
+    except KeyError:
+        raise NameError(f"No snapshot named {name!r} in world {_world.world_id}") from None
+    # Swap the variables in place, unshadowing any server names they covered
+    base = {'FUN': _world.engine, **SERVER_FUNCTIONS}
+    for old_name in _world.store:
+        if old_name in base:
+            _world.globals[old_name] = base[old_name]
+        else:
+            _world.globals.pop(old_name, None)
+    for changed in {*_world.store, *variables}:
+        bump_version(changed)
+    _world.store.clear()
+    _world.store.update(variables)
+    _world.globals.update(variables)
+    return variables if return_variables else sorted(variables)
+
+
+def drop_snapshot(name):
+    """Forget a snapshot of the current world"""
+    return _snapshots.drop((_world.world_id, name))
+
+
+def list_snapshots():
+    """Names of the current world's snapshots and the cache's statistics"""
+    return {"names": _snapshots.names(_world.world_id), **_snapshots.stats()}
+
+
+def make_handle(name, args=(), kwargs=None):
+    """Run a structured call and keep its result on the server; returns the handle's descriptor"""
+    return _handles.add(run_call([name, args, kwargs or {}]), _session)
+
+
+def _handle_value(handle_id):
+    try:
+        return _handles.get(handle_id)
+    except KeyError:
+        raise NameError(f"No handle {handle_id} (it was released or evicted)") from None
+
+
+def handle_getattr(handle_id, name):
+    """An attribute of a held value, or ["method", name] when it is callable"""
+    value = getattr(_handle_value(handle_id), name)
+    if callable(value):
+        return ["method", name]
+    return _handles.wrap(value, _session)
+
+
+def handle_getitem(handle_id, key):
+    """value[key] of a held value; slices arrive encoded by remote_handles.encode_key"""
+    return _handles.wrap(_handle_value(handle_id)[decode_key(key)], _session)
+
+
+def handle_call(handle_id, method, args=(), kwargs=None):
+    """Call a method of a held value"""
+    return _handles.wrap(getattr(_handle_value(handle_id), method)(*args, **(kwargs or {})), _session)
+
+
+def handle_fetch(handle_id):
+    """The whole held value"""
+    return _handle_value(handle_id)
+
+
+def retain_handle(handle_id):
+    """Take another reference to a handle, possibly one made by another client"""
+    _handle_value(handle_id)
+    _handles.retain(handle_id, _session)
+    return _handles.describe(handle_id)
+
+
+def release_handles(handle_ids):
+    """Drop one reference to each handle; returns how many were freed"""
+    return sum(_handles.release(handle_id, _session) for handle_id in handle_ids)
+
+
+def handle_stats():
+    return _handles.stats()
+
+
+def make_vec_env(source, num_envs, num_workers=None):
+    """Start `num_envs` copies of an environment script over worker processes; returns its id.
+
+    See remote_vec_env.VecEnv for what the script must define.
+    """
+    global _next_vec_env_id
+    vec_env = VecEnv(source, num_envs, num_workers)
+    with _vec_envs_lock:
+        env_id = _next_vec_env_id
+        _next_vec_env_id += 1
+        _vec_envs[env_id] = vec_env
+    log.info("Started vec env %s (%d envs on %d workers)", env_id, num_envs, len(vec_env.processes))
+    return env_id
+
+
+def _vec_env(env_id):
+    try:
+        with _vec_envs_lock:
+            return _vec_envs[env_id]
+    except KeyError:
+        raise NameError(f"No vec env with id {env_id}") from None
+
+
+def reset_all(env_id):
+    """Reset every copy of a vec env; returns stacked observations.
+
+    Like the other vec env functions, safe to call off the physics thread:
+    it only talks to the vec env's workers.
+    """
+    return _vec_env(env_id).reset_all()
+
+
+def step_all(env_id, actions):
+    """Step every copy of a vec env; returns stacked (observations, rewards, dones)"""
+    return _vec_env(env_id).step_all(actions)
+
+
+def close_vec_env(env_id):
+    """Stop a vec env's worker processes"""
+    with _vec_envs_lock:
+        vec_env = _vec_envs.pop(env_id, None)
+    if vec_env is None:
+        raise NameError(f"No vec env with id {env_id}")
+    vec_env.close()
+    log.info("Closed vec env %s", env_id)
+    return True
+
+
+# Functions commands can call by name, next to FUN
+SERVER_FUNCTIONS = {
+    'set_shared_variable': set_shared_variable,
+    'get_shared_variable': get_shared_variable,
+    'update_shared_variable': update_shared_variable,
+    'list_shared_variables': list_shared_variables,
+    'register_observation': register_world_observation,
+    'step_and_observe': step_world_and_observe,
+    'start_realtime': start_realtime,
+    'stop_realtime': stop_realtime,
+    'realtime_stats': realtime_stats,
+    'subscribe_state': subscribe_state,
+    'unsubscribe_state': unsubscribe_state,
+    'subscription_stats': subscription_stats,
+    'create_world': create_world,
+    'destroy_world': destroy_world,
+    'list_worlds': list_worlds,
+    'save_snapshot': save_snapshot,
+    'restore_snapshot': restore_snapshot,
+    'drop_snapshot': drop_snapshot,
+    'list_snapshots': list_snapshots,
+    'make_handle': make_handle,
+    'handle_getattr': handle_getattr,
+    'handle_getitem': handle_getitem,
+    'handle_call': handle_call,
+    'handle_fetch': handle_fetch,
+    'retain_handle': retain_handle,
+    'release_handles': release_handles,
+    'handle_stats': handle_stats,
+    'make_vec_env': make_vec_env,
+    'reset_all': reset_all,
+    'step_all': step_all,
+    'close_vec_env': close_vec_env,
+}
+
+# Functions that only start, wait on or stop worker processes. Called on their
+# own, they run off the physics thread so other clients' requests go on meanwhile.
+OFF_THREAD_FUNCTIONS = frozenset((make_vec_env, reset_all, step_all, close_vec_env))
+
+# Globals every command is evaluated with. Shared variables are mirrored in
+# by store_shared_variable, so nothing is rebuilt per call.
+_exec_globals = {
+    'FUN': FUN,
+    **SERVER_FUNCTIONS,
+}
+
+
+class ClientSession:
+    """Per-connection state negotiated with a client"""
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        # Unix socket peers are always on this host
+        self.local = getattr(socket, "AF_UNIX", None) == sock.family or is_local_peer(addr)
+        # Set once the client has moved onto shared memory rings
+        self.transport = None
+        # Clients that never send a hello keep the original text protocol
+        self.codec = DEFAULT_CODEC
+        # Ship array-shaped results as raw NumPy buffers
+        self.arrays = False
+        # Event loop and stream writer of the connection, for pushing subscription frames
+        self.loop = None
+        self.writer = None
+
+
+def handle_control(session, message):
+    """Handle a FLAG_CONTROL message and return the reply message"""
+    op = message.get("op")
+    if op == "hello":
+        session.codec = negotiate_codec(message.get("codecs", []))
+        # Raw array buffers need NumPy here and a binary codec on the wire
+        session.arrays = bool(message.get("arrays")) and np is not None and session.codec is not DEFAULT_CODEC
+        session.codec = codec_for_peer(session.codec, session.arrays)
+        log.info("Client %s negotiated codec '%s' (arrays: %s)", session.addr, session.codec.name, session.arrays)
+        return {"op": "hello", "codec": session.codec.name, "arrays": session.arrays,
+                "local": session.local}
+    if op == "shm":
+        if not session.local:
+            raise ProtocolError("Shared memory transport is only offered to local clients")
+        if session.transport is not None:
+            raise ProtocolError("Client is already on the shared memory transport")
+        # The rings are served by a blocking loop, which gets its own handle on the socket
+        signalling = socket.fromfd(session.sock.fileno(), session.sock.family, session.sock.type)
+        session.transport, names = ShmTransport.create_pair(signalling)
+        log.info("Client %s switching to shared memory transport", session.addr)
+        return {"op": "shm", **names}
+    if op == "stats":
+        return {"op": "stats", "code_cache": _code_cache.stats()}
+    raise ProtocolError(f"Unknown control op {op!r}")
+
+
+def is_local_peer(addr):
+    """True when the peer address is on this host"""
+    host = addr[0] if isinstance(addr, tuple) else addr
+    return host in ("127.0.0.1", "::1", "localhost") or str(host).startswith("127.")
+
+
+def decode_command(session, payload):
+    """Turn a request payload into the command source string"""
+    if session.codec is DEFAULT_CODEC:
+        return bytes(payload).decode('utf-8')
+    command = session.codec.decode(payload)
+    if not isinstance(command, str):
+        raise CodecError(f"Expected a command string, got {type(command).__name__}")
+    return command
+
+
+_REMOTE_COMMAND_PREFIXES = ("FUN.", *(f"{name}(" for name in SERVER_FUNCTIONS))
+
+
+def is_remote_command(command_str):
+    """Only calls into the engine and the shared variable store are executed"""
+    stripped = command_str.strip()
+    return stripped.startswith(_REMOTE_COMMAND_PREFIXES)
+
+
+def run_command(command_str):
+    """Evaluate one command against the engine and the shared variable store"""
+    code, literals = _code_cache.lookup(command_str)
+    # Only the physics thread evaluates, so lifted literals can be bound in place
+    _world.globals.update(literals)
+    return eval(code, _world.globals, _world.store)
+
+
+def build_dispatch_table(engine=FUN):
+    """Map every name a structured call may use to the function it runs.
+
+    Engine functions go by their bare pybullet name and SERVER_FUNCTIONS
+    keep their command names. Built once per world, so a call costs a dict
+    lookup instead of parsing and compiling source.
+    """
+    table = {name: getattr(engine, name) for name in dir(FUN)
+             if not name.startswith("_") and callable(getattr(FUN, name))}
+    table.update(SERVER_FUNCTIONS)
+    table["set_shared_variable"] = store_shared_variable
+    return table
+
+
+DISPATCH_TABLE = build_dispatch_table()
+
+# The original single world: the pybullet module as is, with the module-level store
+_world = _worlds[DEFAULT_WORLD_ID] = World(DEFAULT_WORLD_ID, FUN, None, _shared_variables_store,
+                                           _exec_globals, DISPATCH_TABLE)
+
+
+def resolve_call(call):
+    """Check a structured call given as [name, args, kwargs]; returns (function, args, kwargs)"""
+    if not isinstance(call, (list, tuple)) or len(call) != 3:
+        raise CodecError("Structured call must be [name, args, kwargs]")
+    name, args, kwargs = call
+    if not isinstance(args, (list, tuple)) or not isinstance(kwargs, dict):
+        raise CodecError("Structured call needs an argument list and a keyword dict")
+    try:
+        function = _world.table[name]
+    except (KeyError, TypeError):
+        raise NameError(f"Unknown remote function {name!r}") from None
+    return function, args, kwargs
+
+
+def run_call(call):
+    """Run one structured call given as [name, args, kwargs]"""
+    function, args, kwargs = resolve_call(call)
+    return function(*args, **kwargs)
+
+
+def finish_call(session, call, function, args, kwargs):
+    """Run a call that waits on worker processes, off the physics thread; see execute_request"""
+    try:
+        return 0, encode_result(session, function(*args, **kwargs))
+    except Exception as e:
+        request_log.warning("Error executing call '%s': %s", describe_call(call), e)
+        return FLAG_ERROR, error_payload()
+
+
+def describe_call(call):
+    try:
+        name, args, kwargs = call
+        arguments = [repr(arg) for arg in args] + [f"{key}={value!r}" for key, value in kwargs.items()]
+        return f"{name}({', '.join(arguments)})"
+    except (TypeError, ValueError, AttributeError):
+        return repr(call)
+
+
+def encode_result(session, result):
+    if session.arrays:
+        result = pack_arrays(result)
+    return session.codec.encode(result)
+
+
+def error_payload():
+    # Errors always travel as plain text, whatever the codec
+    return f"ERROR executing command:\n{traceback.format_exc()}".encode('utf-8')
+
+
+def handle_batch(session, payload):
+    """Run a list of commands in order and encode all outcomes in one reply.
+
+    The whole batch is a single job on the physics thread, so no other
+    client's command runs in between. Each entry is either command source or,
+    with a binary codec, a structured [name, args, kwargs] call. The reply is
+    a list with one [ok, value] pair per command, where value is the result
+    or, for a failed command, the formatted traceback. With the text codec
+    the list travels as JSON and each result as its repr() text.
+    """
+    if session.codec is DEFAULT_CODEC:
+        commands = json.loads(bytes(payload).decode('utf-8'))
+    else:
+        commands = session.codec.decode(payload)
+    if not isinstance(commands, (list, tuple)):
+        raise CodecError("Batch payload must be a list of commands")
+    if request_log.isEnabledFor(logging.DEBUG):
+        request_log.debug("Received batch of %d commands from %s", len(commands), session.addr)
+
+    outcomes = []
+    for command in commands:
+        try:
+            if isinstance(command, str):
+                result = run_command(command) if is_remote_command(command) else None
+            elif session.codec is DEFAULT_CODEC:
+                raise CodecError("Structured calls need a binary codec")
+            else:
+                result = run_call(command)
+            if session.arrays:
+                result = pack_arrays(result)
+            outcomes.append([True, repr(result) if session.codec is DEFAULT_CODEC else result])
+        except Exception as e:
+            label = command if isinstance(command, str) else describe_call(command)
+            request_log.warning("Error executing batched command '%s': %s", label, e)
+            outcomes.append([False, f"ERROR executing command:\n{traceback.format_exc()}"])
+
+    if session.codec is DEFAULT_CODEC:
+        return json.dumps(outcomes).encode('utf-8')
+    return session.codec.encode(outcomes)
+
+
+def encode_stream(session, kind, value):
+    """Payload of a FLAG_STREAM frame: a [kind, value] pair"""
+    if session.codec is DEFAULT_CODEC:
+        return json.dumps([kind, value if kind == "stdout" else repr(value)]).encode('utf-8')
+    if session.arrays:
+        value = pack_arrays(value)
+    return session.codec.encode([kind, value])
+
+
+class ScriptOutput(io.TextIOBase):
+    """print() target for an uploaded script that streams text back to the client"""
+
+    def __init__(self, session, send):
+        self.session = session
+        self.send = send
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+        # Time-based flushes wait for a line end so print() calls are not split up
+        if (self._buffered >= SCRIPT_OUTPUT_CHUNK
+                or (text.endswith("\n") and time.monotonic() - self._last_flush >= SCRIPT_OUTPUT_INTERVAL)):
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        self._buffered = 0
+        self.send(encode_stream(self.session, "stdout", text), FLAG_STREAM)
+
+    def print(self, *args, file=None, **kwargs):
+        """print() for the script: output goes here unless another file is given"""
+        print(*args, file=self if file is None else file, **kwargs)
+
+    def emit(self, value):
+        """Stream an intermediate result; earlier output is sent first"""
+        self.flush()
+        self.send(encode_stream(self.session, "result", value), FLAG_STREAM)
+
+
+def handle_script(session, request_id, payload, send):
+    """Run an uploaded script next to the engine and return its final value.
+
+    The payload is a dict with the script `source` and an optional `export`
+    list of names to copy into the shared variable store afterwards. The
+    script sees the engine and the shared variables; its print() output and
+    values passed to emit() are streamed back while it runs. The result is
+    the value of the script's last line when that is an expression.
+    """
+    if session.codec is DEFAULT_CODEC:
+        request = json.loads(bytes(payload).decode('utf-8'))
+    else:
+        request = session.codec.decode(payload)
+    if not isinstance(request, dict) or not isinstance(request.get("source"), str):
+        raise CodecError("Script payload must be a dict with a 'source' string")
+    source = request["source"]
+    export = request.get("export", ())
+    if not isinstance(export, (list, tuple)) or not all(isinstance(name, str) for name in export):
+        raise CodecError("Script 'export' must be a list of variable names")
+    if request_log.isEnabledFor(logging.DEBUG):
+        request_log.debug("Received script %s from %s (%d lines)", request_id, session.addr, source.count("\n") + 1)
+
+    (body, tail), _ = _script_cache.lookup(source)
+    output = ScriptOutput(session, send)
+    namespace = dict(_world.globals)
+    namespace["print"] = output.print
+    namespace["emit"] = output.emit
+    try:
+        exec(body, namespace)
+        result = eval(tail, namespace) if tail is not None else None
+    finally:
+        output.flush()
+
+    missing = [name for name in export if name not in namespace]
+    if missing:
+        raise NameError(f"Script did not define the exported name(s) {', '.join(missing)}")
+    for name in export:
+        store_shared_variable(name, namespace[name])
+    return result
+
+
+def enter_world(flags, payload):
+    """Make the world a request addresses current and return the rest of its payload"""
+    global _world
+    world_id = DEFAULT_WORLD_ID
+    if flags & FLAG_WORLD:
+        world_id, payload = split_world(payload)
+    try:
+        _world = _worlds[world_id]
+    except KeyError:
+        raise NameError(f"No world with id {world_id} (it may have been evicted)") from None
+    _world.touch()
+    return payload
+
+
+def execute_request(session, request_id, flags, payload, send=None):
+    """Execute one command, batch or script frame and return the reply as (flags, payload).
+
+    `send(payload, flags)` writes an extra frame for this request ahead of
+    the reply; scripts use it to stream their output. Subscribers to the
+    request's world get their state frames once it has run. Always called
+    on the physics thread. A structured call to one of OFF_THREAD_FUNCTIONS
+    returns a function instead, which the caller runs on another thread to
+    get (flags, payload).
+    """
+    global _session
+    _session = session
+    reply = dispatch_request(session, request_id, flags, payload, send)
+    if _subscriptions:
+        _subscriptions.publish(_world.world_id)
+    return reply
+
+
+def dispatch_request(session, request_id, flags, payload, send):
+    """Run a request in its world; see execute_request"""
+    try:
+        payload = enter_world(flags, payload)
+    except Exception as e:
+        request_log.warning("Error selecting world for request %s from %s: %s", request_id, session.addr, e)
+        return flags & FLAG_BATCH | FLAG_ERROR, error_payload()
+
+    if flags & FLAG_SCRIPT:
+        try:
+            return 0, encode_result(session, handle_script(session, request_id, payload, send))
+        except Exception as e:
+            request_log.warning("Error executing script %s from %s: %s", request_id, session.addr, e)
+            return FLAG_ERROR, error_payload()
+
+    if flags & FLAG_BATCH:
+        try:
+            return FLAG_BATCH, handle_batch(session, payload)
+        except Exception as e:
+            request_log.warning("Error decoding batch from %s: %s", session.addr, e)
+            return FLAG_BATCH | FLAG_ERROR, error_payload()
+
+    if flags & FLAG_CALL:
+        call = None
+        try:
+            if session.codec is DEFAULT_CODEC:
+                raise CodecError("Structured calls need a binary codec")
+            call = session.codec.decode(payload)
+            if request_log.isEnabledFor(logging.DEBUG):
+                request_log.debug("Received call %s from %s: %s", request_id, session.addr, describe_call(call))
+            function, args, kwargs = resolve_call(call)
+            if function in OFF_THREAD_FUNCTIONS:
+                return functools.partial(finish_call, session, call, function, args, kwargs)
+            return 0, encode_result(session, function(*args, **kwargs))
+        except Exception as e:
+            request_log.warning("Error executing call '%s': %s", describe_call(call), e)
+            return FLAG_ERROR, error_payload()
+
+    # Legacy path: command source checked by prefix and run through eval()
+    command_str = "<undecoded>"
+    try:
+        command_str = decode_command(session, payload)
+        if request_log.isEnabledFor(logging.DEBUG):
+            request_log.debug("Received command %s from %s: %s", request_id, session.addr, command_str)
+
+        response_payload = b""
+        if is_remote_command(command_str):
+            actual_result_for_client = run_command(command_str)
+            response_payload = encode_result(session, actual_result_for_client)
+
+        return 0, response_payload
+    except Exception as e:
+        request_log.warning("Error executing command '%s': %s", command_str, e)
+        return FLAG_ERROR, error_payload()
+
+
+async def process_request(session, writer, request_id, flags, payload):
+    """Run one request on the physics thread and write its reply"""
+    loop = asyncio.get_running_loop()
+    backlog = threading.Semaphore(SCRIPT_OUTPUT_BACKLOG)
+
+    async def write(frame):
+        try:
+            writer.write(frame)
+            await writer.drain()
+        finally:
+            backlog.release()
+
+    def send(stream_payload, stream_flags):
+        # Called on the physics thread; the writer belongs to the event loop.
+        # A script printing faster than its client reads waits here rather
+        # than piling its output up in the transport's buffer.
+        backlog.acquire()
+        asyncio.run_coroutine_threadsafe(write(pack_frame(request_id, stream_payload, stream_flags)), loop)
+
+    reply = await _physics.run(execute_request, session, request_id, flags, payload, send)
+    if callable(reply):
+        reply = await asyncio.to_thread(reply)
+    response_flags, response_payload = reply
+    # Reply with the same request id so the client can match it; replies
+    # go out as soon as they are ready, not necessarily in request order
+    writer.write(pack_frame(request_id, response_payload, response_flags))
+    await writer.drain()
+
+
+def serve_shm_session(session):
+    """Blocking request loop for a client that moved onto shared memory rings"""
+    transport = session.transport
+    try:
+        while True:
+            frame = transport.recv_frame()
+            if frame is None:
+                log.info("Client %s disconnected gracefully.", session.addr)
+                break
+            request_id, flags, payload = frame
+            if flags & FLAG_CONTROL:
+                reply = handle_control(session, decode_control(payload))
+                transport.send_frame(request_id, encode_control(reply), FLAG_CONTROL)
+                continue
+            # This thread waits for the result, so the physics thread can use the transport meanwhile
+            send = functools.partial(transport.send_frame, request_id)
+            reply = _physics.submit(execute_request, session, request_id, flags, payload, send).result()
+            response_flags, response_payload = reply() if callable(reply) else reply
+            transport.send_frame(request_id, response_payload, response_flags)
+    finally:
+        transport.close()
+        transport.sock.close()
+
+
+async def run_in_thread(name, fn, *args):
+    """Await fn(*args) on a thread of its own.
+
+    For calls that block for the life of a connection; the event loop's
+    default executor has only a few workers to share.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def settle(method, value):
+        if not future.done():  # the awaiting task may have been cancelled meanwhile
+            method(value)
+
+    def run():
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            loop.call_soon_threadsafe(settle, future.set_exception, e)
+        else:
+            loop.call_soon_threadsafe(settle, future.set_result, result)
+
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return await future
+
+
+async def handle_client(reader, writer):
+    """Serve one client connection until it disconnects"""
+    sock = writer.get_extra_info('socket')
+    addr = writer.get_extra_info('peername') or sock.getsockname()
+    log.info("Connected by %s", addr)
+    session = ClientSession(sock, addr)
+    session.loop = asyncio.get_running_loop()
+    session.writer = writer
+    in_flight = set()
+    reply_errors = 0
+
+    def finished(task):
+        nonlocal reply_errors
+        in_flight.discard(task)
+        # Retrieve the error here, or asyncio drops it with the task
+        if task.cancelled() or task.exception() is None:
+            return
+        # A lost connection fails every pipelined reply; say so once
+        reply_errors += 1
+        level = logging.WARNING if reply_errors == 1 else logging.DEBUG
+        log.log(level, "Error replying to client %s: %s", addr, task.exception())
+
+    try:
+        while True:
+            # Read one complete framed request
+            frame = await recv_frame_async(reader)
+            if frame is None:
+                log.info("Client %s disconnected gracefully.", addr)
+                break
+            request_id, flags, payload = frame
+
+            if flags & FLAG_CONTROL:
+                # Control messages change how later frames are handled, so let
+                # earlier requests finish first
+                if in_flight:
+                    await asyncio.gather(*in_flight, return_exceptions=True)
+                reply = handle_control(session, decode_control(payload))
+                writer.write(pack_frame(request_id, encode_control(reply), FLAG_CONTROL))
+                await writer.drain()
+                if session.transport is not None:
+                    # From here on the rings carry the frames; the socket only carries doorbells
+                    session.writer = None
+                    writer.transport.pause_reading()
+                    await run_in_thread(f"shm-{addr}", serve_shm_session, session)
+                    break
+                continue
+
+            # Keep reading while the request runs, so one client can pipeline many
+            task = asyncio.create_task(process_request(session, writer, request_id, flags, payload))
+            in_flight.add(task)
+            task.add_done_callback(finished)
+
+    except ProtocolError as pe:
+        log.warning("Protocol error with client %s: %s", addr, pe)
+    except socket.error as se:
+        log.warning("Socket error with client %s: %s", addr, se)
+    except Exception as client_e:
+        log.error("Error during client %s communication: %s", addr, client_e)
+    finally:
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+        await _physics.run(_handles.release_owner, session)
+        await _physics.run(_subscriptions.drop_session, session)
+        writer.close()
+        log.info("Client %s session ended.", addr)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve PyBullet calls to remote clients.")
+    parser.add_argument("--host", default=SERVER_IP, help="TCP address to bind")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help="TCP port to bind")
+    parser.add_argument("--unix", metavar="PATH", default=SERVER_UNIX_PATH,
+                        help="also listen on a unix domain socket at PATH")
+    parser.add_argument("--no-tcp", action="store_true", help="do not open the TCP listener")
+    parser.add_argument("--code-cache-size", type=int, default=DEFAULT_CODE_CACHE_SIZE,
+                        help="compiled commands to keep for the eval path (0 disables the cache)")
+    parser.add_argument("--no-parameterize", action="store_true",
+                        help="cache commands by exact text instead of lifting out literal arguments")
+    parser.add_argument("--snapshot-budget", type=float, default=DEFAULT_SNAPSHOT_BUDGET / (1 << 20),
+                        help="megabytes of snapshots to keep in memory")
+    parser.add_argument("--snapshot-spill-dir", metavar="PATH",
+                        help="keep snapshots evicted from memory as files in PATH")
+    parser.add_argument("--handle-budget", type=float, default=DEFAULT_HANDLE_BUDGET / (1 << 20),
+                        help="megabytes of results to keep for client handles")
+    parser.add_argument("--log-level", default="info",
+                        choices=["debug", "info", "warning", "error"],
+                        help="'debug' also logs every request, which costs throughput")
+    parser.add_argument("--log-sample", type=int, default=1, metavar="N",
+                        help="keep only one in N per-request log records")
+    parser.add_argument("--log-file", metavar="PATH", help="write the log to PATH instead of stderr")
+    parser.add_argument("--world-idle-timeout", type=float, default=DEFAULT_IDLE_TIMEOUT,
+                        help="seconds without requests before a world is evicted (0 keeps worlds forever)")
+    return parser.parse_args(argv)
+
+
+async def evict_worlds_periodically(timeout):
+    """Check for idle worlds a few times per timeout period"""
+    while True:
+        await asyncio.sleep(min(timeout / 4, 60.0))
+        await _physics.run(evict_idle_worlds, timeout)
+
+
+def remove_socket_file(path):
+    """Remove a unix socket left at `path`; any other kind of file is left alone"""
+    try:
+        if stat.S_ISSOCK(os.lstat(path).st_mode):
+            os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+async def serve(args):
+    """Accept clients on every configured listener and serve them concurrently"""
+    servers = []
+    try:
+        if not args.no_tcp:
+            servers.append(await asyncio.start_server(handle_client, args.host, args.port, reuse_address=True))
+            log.info("Server listening on %s:%s", args.host, args.port)
+        if args.unix:
+            # Local clients can skip the TCP stack entirely
+            remove_socket_file(args.unix)
+            servers.append(await asyncio.start_unix_server(handle_client, args.unix))
+            log.info("Server listening on unix socket %s", args.unix)
+        if not servers:
+            log.error("Nothing to listen on: TCP is disabled and no unix socket path was given.")
+            return
+        tasks = [server.serve_forever() for server in servers]
+        if args.world_idle_timeout > 0:
+            tasks.append(evict_worlds_periodically(args.world_idle_timeout))
+        await asyncio.gather(*tasks)
+    finally:
+        for server in servers:
+            server.close()
+        if args.unix:
+            remove_socket_file(args.unix)
+
+
+def main(argv=None):
+    global _physics, _code_cache, _snapshots, _handles
+    args = parse_args(argv)
+    configure_logging(args.log_level, args.log_sample, filename=args.log_file)
+    _code_cache = CodeCache(args.code_cache_size, parameterize=not args.no_parameterize)
+    _snapshots = SnapshotCache(int(args.snapshot_budget * (1 << 20)), args.snapshot_spill_dir)
+    _handles = HandleTable(int(args.handle_budget * (1 << 20)))
+
     # Initialize default pybullet instance
     # physicsClientId = -1
     # try:
@@ -95,69 +1186,23 @@ def main():
     #         FUN_MODULE.disconnect(physicsClientId)
     #     return
 
-    # Open an IPv4 Socket
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        try:
-            s.bind((SERVER_IP, SERVER_PORT))
-            s.listen()
-            print(f"Server listening on {SERVER_IP}:{SERVER_PORT}")
-
-            # Wait for clients to connect and handle connections
-            while True:
-                print("Waiting for a client connection...")
-                conn, addr = s.accept()
-                with conn:
-                    print(f"Connected by {addr}")
-                    try:
-                        while True:
-                            # Buffer size of 8k bytes
-                            data = conn.recv(8192)
-                            if not data:
-                                print(f"Client {addr} disconnected gracefully.")
-                                break
-
-                            command_str = data.decode('utf-8')
-                            print(f"Server Received command from {addr}: {command_str}") # Log raw command
-
-                            response_message = ""
-                            try:
-                                # Global variables
-                                exec_globals = {
-                                    'set_shared_variable': set_shared_variable,
-                                    'get_shared_variable': get_shared_variable,
-                                    **_shared_variables_store 
-                                }
-
-                                # 
-                                if command_str.strip().startswith(("set_shared_variable(", "get_shared_variable(")) or \
-                                   command_str.strip().startswith("FUN.") :
-                                    actual_result_for_client = eval(command_str, exec_globals, _shared_variables_store)
-                                    response_message = repr(actual_result_for_client)
-                                
-                                print("\n")
-                            except Exception as e:
-                                print(f"Server Error executing command '{command_str}': {e}")
-                                response_message = f"ERROR executing command:\n{traceback.format_exc()}"
-                            conn.sendall(response_message.encode('utf-8'))
-
-                    except socket.error as se:
-                        print(f"Socket error with client {addr}: {se}")
-                    except Exception as client_e:
-                        print(f"Error during client {addr} communication: {client_e}")
-                    finally:
-                        print(f"Client {addr} session ended.")
-        except socket.error as e:
-            print(f"Socket error: {e}")
-        except KeyboardInterrupt:
-            print("Server shutting down due to KeyboardInterrupt.")
-        except Exception as e:
-            print(f"An unexpected server error occurred: {e}")
-        finally:
-            print("Shutting down PyBullet simulation.")
-
-            print("Server shutdown.")
+    _physics = PhysicsExecutor(on_step=_subscriptions.publish)
+    try:
+        asyncio.run(serve(args))
+    except socket.error as e:
+        log.error("Socket error: %s", e)
+    except KeyboardInterrupt:
+        log.info("Server shutting down due to KeyboardInterrupt.")
+    except Exception as e:
+        log.exception("An unexpected server error occurred: %s", e)
+    finally:
+        with _vec_envs_lock:
+            vec_envs = list(_vec_envs.values())
+        for vec_env in vec_envs:
+            vec_env.close()
+        _physics.shutdown()
+        log.info("Shutting down PyBullet simulation.")
+        log.info("Server shutdown.")
 
 if __name__ == "__main__":
     main()
-
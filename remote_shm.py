@@ -0,0 +1,228 @@
+# remote_shm.py
+import os
+import socket
+import struct
+import time
+from multiprocessing import shared_memory
+
+from remote_protocol import FRAME_HEADER, MAX_FRAME_SIZE, ProtocolError
+
+# Ring layout: a small header followed by the data area.
+#   head (uint64, bytes written) | tail (uint64, bytes read) |
+#   reader waiting (uint32) | writer waiting (uint32)
+_RING_HEADER = struct.Struct("=QQII")
+_HEAD_OFFSET = 0
+_TAIL_OFFSET = 8
+_READER_WAITING_OFFSET = 16
+_WRITER_WAITING_OFFSET = 20
+_DATA_OFFSET = 64
+
+DEFAULT_RING_SIZE = 4 << 20
+
+# Busy-poll this long before parking on the signalling socket. On a single
+# core spinning only delays the peer we are waiting for.
+SPIN_SECONDS = 50e-6 if (os.cpu_count() or 1) > 1 else 0.0
+# A doorbell is only missed when the waiting flag and the data cross in
+# flight; this bounds how long that can stall a waiting side. Idle peers
+# wake this often, so it is kept well above a round trip.
+WAKE_TIMEOUT = 0.1
+_DOORBELL = b'\x01'
+# Ringing never waits for socket buffer space
+_DOORBELL_FLAGS = getattr(socket, "MSG_DONTWAIT", 0)
+
+
+def _attach(name):
+    """Attach to a segment created by the peer without taking ownership of it"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13 has no track argument
+        shm = shared_memory.SharedMemory(name=name)
+        # Otherwise this process's resource tracker would unlink the peer's segment at exit
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class ShmRing:
+    """Single-producer single-consumer byte ring in a shared memory segment"""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        self.buf = shm.buf
+        self.capacity = shm.size - _DATA_OFFSET
+
+    @classmethod
+    def create(cls, size=DEFAULT_RING_SIZE):
+        shm = shared_memory.SharedMemory(create=True, size=size + _DATA_OFFSET)
+        _RING_HEADER.pack_into(shm.buf, 0, 0, 0, 0, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(_attach(name), owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _load(self, offset, fmt="=Q"):
+        return struct.unpack_from(fmt, self.buf, offset)[0]
+
+    def _store(self, offset, value, fmt="=Q"):
+        struct.pack_into(fmt, self.buf, offset, value)
+
+    def readable(self):
+        return self._load(_HEAD_OFFSET) - self._load(_TAIL_OFFSET)
+
+    def writable(self):
+        return self.capacity - self.readable()
+
+    def set_waiting(self, offset, waiting):
+        self._store(offset, 1 if waiting else 0, "=I")
+
+    def is_waiting(self, offset):
+        return self._load(offset, "=I") != 0
+
+    def write_some(self, view):
+        """Copy as much of `view` as fits without wrapping; return bytes written"""
+        head = self._load(_HEAD_OFFSET)
+        free = self.capacity - (head - self._load(_TAIL_OFFSET))
+        index = head % self.capacity
+        count = min(free, len(view), self.capacity - index)
+        if count:
+            start = _DATA_OFFSET + index
+            self.buf[start:start + count] = view[:count]
+            # Publish the data only after it has been copied in
+            self._store(_HEAD_OFFSET, head + count)
+        return count
+
+    def read_some(self, view):
+        """Fill as much of `view` as is available without wrapping; return bytes read"""
+        tail = self._load(_TAIL_OFFSET)
+        available = self._load(_HEAD_OFFSET) - tail
+        index = tail % self.capacity
+        count = min(available, len(view), self.capacity - index)
+        if count:
+            start = _DATA_OFFSET + index
+            view[:count] = self.buf[start:start + count]
+            self._store(_TAIL_OFFSET, tail + count)
+        return count
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class ShmTransport:
+    """Frame transport over a pair of shared memory rings.
+
+    Frames use the same header as the socket transport. The original socket
+    stays open as the signalling channel: a side that has nothing to do
+    spins briefly, then flags itself as waiting and blocks on the socket
+    until the peer rings a one-byte doorbell.
+    """
+    name = "shm"
+
+    def __init__(self, sock, inbound, outbound):
+        self.sock = sock
+        self.inbound = inbound
+        self.outbound = outbound
+        # The socket now only carries doorbells; the timeout only matters for a missed one
+        self.sock.settimeout(WAKE_TIMEOUT)
+        if sock.family in (socket.AF_INET, socket.AF_INET6):
+            # Nagle would hold back a doorbell until the previous one is acknowledged
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    @classmethod
+    def create_pair(cls, sock, size=DEFAULT_RING_SIZE):
+        """Server side: create both rings. Returns the transport and the names to send the client."""
+        inbound = ShmRing.create(size)
+        outbound = ShmRing.create(size)
+        names = {"client_to_server": inbound.name, "server_to_client": outbound.name}
+        return cls(sock, inbound, outbound), names
+
+    @classmethod
+    def attach_pair(cls, sock, names):
+        """Client side: attach to the rings the server created"""
+        inbound = ShmRing.attach(names["server_to_client"])
+        outbound = ShmRing.attach(names["client_to_server"])
+        return cls(sock, inbound, outbound)
+
+    def _ring_doorbell(self):
+        try:
+            self.sock.send(_DOORBELL, _DOORBELL_FLAGS)
+        except (socket.timeout, BlockingIOError):
+            # The peer has unread doorbells queued already, so it will wake up anyway
+            pass
+
+    def _wait(self, ring, waiting_offset, ready):
+        deadline = time.perf_counter() + SPIN_SECONDS
+        while time.perf_counter() < deadline:
+            if ready():
+                return
+        ring.set_waiting(waiting_offset, True)
+        try:
+            while not ready():
+                try:
+                    if not self.sock.recv(4096):
+                        raise ConnectionAbortedError("Peer closed the signalling channel")
+                except socket.timeout:
+                    pass
+        finally:
+            ring.set_waiting(waiting_offset, False)
+
+    def _write(self, data):
+        view = memoryview(data).cast('B')
+        while view:
+            written = self.outbound.write_some(view)
+            if written:
+                view = view[written:]
+                if self.outbound.is_waiting(_READER_WAITING_OFFSET):
+                    self._ring_doorbell()
+            else:
+                self._wait(self.outbound, _WRITER_WAITING_OFFSET, lambda: self.outbound.writable() > 0)
+
+    def _read_exactly(self, size):
+        buf = bytearray(size)
+        view = memoryview(buf)
+        while view:
+            received = self.inbound.read_some(view)
+            if received:
+                view = view[received:]
+                if self.inbound.is_waiting(_WRITER_WAITING_OFFSET):
+                    self._ring_doorbell()
+            else:
+                self._wait(self.inbound, _READER_WAITING_OFFSET, lambda: self.inbound.readable() > 0)
+        return buf
+
+    def send_frame(self, request_id, payload, flags=0):
+        if len(payload) > MAX_FRAME_SIZE:
+            raise ProtocolError(f"Frame of {len(payload)} bytes exceeds limit of {MAX_FRAME_SIZE}")
+        header = FRAME_HEADER.pack(len(payload), request_id, flags)
+        # Publish small frames in one write so the reader is woken at most once
+        if len(payload) < 65536:
+            self._write(header + payload)
+        else:
+            self._write(header)
+            self._write(payload)
+
+    def recv_frame(self):
+        try:
+            header = self._read_exactly(FRAME_HEADER.size)
+        except ConnectionAbortedError:
+            return None
+        length, request_id, flags = FRAME_HEADER.unpack(header)
+        if length > MAX_FRAME_SIZE:
+            raise ProtocolError(f"Frame of {length} bytes exceeds limit of {MAX_FRAME_SIZE}")
+        return request_id, flags, self._read_exactly(length)
+
+    def close(self):
+        self.inbound.close()
+        self.outbound.close()
+
@@ -0,0 +1,179 @@
+# remote_snapshot.py
+import hashlib
+import os
+import pickle
+from collections import OrderedDict
+
+DEFAULT_SNAPSHOT_BUDGET = 256 << 20
+
+# Rough size of a .bullet serialization: a fixed header plus so much per body
+# and per joint (measured on pybullet_data's URDFs)
+_STATE_BASE_BYTES = 16 << 10
+_STATE_BODY_BYTES = 1 << 10
+_STATE_JOINT_BYTES = 8 << 10
+
+
+def estimate_state_size(engine):
+    """Approximate bytes of the engine's state, from its body and joint counts"""
+    bodies = engine.getNumBodies()
+    joints = sum(engine.getNumJoints(engine.getBodyUniqueId(i)) for i in range(bodies))
+    return _STATE_BASE_BYTES + bodies * _STATE_BODY_BYTES + joints * _STATE_JOINT_BYTES
+
+
+class Snapshot:
+    """One saved physics state plus the shared variables that went with it"""
+    __slots__ = ("engine", "state_id", "variables", "nbytes", "path")
+
+    def __init__(self, engine, state_id, variables, nbytes, path):
+        self.engine = engine
+        # Engine-held state while in memory; None once only the spilled copy is left
+        self.state_id = state_id
+        # Pickled variables while in memory
+        self.variables = variables
+        self.nbytes = nbytes
+        # .bullet file on disk once spilled
+        self.path = path
+
+
+class SnapshotCache:
+    """LRU cache of physics snapshots with a byte budget.
+
+    In memory a snapshot is a state held by the engine (saveState), which
+    restores in well under a millisecond, plus the pickled shared variables.
+    Its size is estimated from the world's body and joint counts. Past the
+    budget the least recently used snapshots are dropped; with a spill
+    directory they are written out as a .bullet file and their variables
+    instead, and are reloaded, and moved back into memory, when restored.
+
+    Keys are (world_id, name). Restoring needs the same bodies loaded as
+    when the snapshot was taken, as with pybullet's restoreState.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_SNAPSHOT_BUDGET, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        if spill_dir:
+            os.makedirs(spill_dir, exist_ok=True)
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.evictions = 0
+        self._memory = OrderedDict()
+        self._spilled = {}
+
+    def _spill_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.spill_dir, f"{digest}.bullet")
+
+    def save(self, key, engine, variables):
+        """Snapshot the engine state and `variables` under `key`, replacing any older one"""
+        blob = pickle.dumps(variables, protocol=5)
+        self.drop(key)
+        nbytes = estimate_state_size(engine) + len(blob)
+        snapshot = Snapshot(engine, engine.saveState(), blob, nbytes, None)
+        self._remember(key, snapshot)
+        return nbytes
+
+    def _remember(self, key, snapshot):
+        self._memory[key] = snapshot
+        self.bytes += snapshot.nbytes
+        # The snapshot just saved always stays, even if it alone exceeds the budget
+        while self.bytes > self.max_bytes and len(self._memory) > 1:
+            old_key, old = self._memory.popitem(last=False)
+            self.bytes -= old.nbytes
+            self.evictions += 1
+            if self.spill_dir and old.path is None:
+                self._spill(old_key, old)
+            self._release_state(old)
+            if old.path is not None:
+                self._spilled[old_key] = old
+
+    def _spill(self, key, snapshot):
+        """Write an in-memory snapshot to the spill directory; on failure it is just dropped"""
+        engine = snapshot.engine
+        path = self._spill_path(key)
+        try:
+            # saveBullet writes the current state, so step into the snapshot's and back
+            current = engine.saveState()
+            try:
+                engine.restoreState(stateId=snapshot.state_id)
+                engine.saveBullet(path)
+            finally:
+                engine.restoreState(stateId=current)
+                engine.removeState(current)
+            with open(f"{path}.vars", "wb") as f:
+                f.write(snapshot.variables)
+        except Exception:
+            # The world and its engine states may be gone already
+            for leftover in (path, f"{path}.vars"):
+                try:
+                    os.unlink(leftover)
+                except FileNotFoundError:
+                    pass
+            return
+        snapshot.path = path
+
+    def _release_state(self, snapshot):
+        try:
+            snapshot.engine.removeState(snapshot.state_id)
+        except Exception:
+            pass  # the world and its engine states may be gone already
+        snapshot.state_id = None
+        snapshot.variables = None
+
+    def restore(self, key, engine):
+        """Put the engine back into the snapshot's state and return a fresh copy of its variables"""
+        snapshot = self._memory.get(key)
+        if snapshot is not None:
+            self.hits += 1
+            self._memory.move_to_end(key)
+            engine.restoreState(stateId=snapshot.state_id)
+            return pickle.loads(snapshot.variables)
+
+        snapshot = self._spilled.pop(key, None)
+        if snapshot is None:
+            raise KeyError(f"No snapshot named {key[1]!r}")
+        try:
+            engine.restoreState(fileName=snapshot.path)
+            with open(f"{snapshot.path}.vars", "rb") as f:
+                snapshot.variables = f.read()
+        except BaseException:
+            self._spilled[key] = snapshot
+            raise
+        self.disk_hits += 1
+        # Back in memory: the next restore is served by the engine directly
+        snapshot.engine = engine
+        snapshot.state_id = engine.saveState()
+        self._remember(key, snapshot)
+        return pickle.loads(snapshot.variables)
+
+    def drop(self, key):
+        """Forget a snapshot; returns whether there was one"""
+        snapshot = self._memory.pop(key, None)
+        if snapshot is not None:
+            self.bytes -= snapshot.nbytes
+            self._release_state(snapshot)
+        else:
+            snapshot = self._spilled.pop(key, None)
+        if snapshot is None:
+            return False
+        if snapshot.path is not None:
+            for path in (snapshot.path, f"{snapshot.path}.vars"):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+        return True
+
+    def drop_world(self, world_id):
+        """Forget every snapshot of a world"""
+        for key in [key for key in (*self._memory, *self._spilled) if key[0] == world_id]:
+            self.drop(key)
+
+    def names(self, world_id):
+        return [key[1] for key in (*self._memory, *self._spilled) if key[0] == world_id]
+
+    def stats(self):
+        return {"in_memory": len(self._memory), "spilled": len(self._spilled), "bytes": self.bytes,
+                "max_bytes": self.max_bytes, "hits": self.hits, "disk_hits": self.disk_hits,
+                "evictions": self.evictions}
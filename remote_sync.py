@@ -0,0 +1,126 @@
+# remote_sync.py
+import hashlib
+import itertools
+import operator
+
+# A delta is only sent when it rewrites at most this share of a container;
+# past that the whole value is cheaper to send and to apply
+MAX_DELTA_FRACTION = 0.5
+
+
+class VersionConflict(Exception):
+    """The server's copy of a variable is not the one a delta was computed against"""
+
+
+def _digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class SyncState:
+    """What a client last sent for one shared variable.
+
+    `version` is the server's version number after that update and
+    `digest` a hash of the value's encoding. For lists and dicts a key per
+    element is kept too (see fingerprint), so the next update can be
+    narrowed down to the elements that changed without keeping a copy of
+    the containers in the value.
+    """
+    __slots__ = ("version", "digest", "kind", "items")
+
+    def __init__(self, version, digest, kind, items):
+        self.version = version
+        self.digest = digest
+        self.kind = kind
+        self.items = items
+
+
+# Immutable values that stand for themselves when comparing elements;
+# anything else is compared by the hash of its encoding
+_PLAIN_TYPES = frozenset((int, float, complex, bool, str, bytes, type(None)))
+
+
+def _element_keys(items, encode):
+    items = list(items)
+    # Lists of plain numbers and strings, the common large case, are copied at C speed
+    if _PLAIN_TYPES.issuperset(map(type, items)):
+        return items
+    return [item if type(item) in _PLAIN_TYPES else _digest(encode(item)) for item in items]
+
+
+def _differs(old, new):
+    # 1, 1.0 and True compare equal but are different values to send
+    return old != new or type(old) is not type(new)
+
+
+def fingerprint(value, encode):
+    """(digest, kind, element keys) of a value, using `encode` to serialize it.
+
+    The digest covers the whole encoding. For lists and dicts each element
+    also gets a key to compare by: plain values stand for themselves and
+    anything else is represented by its own digest.
+    """
+    digest = _digest(encode(value)).hex()
+    kind = type(value)
+    if kind is list:
+        return digest, "list", _element_keys(value, encode)
+    if kind is dict:
+        return digest, "dict", dict(zip(value, _element_keys(value.values(), encode)))
+    return digest, "value", None
+
+
+def plan_update(state, value, encode):
+    """Work out how to bring the server's copy of a variable up to `value`.
+
+    Returns (change, digest, kind, items): `change` is None when the value
+    is unchanged since `state`, ["value", value] to replace it, or a delta:
+    ["list", length, [[index, item], ...]] or ["dict", [[key, item], ...],
+    [deleted keys]].
+    """
+    digest, kind, items = fingerprint(value, encode)
+    if state is not None and state.digest == digest:
+        return None, digest, kind, items
+    change = ["value", value]
+    if state is not None and state.kind == kind == "list":
+        old = state.items
+        common = min(len(old), len(items))
+        # Elements that are still the same objects cannot have changed; finding
+        # the others runs in C, so only those get the slower typed comparison
+        suspects = itertools.compress(range(common), map(operator.is_not, old, items))
+        changed = [[index, value[index]] for index in suspects if _differs(old[index], items[index])]
+        changed.extend([index, value[index]] for index in range(common, len(items)))
+        if len(changed) <= MAX_DELTA_FRACTION * len(items):
+            change = ["list", len(items), changed]
+    elif state is not None and state.kind == kind == "dict":
+        changed = [[key, value[key]] for key, item in items.items()
+                   if key not in state.items or _differs(state.items[key], item)]
+        deleted = [key for key in state.items if key not in items]
+        if len(changed) + len(deleted) <= MAX_DELTA_FRACTION * max(len(items), 1):
+            change = ["dict", changed, deleted]
+    return change, digest, kind, items
+
+
+def apply_update(current, change):
+    """The new value of a variable after `change`; `current` is left untouched"""
+    kind = change[0]
+    if kind == "value":
+        return change[1]
+    if kind == "list":
+        if type(current) is not list:
+            raise VersionConflict("List delta for a value that is not a list")
+        _, length, changed = change
+        updated = current[:length]
+        updated.extend([None] * (length - len(updated)))
+        for index, item in changed:
+            updated[index] = item
+        return updated
+    if kind == "dict":
+        if type(current) is not dict:
+            raise VersionConflict("Dict delta for a value that is not a dict")
+        _, changed, deleted = change
+        updated = dict(current)
+        for key in deleted:
+            updated.pop(key, None)
+        for key, item in changed:
+            updated[key] = item
+        return updated
+    raise ValueError(f"Unknown shared variable change {kind!r}")
@@ -0,0 +1,163 @@
+# remote_vec_env.py
+import multiprocessing
+import os
+import threading
+import traceback
+
+import pybullet as FUN
+
+from remote_world import WorldEngine
+
+try:
+    import numpy as np
+except ImportError:  # Vectorized environments need NumPy on the server
+    np = None
+
+
+def _load_env(source, index):
+    """Run an environment script in a fresh namespace bound to its own physics client"""
+    client_id = FUN.connect(FUN.DIRECT)
+    if client_id < 0:
+        raise RuntimeError(f"Could not start a physics client for environment {index}")
+    namespace = {"FUN": WorldEngine(client_id), "ENV_INDEX": index, "np": np}
+    exec(compile(source, f"<vec env {index}>", "exec"), namespace)
+    for name in ("reset", "step"):
+        if not callable(namespace.get(name)):
+            raise NameError(f"Environment script must define {name}()")
+    return namespace
+
+
+def _worker_main(conn, source, indices):
+    """Worker process: host a slice of the environments and serve step/reset requests"""
+    try:
+        envs = [_load_env(source, index) for index in indices]
+        conn.send(("ok", len(envs)))
+    except Exception:
+        conn.send(("error", traceback.format_exc()))
+        return
+    while True:
+        try:
+            op, argument = conn.recv()
+        except EOFError:
+            break
+        if op == "close":
+            break
+        try:
+            if op == "reset":
+                reply = [env["reset"]() for env in envs]
+            elif op == "step":
+                reply = []
+                for env, action in zip(envs, argument):
+                    observation, reward, done = env["step"](action)
+                    if done:
+                        # Auto-reset, so every slot always holds a running episode
+                        observation = env["reset"]()
+                    reply.append((observation, reward, done))
+            else:
+                raise ValueError(f"Unknown vec env op {op!r}")
+            conn.send(("ok", reply))
+        except Exception:
+            conn.send(("error", traceback.format_exc()))
+    conn.close()
+
+
+class VecEnv:
+    """N copies of an environment spread over a pool of worker processes.
+
+    The environment is a script defining reset() -> observation and
+    step(action) -> (observation, reward, done). Each copy runs in its own
+    namespace with FUN bound to its own physics client and ENV_INDEX set to
+    its position. Workers are started with 'spawn', so they do not inherit
+    the server's threads or engine state. Copies whose episode ends are
+    reset automatically and report the first observation of the new one.
+    Calls may come from any thread; they take turns on the worker pipes.
+    """
+
+    def __init__(self, source, num_envs, num_workers=None):
+        if np is None:
+            raise RuntimeError("Vectorized environments need NumPy on the server")
+        if num_envs < 1:
+            raise ValueError(f"num_envs must be at least 1, got {num_envs}")
+        num_workers = min(num_envs, num_workers or os.cpu_count() or 1)
+        self.num_envs = num_envs
+        self._lock = threading.Lock()
+        context = multiprocessing.get_context("spawn")
+        # Contiguous slices, so stacking worker replies keeps environment order
+        bounds = [num_envs * i // num_workers for i in range(num_workers + 1)]
+        self.slices = [range(bounds[i], bounds[i + 1]) for i in range(num_workers)]
+        self.connections = []
+        self.processes = []
+        try:
+            for indices in self.slices:
+                parent, child = context.Pipe()
+                process = context.Process(target=_worker_main, args=(child, source, list(indices)), daemon=True)
+                process.start()
+                child.close()
+                self.connections.append(parent)
+                self.processes.append(process)
+            self._gather()
+        except BaseException:
+            self.close()
+            raise
+
+    def _gather(self):
+        replies = []
+        errors = []
+        for conn in self.connections:
+            try:
+                status, value = conn.recv()
+            except EOFError:
+                status, value = "error", "Worker process exited unexpectedly"
+            if status == "ok":
+                replies.append(value)
+            else:
+                errors.append(value)
+        if errors:
+            raise RuntimeError(f"Vec env worker failed:\n{errors[0]}")
+        return replies
+
+    def reset_all(self):
+        """Reset every copy and return the stacked observations"""
+        with self._lock:
+            self._check_open()
+            for conn in self.connections:
+                conn.send(("reset", None))
+            replies = self._gather()
+        return np.stack([np.asarray(obs) for reply in replies for obs in reply])
+
+    def step_all(self, actions):
+        """Step every copy with its action; returns stacked (observations, rewards, dones)"""
+        if len(actions) != self.num_envs:
+            raise ValueError(f"Expected {self.num_envs} actions, got {len(actions)}")
+        with self._lock:
+            self._check_open()
+            # All workers step at once; only then are the replies collected
+            for conn, indices in zip(self.connections, self.slices):
+                conn.send(("step", [actions[i] for i in indices]))
+            results = [result for reply in self._gather() for result in reply]
+        observations = np.stack([np.asarray(result[0]) for result in results])
+        rewards = np.array([result[1] for result in results], dtype=np.float64)
+        dones = np.array([result[2] for result in results], dtype=bool)
+        return observations, rewards, dones
+
+    def _check_open(self):
+        if not self.connections:
+            raise RuntimeError("Vec env is closed")
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        for conn in self.connections:
+            try:
+                conn.send(("close", None))
+                conn.close()
+            except (OSError, ValueError):
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.connections = []
+        self.processes = []
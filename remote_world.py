@@ -0,0 +1,77 @@
+# remote_world.py
+import time
+
+import pybullet as FUN
+
+# World every request without a world id runs in; it uses the pybullet module as is
+DEFAULT_WORLD_ID = 0
+# Seconds a world may go without requests before it is evicted
+DEFAULT_IDLE_TIMEOUT = 600.0
+
+
+class WorldEngine:
+    """Stands in for the pybullet module inside one world.
+
+    Every engine function is called with the world's physicsClientId unless
+    the caller passes one, and constants are passed through. The world owns
+    its physics client, so connect() just returns it and disconnect() does
+    nothing; use destroy_world() to get rid of a world.
+    """
+
+    def __init__(self, client_id):
+        self.client_id = client_id
+
+    def __getattr__(self, name):
+        value = getattr(FUN, name)
+        if callable(value) and not name.startswith("_"):
+            value = self._bind(name, value)
+        # Cache on the instance so later lookups skip __getattr__
+        setattr(self, name, value)
+        return value
+
+    def _bind(self, name, function):
+        client_id = self.client_id
+        if name == "connect":
+            return lambda *args, **kwargs: client_id
+        if name == "disconnect":
+            return lambda *args, **kwargs: None
+
+        def call(*args, **kwargs):
+            kwargs.setdefault("physicsClientId", client_id)
+            return function(*args, **kwargs)
+        call.__name__ = name
+        call.__doc__ = function.__doc__
+        return call
+
+
+class World:
+    """One isolated simulation: a physics client with its own variables.
+
+    `store` holds the shared variables and `globals` is the namespace
+    commands are evaluated in; `table` maps structured call names to
+    functions. `versions` maps each variable to [version, digest], where
+    the version goes up on every assignment and the digest is the content
+    hash the assigning client sent, if any. Observations and the real-time
+    stepper are per world too.
+    """
+
+    def __init__(self, world_id, engine, client_id, store, globals, table):
+        self.world_id = world_id
+        self.engine = engine
+        self.client_id = client_id
+        self.store = store
+        self.globals = globals
+        self.table = table
+        self.versions = {}
+        self.observations = {}
+        self.last_used = time.monotonic()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def idle_for(self):
+        return time.monotonic() - self.last_used
+
+    def describe(self):
+        return {"world_id": self.world_id, "client_id": self.client_id,
+                "variables": len(self.store), "idle": self.idle_for()}
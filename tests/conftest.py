@@ -0,0 +1,73 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The modules live at the top of the repository rather than in a package
+sys.path.insert(0, ROOT)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(*args):
+    """Run remote_server.py with `args` on a free port; returns (process, port)"""
+    pytest.importorskip("pybullet")
+    port = _free_port()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "remote_server.py"), "--port", str(port),
+                                "--log-level", "warning", *args],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process, port
+        except OSError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError("remote_server.py did not start")
+            time.sleep(0.1)
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+@pytest.fixture(scope="session")
+def server_port():
+    process, port = start_server()
+    yield port
+    stop_server(process)
+
+
+@pytest.fixture
+def connect(server_port):
+    """connect(**options) -> a RemoteClient in a world of its own, closed after the test"""
+    from remote_client import RemoteClient
+    clients = []
+
+    def connect(port=server_port, **options):
+        client = RemoteClient(server_port=port, **options)
+        assert client.connect()
+        clients.append(client)
+        client.create_world()
+        return client
+
+    yield connect
+    for client in clients:
+        try:
+            client.destroy_world()
+        except Exception:
+            pass
+        client.close()
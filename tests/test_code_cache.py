@@ -0,0 +1,99 @@
+import pytest
+
+from remote_code_cache import CodeCache, ScriptCache
+
+
+def run(cache, command, namespace=None):
+    code, bindings = cache.lookup(command)
+    return eval(code, {"f": lambda *args, **kwargs: (args, kwargs), **(namespace or {})}, bindings)
+
+
+COMMANDS = [
+    'f(1, 2.5, -3, 0x1F, 1_000, 2e3, 1j)',
+    '''f("a", 'b', "it's", "\\n", 'say "hi"')''',
+    'f(f"id 1 here")',
+    'f(f"{1} and {x[0]:10}", y=7)',
+    'f(r"C:\\data 2 x")',
+    'f(b"a 3 b", rb"\\d 4")',
+    'f(u"u 5")',
+    'f("""triple 6 "quoted" """)',
+    "f('''a 7\nb''')",
+    'f("a" "b 8", "c")',
+    'f("d" f"{9}")',
+    'f("é", 10, key="ü 11")',
+    'f([1, 2], {"k": (3,)}, x[0])',
+    'f(True, None, ...)',
+    'f(\n  "multi",\n  12)',
+]
+
+
+@pytest.mark.parametrize("command", COMMANDS)
+def test_results_match_plain_eval(command):
+    namespace = {"x": [5], "f": lambda *args, **kwargs: (args, kwargs)}
+    expected = eval(command, namespace)
+    cache = CodeCache()
+    # Twice: the first lookup checks the template, the second uses the result
+    assert run(cache, command, namespace) == expected
+    assert run(cache, command, namespace) == expected
+
+
+@pytest.mark.parametrize("command", COMMANDS)
+def test_results_match_after_a_similar_command(command):
+    """A command that shares a template with one seen before still runs as written"""
+    namespace = {"x": [5], "f": lambda *args, **kwargs: (args, kwargs)}
+    cache = CodeCache()
+    for other in COMMANDS:
+        run(cache, other, namespace)
+    assert run(cache, command, namespace) == eval(command, namespace)
+
+
+def test_literals_share_a_template():
+    cache = CodeCache()
+    for i in range(10):
+        assert run(cache, f'f({i}, "name {i}", {i / 2})') == ((i, f"name {i}", i / 2), {})
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 9
+
+
+def test_prefixed_strings_keep_their_text():
+    cache = CodeCache()
+    for _ in range(2):
+        assert run(cache, 'f(f"id 1 here")') == (("id 1 here",), {})
+        assert run(cache, 'f(f"id 2 here")') == (("id 2 here",), {})
+        assert run(cache, 'f(r"C:\\data 2 x", b"a 3 b")') == (("C:\\data 2 x", b"a 3 b"), {})
+        assert run(cache, 'f("a" "b 4")') == (("ab 4",), {})
+
+
+def test_literal_types_are_kept():
+    cache = CodeCache()
+    assert run(cache, "f(1)") == ((1,), {})
+    assert type(run(cache, "f(1.0)")[0][0]) is float
+    assert type(run(cache, "f(1)")[0][0]) is int
+
+
+def test_without_parameterize():
+    cache = CodeCache(parameterize=False)
+    run(cache, "f(1)")
+    run(cache, "f(2)")
+    assert cache.stats()["misses"] == 2
+
+
+def test_syntax_errors_are_raised():
+    with pytest.raises(SyntaxError):
+        CodeCache().lookup("f(1")
+
+
+def test_lru_bound():
+    cache = CodeCache(maxsize=4, parameterize=False)
+    for i in range(10):
+        run(cache, f"f({i})")
+    assert cache.stats()["size"] == 4
+
+
+def test_script_cache_returns_last_expression():
+    body, tail = ScriptCache().lookup("x = 2\nx * 3")[0]
+    namespace = {}
+    exec(body, namespace)
+    assert eval(tail, namespace) == 6
+    body, tail = ScriptCache().lookup("x = 2")[0]
+    assert tail is None
@@ -0,0 +1,127 @@
+import ast
+
+import pytest
+
+from remote_codec import CODECS, CodecError, TaggedCodec, codec_for_peer, negotiate_codec, np, pack_arrays
+
+needs_numpy = pytest.mark.skipif(np is None, reason="needs NumPy")
+
+VALUES = [
+    None, True, False, 0, -1, 1 << 62, -(1 << 63), 1 << 64, -(1 << 100), 0.5, -0.0, "", "héllo",
+    b"", b"\x00\xff", [], (), {}, [1], (1.5,), [1, 2, 3], (1.0, 2.0, 3.0), [1, 2.0], [True, False],
+    [1 << 70, 1], {"a": [1, 2], 3: (None, "x")}, [[1.0, 2.0], [3.0, 4.0]], ((0.0, 0.0, 1.0), (0.0, 0.0, 0.0, 1.0)),
+]
+
+
+@pytest.mark.parametrize("value", VALUES + [float("inf")], ids=repr)
+@pytest.mark.parametrize("name", ["tagged", "pickle"])
+def test_binary_round_trip(name, value):
+    codec = CODECS[name]
+    decoded = codec.decode(codec.encode(value))
+    assert decoded == value
+    assert type(decoded) is type(value)
+
+
+@pytest.mark.parametrize("value", VALUES, ids=repr)
+def test_text_round_trip(value):
+    codec = CODECS["text"]
+    assert ast.literal_eval(codec.decode(codec.encode(value))) == value
+
+
+def test_tagged_keeps_element_types():
+    codec = CODECS["tagged"]
+    decoded = codec.decode(codec.encode([1, 1.0, True]))
+    assert [type(item) for item in decoded] == [int, float, bool]
+
+
+def test_tagged_packs_numeric_sequences():
+    codec = CODECS["tagged"]
+    floats = [float(i) for i in range(100)]
+    # A one-byte tag, a 4-byte length and 8 bytes per element
+    assert len(codec.encode(floats)) == 5 + 8 * len(floats)
+    assert codec.decode(codec.encode(floats)) == floats
+
+
+def test_tagged_rejects_trailing_bytes():
+    codec = CODECS["tagged"]
+    with pytest.raises(CodecError):
+        codec.decode(bytes(codec.encode(1)) + b"\x00")
+
+
+def test_tagged_rejects_truncated_payload():
+    codec = CODECS["tagged"]
+    with pytest.raises(CodecError):
+        codec.decode(bytes(codec.encode("hello"))[:-1])
+
+
+def test_tagged_rejects_unknown_types():
+    with pytest.raises(CodecError):
+        CODECS["tagged"].encode(object())
+
+
+@needs_numpy
+@pytest.mark.parametrize("dtype", ["float64", "float32", "int64", "int16", "uint8", "bool"])
+def test_tagged_ndarray_round_trip(dtype):
+    codec = CODECS["tagged"]
+    value = (np.arange(24) % 7).astype(dtype).reshape(2, 3, 4)
+    decoded = codec.decode(codec.encode(value))
+    assert decoded.dtype == value.dtype
+    assert decoded.shape == value.shape
+    assert np.array_equal(decoded, value)
+
+
+@needs_numpy
+def test_tagged_ndarray_non_contiguous():
+    codec = CODECS["tagged"]
+    value = np.arange(20.0).reshape(4, 5)[:, ::2]
+    assert np.array_equal(codec.decode(codec.encode(value)), value)
+
+
+@needs_numpy
+def test_tagged_ndarray_is_aligned_in_payload():
+    codec = CODECS["tagged"]
+    decoded = codec.decode(codec.encode(["x", np.arange(5.0), np.arange(3, dtype=np.int64)]))
+    assert all(array.ctypes.data % 8 == 0 for array in decoded[1:])
+
+
+@needs_numpy
+def test_tagged_sends_lists_without_arrays():
+    codec = codec_for_peer(CODECS["tagged"], arrays=False)
+    value = {"a": np.arange(6.0).reshape(2, 3), "b": [np.int32(3)]}
+    assert codec.decode(codec.encode(value)) == {"a": [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]], "b": [3]}
+    assert codec_for_peer(CODECS["tagged"], arrays=True) is CODECS["tagged"]
+
+
+@needs_numpy
+def test_pickle_sends_lists_without_arrays():
+    codec = codec_for_peer(CODECS["pickle"], arrays=False)
+    value = {"a": np.arange(6.0).reshape(2, 3), "b": (np.int32(3), [np.float32(0.5)])}
+    decoded = codec.decode(codec.encode(value))
+    assert decoded == {"a": [[0.0, 1.0, 2.0], [3.0, 4.0, 5.0]], "b": (3, [0.5])}
+    assert type(decoded["b"][0]) is int and type(decoded["b"][1][0]) is float
+    assert codec_for_peer(CODECS["pickle"], arrays=True) is CODECS["pickle"]
+    assert isinstance(CODECS["pickle"].decode(CODECS["pickle"].encode(value))["a"], np.ndarray)
+
+
+@needs_numpy
+def test_text_sends_arrays_as_lists():
+    codec = CODECS["text"]
+    assert ast.literal_eval(codec.decode(codec.encode((np.arange(3), 1)))) == ([0, 1, 2], 1)
+
+
+@needs_numpy
+def test_pack_arrays():
+    pixels = [[i % 256 for i in range(32)] for _ in range(4)]
+    packed = pack_arrays((4, 32, pixels, [1.0, 2.0]))
+    assert isinstance(packed, tuple)
+    assert packed[:2] == (4, 32)
+    assert packed[2].dtype == np.uint8 and packed[2].shape == (4, 32)
+    # Too small to be worth an array
+    assert packed[3] == [1.0, 2.0]
+    round_trip = TaggedCodec().decode(TaggedCodec().encode(packed))
+    assert np.array_equal(round_trip[2], np.array(pixels))
+
+
+def test_negotiate_codec():
+    assert negotiate_codec(["nope", "tagged", "pickle"]) is CODECS["tagged"]
+    assert negotiate_codec(["nope"]) is CODECS["text"]
@@ -0,0 +1,154 @@
+import pytest
+
+from remote_codec import CODECS, np
+
+pytestmark = pytest.mark.skipif(np is None, reason="delta encoding needs NumPy")
+
+if np is not None:
+    from remote_delta import DEFAULT_POSITION_RANGE, INT16_MAX, FrameDecoder, FrameEncoder
+
+
+def make_frame(seq, bodies=4, joints=6, seed=0):
+    rng = np.random.default_rng(seed)
+    orientations = rng.normal(size=(bodies, 4))
+    return {
+        "seq": seq,
+        "time": seq / 60.0,
+        "base_positions": rng.uniform(-5, 5, size=(bodies, 3)),
+        "base_orientations": orientations / np.linalg.norm(orientations, axis=1, keepdims=True),
+        "joint_positions": rng.uniform(-3, 3, size=joints),
+        "joint_velocities": rng.normal(size=joints),
+        "joint_torques": np.zeros(joints),
+        "contact_counts": np.zeros(bodies, dtype=np.int64),
+    }
+
+
+def transmit(encoder, decoder, frame):
+    """Encode a frame, send it through the tagged codec and decode it"""
+    codec = CODECS["tagged"]
+    encoded = encoder.encode(frame)
+    return encoded, decoder.decode(codec.decode(codec.encode(encoded)))
+
+
+def assert_close(decoded, frame, tolerance):
+    for name in ("base_positions", "base_orientations", "joint_positions", "joint_velocities",
+                 "joint_torques", "contact_counts"):
+        np.testing.assert_allclose(decoded[name], frame[name], rtol=0, atol=tolerance, err_msg=name)
+    assert decoded["seq"] == frame["seq"]
+    assert decoded["time"] == frame["time"]
+
+
+def test_keyframe_is_exact():
+    encoder, decoder = FrameEncoder(), FrameDecoder()
+    frame = make_frame(1)
+    encoded, decoded = transmit(encoder, decoder, frame)
+    assert encoded["keyframe"] and encoded["bodies"] is None
+    assert_close(decoded, frame, 0)
+    assert decoded["base_positions"].shape == (4, 3)
+    assert decoded["base_orientations"].shape == (4, 4)
+
+
+def test_deltas_send_only_what_moved():
+    encoder, decoder = FrameEncoder(epsilon=1e-4), FrameDecoder()
+    frame = make_frame(1)
+    transmit(encoder, decoder, frame)
+    moved = dict(frame, seq=2, time=2 / 60.0)
+    moved["base_positions"] = frame["base_positions"].copy()
+    moved["base_positions"][2, 1] += 0.5
+    moved["joint_positions"] = frame["joint_positions"].copy()
+    moved["joint_positions"][[0, 5]] += 0.25
+    encoded, decoded = transmit(encoder, decoder, moved)
+    assert not encoded["keyframe"]
+    assert list(encoded["bodies"]) == [2]
+    assert list(encoded["changes"]["joint_positions"][0]) == [0, 5]
+    assert len(encoded["changes"]["joint_velocities"][0]) == 0
+    assert_close(decoded, moved, 0)
+
+
+def test_small_changes_accumulate_until_sent():
+    epsilon = 1e-3
+    encoder, decoder = FrameEncoder(epsilon=epsilon), FrameDecoder()
+    frame = make_frame(1)
+    transmit(encoder, decoder, frame)
+    for seq in range(2, 20):
+        frame = dict(frame, seq=seq)
+        frame["base_positions"] = frame["base_positions"] + 4e-4
+        _, decoded = transmit(encoder, decoder, frame)
+        # Never further off than epsilon, however many small steps were skipped
+        assert_close(decoded, frame, epsilon)
+
+
+def test_random_walk_stays_within_epsilon():
+    epsilon = 1e-3
+    encoder, decoder = FrameEncoder(epsilon=epsilon, keyframe_interval=10), FrameDecoder()
+    rng = np.random.default_rng(1)
+    frame = make_frame(1)
+    keyframes = 0
+    for seq in range(1, 50):
+        frame = dict(frame, seq=seq)
+        for name in ("base_positions", "base_orientations", "joint_positions", "joint_velocities"):
+            frame[name] = frame[name] + rng.normal(scale=2e-3, size=frame[name].shape)
+        encoded, decoded = transmit(encoder, decoder, frame)
+        keyframes += encoded["keyframe"]
+        assert_close(decoded, frame, epsilon)
+    assert keyframes == 5
+    assert encoder.stats() == {"frames": 49, "keyframes": 5}
+
+
+def test_quantized_reconstruction():
+    encoder, decoder = FrameEncoder(epsilon=1e-4, quantize=True), FrameDecoder()
+    position_step = DEFAULT_POSITION_RANGE / INT16_MAX
+    rng = np.random.default_rng(2)
+    frame = make_frame(1)
+    for seq in range(1, 30):
+        frame = dict(frame, seq=seq)
+        frame["base_positions"] = frame["base_positions"] + rng.normal(scale=0.01, size=(4, 3))
+        encoded, decoded = transmit(encoder, decoder, frame)
+        assert encoded["base_positions"].dtype == np.int16
+        assert encoded["base_orientations"].dtype == np.int16
+        np.testing.assert_allclose(decoded["base_positions"], frame["base_positions"], rtol=0, atol=position_step)
+        np.testing.assert_allclose(decoded["base_orientations"], frame["base_orientations"], rtol=0,
+                                   atol=1.0 / INT16_MAX)
+        # Joints are never quantized
+        np.testing.assert_array_equal(decoded["joint_positions"], frame["joint_positions"])
+
+
+def test_quantize_falls_back_to_floats_out_of_range():
+    encoder, decoder = FrameEncoder(quantize=True, position_range=1.0), FrameDecoder()
+    frame = make_frame(1)
+    frame["base_positions"][0, 0] = 50.0
+    encoded, decoded = transmit(encoder, decoder, frame)
+    assert encoded["scales"][0] is None
+    assert encoded["scales"][1] is not None
+    np.testing.assert_array_equal(decoded["base_positions"], frame["base_positions"])
+
+
+def test_decoder_waits_for_a_keyframe():
+    encoder = FrameEncoder()
+    encoder.encode(make_frame(1))
+    delta = encoder.encode(make_frame(2, seed=1))
+    decoder = FrameDecoder()
+    assert decoder.decode(delta) is None
+    _, decoded = transmit(encoder, decoder, make_frame(3, seed=2))
+    assert decoded is None
+    encoder = FrameEncoder()
+    frame = make_frame(4, seed=3)
+    _, decoded = transmit(encoder, decoder, frame)
+    assert_close(decoded, frame, 0)
+
+
+def test_decoded_frames_are_independent():
+    encoder, decoder = FrameEncoder(), FrameDecoder()
+    _, first = transmit(encoder, decoder, make_frame(1))
+    kept = first["base_positions"].copy()
+    transmit(encoder, decoder, make_frame(2, seed=5))
+    np.testing.assert_array_equal(first["base_positions"], kept)
+
+
+def test_frames_without_joints():
+    encoder, decoder = FrameEncoder(), FrameDecoder()
+    frame = make_frame(1)
+    for name in ("joint_positions", "joint_velocities", "joint_torques", "contact_counts"):
+        del frame[name]
+    _, decoded = transmit(encoder, decoder, frame)
+    assert sorted(decoded) == ["base_orientations", "base_positions", "seq", "time"]
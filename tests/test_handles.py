@@ -0,0 +1,126 @@
+import time
+
+import pytest
+
+from conftest import start_server, stop_server
+from remote_handles import HandleTable, decode_key, encode_key
+
+# 64x48 camera images are held as a 37000-byte tuple
+WIDTH, HEIGHT = 64, 48
+
+
+def camera(client):
+    return client.call_handle("getCameraImage", WIDTH, HEIGHT)
+
+
+def held(client):
+    # A request first, so handles dropped on this side are released on the server
+    client.call("getNumBodies")
+    return client.handle_stats()
+
+
+def held_after_disconnect(client, handles):
+    # The server frees a closed client's handles once it notices the disconnect
+    deadline = time.monotonic() + 5
+    while held(client)["handles"] != handles and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return held(client)["handles"]
+
+
+def test_table_keeps_large_values_only():
+    table = HandleTable(inline_bytes=100)
+    assert table.wrap(b"x" * 100, "a") == ["value", b"x" * 100]
+    kind, info = table.wrap(b"x" * 101, "a")
+    assert kind == "handle" and info["type"] == "bytes" and info["len"] == 101
+    assert table.get(info["handle"]) == b"x" * 101
+
+
+def test_table_counts_references_per_owner():
+    table = HandleTable()
+    handle_id = table.add(b"data", "a")["handle"]
+    table.retain(handle_id, "a")
+    table.retain(handle_id, "b")
+    assert not table.release(handle_id, "a")
+    assert not table.release(handle_id, "c")  # holds no reference, so changes nothing
+    table.release_owner("b")
+    assert table.get(handle_id) == b"data"
+    assert table.release(handle_id, "a")
+    with pytest.raises(KeyError):
+        table.get(handle_id)
+    assert table.stats()["bytes"] == 0
+
+
+def test_table_evicts_least_recently_used():
+    table = HandleTable(max_bytes=300)
+    first, second = (table.add(value, "a", nbytes=100)["handle"] for value in ("first", "second"))
+    table.get(first)
+    third = table.add("third", "a", nbytes=150)["handle"]
+    assert table.get(first) == "first" and table.get(third) == "third"
+    with pytest.raises(KeyError):
+        table.get(second)
+    # The newest handle stays even when it alone is over the budget
+    big = table.add("big", "a", nbytes=1000)["handle"]
+    assert table.get(big) == "big"
+    assert table.stats()["handles"] == 1 and table.evictions == 3
+
+
+@pytest.mark.parametrize("key", [3, -1, slice(1, None, 2), Ellipsis, (slice(None), 0), (Ellipsis, slice(2, 4))])
+def test_keys_survive_encoding(key):
+    assert decode_key(encode_key(key)) == key
+
+
+def test_handle_runs_on_the_server(connect):
+    client = connect()
+    image = client.call("getCameraImage", WIDTH, HEIGHT)
+    handle = camera(client)
+    assert handle.type == "tuple" and len(handle) == 5
+    assert handle[0] == WIDTH and handle[1] == HEIGHT
+    assert handle[0:2] == (WIDTH, HEIGHT)
+    assert handle[2] == image[2]
+    assert handle.index(HEIGHT) == 1
+    assert handle.fetch() == image
+
+
+def test_released_handles_are_freed(connect):
+    client = connect()
+    before = held(client)
+    handle = camera(client)
+    with camera(client):
+        assert held(client)["handles"] == before["handles"] + 2
+        assert held(client)["bytes"] > before["bytes"]
+    assert held(client)["handles"] == before["handles"] + 1
+    del handle
+    assert held(client) == before
+
+
+def test_handles_outlive_their_owner_only_if_retained(connect):
+    owner, other = connect(), connect()
+    before = held(other)
+    kept, dropped = camera(owner), camera(owner)
+    retained = other.retain_handle(kept.id)
+    assert retained.type == "tuple" and len(retained) == 5
+    owner.close()
+    assert held_after_disconnect(other, before["handles"] + 1) == before["handles"] + 1
+    assert retained[0] == WIDTH
+    with pytest.raises(ConnectionAbortedError, match=f"No handle {dropped.id}"):
+        other.retain_handle(dropped.id)
+
+
+def test_evicted_handles_report_an_error(connect):
+    # Room for one camera image but not two
+    process, port = start_server("--handle-budget", "0.05")
+    try:
+        client = connect(port=port)
+        first, second = camera(client), camera(client)
+        assert second[0] == WIDTH
+        with pytest.raises(ConnectionAbortedError, match="evicted"):
+            first[0]
+        assert client.handle_stats()["evictions"] == 1
+    finally:
+        stop_server(process)
+
+
+def test_handles_need_a_binary_codec(connect):
+    client = connect(codec="text")
+    with pytest.raises(ValueError, match="binary codec"):
+        camera(client)
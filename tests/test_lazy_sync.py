@@ -0,0 +1,97 @@
+import ast
+
+import pytest
+
+from test_shared_variables import shared, spy
+
+CODECS = ["text", "tagged"]
+
+SCRIPT = [
+    "loop_counter = 0",
+    "scratch = [1.0, 2.0, 3.0]",
+    "time_step = 1 / 120",
+    "loop_counter = loop_counter + 1",
+]
+
+
+def pushes(sent, name):
+    """How many of the sent requests pushed the variable `name`"""
+    return sum(b"update_shared_variable" in payload and name.encode() in payload for payload in sent)
+
+
+def time_step(client):
+    params = client.call("getPhysicsEngineParameters")
+    if isinstance(params, str):
+        params = ast.literal_eval(params)
+    return params["fixedTimeStep"]
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_assignments_are_not_sent(connect, codec):
+    client = connect(codec=codec, lazy_sync=True)
+    sent = spy(client)
+    client.execute_script(SCRIPT)
+    assert not sent
+    assert client.local_namespace["loop_counter"] == 1
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_eager_sync_sends_every_assignment(connect, codec):
+    client = connect(codec=codec)
+    sent = spy(client)
+    client.execute_script(SCRIPT)
+    assert pushes(sent, "loop_counter") == 2 and pushes(sent, "scratch") == 1
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_remote_call_pushes_only_what_it_reads(connect, codec):
+    client = connect(codec=codec, lazy_sync=True)
+    client.execute_script(SCRIPT)
+    sent = spy(client)
+    client.execute_line("FUN.setTimeStep(time_step * 2)")
+    assert pushes(sent, "time_step") == 1
+    assert not pushes(sent, "loop_counter") and not pushes(sent, "scratch")
+    assert time_step(client) == pytest.approx(1 / 60)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_variables_are_pushed_once_per_value(connect, codec):
+    client = connect(codec=codec, lazy_sync=True)
+    client.execute_script(SCRIPT)
+    sent = spy(client)
+    client.execute_line("FUN.setTimeStep(time_step * 2)")
+    client.execute_line("FUN.setTimeStep(time_step * 3)")
+    assert pushes(sent, "time_step") == 1
+    client.execute_line("time_step = 1 / 240")
+    client.execute_line("FUN.setTimeStep(time_step * 2)")
+    assert pushes(sent, "time_step") == 2
+    assert time_step(client) == pytest.approx(1 / 120)
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_flush_pushes_everything(connect, codec):
+    client = connect(codec=codec, lazy_sync=True)
+    client.execute_script(SCRIPT)
+    sent = spy(client)
+    client.flush()
+    assert all(pushes(sent, name) == 1 for name in ("loop_counter", "scratch", "time_step"))
+    del sent[:]
+    assert shared(client, "loop_counter") == 1
+    assert len(sent) == 1
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_each_world_gets_its_own_push(connect, codec):
+    client = connect(codec=codec, lazy_sync=True)
+    client.execute_script(SCRIPT)
+    first = client.world
+    client.execute_line("FUN.setTimeStep(time_step * 2)")
+    second = client.create_world()
+    sent = spy(client)
+    client.execute_line("FUN.setTimeStep(time_step * 4)")
+    assert pushes(sent, "time_step") == 1
+    assert time_step(client) == pytest.approx(1 / 30)
+    client.world = first
+    client.execute_line("FUN.setTimeStep(time_step * 2)")
+    assert pushes(sent, "time_step") == 1
+    client.destroy_world(second)
@@ -0,0 +1,113 @@
+import time
+
+import pytest
+
+FUN = pytest.importorskip("pybullet")
+
+from remote_realtime import RealTimeStepper
+
+
+@pytest.fixture
+def physics():
+    client_id = FUN.connect(FUN.DIRECT)
+    yield client_id
+    FUN.disconnect(client_id)
+
+
+def time_step(client_id):
+    return FUN.getPhysicsEngineParameters(physicsClientId=client_id)["fixedTimeStep"]
+
+
+def run(stepper, seconds, jitter=0.0):
+    """Step on schedule for `seconds`, oversleeping by up to `jitter` periods each time"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        wait = stepper.due_in()
+        if wait > 0:
+            time.sleep(wait + jitter * stepper.period * (stepper.steps % 3) / 2)
+        stepper.step()
+
+
+def test_steps_follow_the_wall_clock(physics):
+    stepper = RealTimeStepper(200, physics)
+    assert time_step(physics) == pytest.approx(1 / 200)
+    run(stepper, 0.5)
+    stats = stepper.stats()
+    assert 80 <= stats["steps"] <= 110
+    assert stats["achieved_rate"] == pytest.approx(200, rel=0.2)
+    assert stats["skipped"] == 0
+
+
+def test_jitter_does_not_accumulate(physics):
+    stepper = RealTimeStepper(200, physics)
+    run(stepper, 0.3, jitter=0.8)
+    # Deadlines follow the schedule, not the time the last step ran
+    assert stepper.skipped == 0
+    assert stepper.next_deadline == pytest.approx(stepper.started + (stepper.steps + 1) * stepper.period)
+    assert stepper.max_lateness > 0.3 * stepper.period
+
+
+def test_falling_behind_skips_steps(physics):
+    stepper = RealTimeStepper(1000, physics, max_lag=5)
+    time.sleep(0.05)
+    stepper.step()
+    stats = stepper.stats()
+    assert stats["overruns"] == 1 and stats["skipped"] >= 40
+    # The schedule restarts from now rather than racing to catch up
+    assert stepper.due_in() > -6 * stepper.period
+
+
+def test_time_step_can_be_left_alone(physics):
+    FUN.setTimeStep(0.01, physicsClientId=physics)
+    RealTimeStepper(500, physics, set_time_step=False)
+    assert time_step(physics) == 0.01
+
+
+def test_rate_must_be_positive(physics):
+    with pytest.raises(ValueError):
+        RealTimeStepper(0, physics)
+
+
+def cube(client):
+    pybullet_data = pytest.importorskip("pybullet_data")
+    client.call("setAdditionalSearchPath", pybullet_data.getDataPath())
+    client.call("setGravity", 0, 0, -10)
+    return client.call("loadURDF", "cube_small.urdf", [0, 0, 2])
+
+
+def height(client, body):
+    return client.call("getBasePositionAndOrientation", body)[0][2]
+
+
+def test_server_steps_between_commands(connect):
+    client = connect()
+    body = cube(client)
+    client.start_realtime(rate=240)
+    # Commands keep being served while the world steps
+    deadline = time.perf_counter() + 0.5
+    calls = 0
+    while time.perf_counter() < deadline:
+        assert client.call("getNumBodies") == 1
+        calls += 1
+    stats = client.realtime_stats()
+    assert calls > 10
+    assert 90 <= stats["steps"] <= 150 and stats["rate"] == 240
+    # Simulated time kept up with the wall clock: about 0.5 s of free fall
+    assert height(client, body) == pytest.approx(2 - 5 * 0.5 ** 2, abs=0.3)
+    final = client.stop_realtime()
+    assert final["steps"] >= stats["steps"]
+    assert client.realtime_stats() is None
+    stopped = height(client, body)
+    time.sleep(0.1)
+    assert height(client, body) == stopped
+
+
+def test_server_steps_only_its_world(connect):
+    stepping, idle = connect(), connect()
+    stepping_cube, idle_cube = cube(stepping), cube(idle)
+    stepping.start_realtime(rate=240)
+    time.sleep(0.2)
+    stepping.stop_realtime()
+    assert height(stepping, stepping_cube) < 1.95
+    assert height(idle, idle_cube) == 2
+    assert idle.realtime_stats() is None
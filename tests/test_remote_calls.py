@@ -0,0 +1,22 @@
+import pytest
+
+from remote_client import RemoteClient
+
+
+@pytest.fixture
+def client():
+    return RemoteClient(remote_prefix="FUN.")
+
+
+@pytest.mark.parametrize("command, calls", [
+    ("pos = FUN.getBasePositionAndOrientation(body)", ["FUN.getBasePositionAndOrientation(body)"]),
+    ("out = step_all(env, [[1, (2)]])", ["step_all(env, [[1, (2)]])"]),
+    ("FUN.stepSimulation(); n = list_shared_variables()", ["FUN.stepSimulation()", "list_shared_variables()"]),
+    ("y = myFUN.x(1)", []),
+    ("y = env.FUN.x(1)", []),
+    ("y = my_step_all(env)", []),
+    ("y = envs.step_all(env)", []),
+    ("y = step_all_twice(env)", []),
+])
+def test_find_remote_calls(client, command, calls):
+    assert client.find_remote_calls(command) == calls
@@ -0,0 +1,73 @@
+import pytest
+
+CODECS = ["text", "tagged"]
+
+
+def spy(client):
+    """List that collects the payload of every request the client sends from now on"""
+    sent = []
+    send = client._send
+    client._send = lambda payload, flags=0: (sent.append(bytes(payload)), send(payload, flags))[1]
+    return sent
+
+
+def shared(client, name):
+    value = client.call("get_shared_variable", name)
+    return int(value) if isinstance(value, str) else value
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_assignment_reaches_server(connect, codec):
+    client = connect(codec=codec)
+    client.execute_line("x = 3")
+    assert shared(client, "x") == 3
+    client.execute_line("x = 4")
+    assert shared(client, "x") == 4
+
+
+@pytest.mark.parametrize("codec", CODECS)
+@pytest.mark.parametrize("write", [
+    lambda client: client.call("set_shared_variable", "x", 5),
+    lambda client: client.execute_remote_function("set_shared_variable('x', 5)"),
+    lambda client: client.execute_remote_function("update_shared_variable('x', ['value', 5])"),
+    lambda client: client.call_batch(["set_shared_variable('x', 5)"]),
+    lambda client: client.run_script("x = 5", export=["x"]),
+    lambda client: client.run_script("set_shared_variable('x', 5)"),
+], ids=["call", "source", "update", "batch", "export", "script"])
+def test_reassignment_after_server_write_is_sent(connect, codec, write):
+    client = connect(codec=codec)
+    client.execute_line("x = 1")
+    write(client)
+    assert shared(client, "x") == 5
+    client.execute_line("x = 1")
+    assert shared(client, "x") == 1
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_unchanged_reassignment_is_skipped(connect, codec):
+    client = connect(codec=codec)
+    client.execute_line("x = [1, 2, 3]")
+    sent = spy(client)
+    client.execute_line("x = [1, 2, 3]")
+    assert not sent
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_lazy_sync_pushes_before_a_read(connect, codec):
+    client = connect(codec=codec, lazy_sync=True)
+    sent = spy(client)
+    client.execute_line("x = 7")
+    assert not sent
+    assert shared(client, "x") == 7
+    client.execute_line("y = x * 2")
+    assert int(str(client.run_script("y + 1"))) == 15
+
+
+def test_lazy_sync_keeps_server_writes(connect):
+    client = connect(codec="tagged", lazy_sync=True)
+    client.execute_line("x = 1")
+    client.call("set_shared_variable", "x", 5)
+    # Reading x must not push the client's older value over the server's write
+    assert shared(client, "x") == 5
+    client.execute_line("x = 1")
+    assert shared(client, "x") == 1
@@ -0,0 +1,105 @@
+import ast
+
+import pytest
+
+pybullet_data = pytest.importorskip("pybullet_data")
+
+CODECS = ["text", "tagged"]
+
+
+def shared(client, name):
+    value = client.call("get_shared_variable", name)
+    return int(value) if isinstance(value, str) else value
+
+
+def load_cube(client):
+    client.call("setAdditionalSearchPath", pybullet_data.getDataPath())
+    client.call("setGravity", 0, 0, -10)
+    return int(client.call("loadURDF", "cube_small.urdf", [0, 0, 2]))
+
+
+def height(client, body):
+    pose = client.call("getBasePositionAndOrientation", body)
+    if isinstance(pose, str):
+        pose = ast.literal_eval(pose)
+    return pose[0][2]
+
+
+@pytest.mark.parametrize("sync", [True, False])
+@pytest.mark.parametrize("codec", CODECS)
+def test_restore_keeps_restored_variables(connect, codec, sync):
+    client = connect(codec=codec)
+    client.execute_line("x = 1")
+    client.save_snapshot("start")
+    client.execute_line("x = 2")
+    client.restore_snapshot("start", sync=sync)
+    assert shared(client, "x") == 1
+    # The client's own value only changes when the values came back
+    assert client.local_namespace["x"] == (1 if sync and codec != "text" else 2)
+    client.execute_line("x = 3")
+    assert shared(client, "x") == 3
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_restore_with_lazy_sync(connect, codec):
+    client = connect(codec=codec, lazy_sync=True)
+    client.execute_line("x = 1")
+    client.save_snapshot("start")
+    client.execute_line("x = 2")
+    client.restore_snapshot("start", sync=False)
+    assert shared(client, "x") == 1
+    client.execute_line("x = 2")
+    assert shared(client, "x") == 2
+
+
+def test_restore_pushes_variables_the_snapshot_lacks(connect):
+    client = connect(codec="tagged", lazy_sync=True)
+    client.save_snapshot("empty")
+    client.execute_line("y = 4")
+    assert shared(client, "y") == 4
+    client.restore_snapshot("empty", sync=False)
+    assert shared(client, "y") == 4
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_restore_physics_state(connect, codec):
+    client = connect(codec=codec)
+    cube = load_cube(client)
+    client.save_snapshot("start")
+    client.run_script("for _ in range(100): FUN.stepSimulation()")
+    assert height(client, cube) < 1.5
+    client.restore_snapshot("start")
+    assert height(client, cube) == 2.0
+
+
+def test_snapshot_names(connect):
+    client = connect(codec="tagged")
+    client.save_snapshot("a")
+    client.save_snapshot("b")
+    assert sorted(client.list_snapshots()["names"]) == ["a", "b"]
+    assert client.drop_snapshot("a")
+    assert client.list_snapshots()["names"] == ["b"]
+    with pytest.raises(ConnectionAbortedError, match="No snapshot named 'a'"):
+        client.restore_snapshot("a")
+
+
+def test_spilled_snapshots_restore(tmp_path, connect):
+    from conftest import start_server, stop_server
+    process, port = start_server("--snapshot-budget", "0.02", "--snapshot-spill-dir", str(tmp_path))
+    try:
+        client = connect(port=port, codec="tagged")
+        cube = load_cube(client)
+        client.execute_line("k = 0")
+        client.save_snapshot("start")
+        for i in range(1, 4):
+            client.run_script("for _ in range(50): FUN.stepSimulation()")
+            client.execute_line(f"k = {i}")
+            client.save_snapshot(f"s{i}")
+        stats = client.list_snapshots()
+        assert stats["spilled"] >= 1 and stats["evictions"] >= 1
+        client.restore_snapshot("start")
+        assert height(client, cube) == 2.0
+        assert shared(client, "k") == 0 and client.local_namespace["k"] == 0
+        assert client.list_snapshots()["disk_hits"] == 1
+    finally:
+        stop_server(process)
@@ -0,0 +1,114 @@
+import pytest
+
+from remote_codec import CODECS
+from remote_sync import MAX_DELTA_FRACTION, SyncState, VersionConflict, apply_update, fingerprint, plan_update
+
+encode = CODECS["tagged"].encode
+
+
+def sync(state, value):
+    """Plan an update from `state` to `value`; returns (change, the state after it)"""
+    change, digest, kind, items = plan_update(state, value, encode)
+    version = 1 if state is None else state.version + 1
+    return change, SyncState(version, digest, kind, items)
+
+
+def round_trip(old, new):
+    """The change sent to turn `old` into `new`, after checking the server would rebuild `new`"""
+    _, state = sync(None, old)
+    change, _ = sync(state, new)
+    if change is not None:
+        rebuilt = apply_update(old, change)
+        assert rebuilt == new
+        if isinstance(new, list):
+            assert [type(item) for item in rebuilt] == [type(item) for item in new]
+    return change
+
+
+def test_first_sync_sends_the_value():
+    change, _ = sync(None, [1, 2, 3])
+    assert change == ["value", [1, 2, 3]]
+
+
+def test_unchanged_value_sends_nothing():
+    assert round_trip([1, {"a": 2}], [1, {"a": 2}]) is None
+    assert round_trip("text", "text") is None
+
+
+def test_changed_scalar_sends_the_value():
+    assert round_trip(1, 2) == ["value", 2]
+
+
+def test_list_delta():
+    old = list(range(100))
+    new = old.copy()
+    new[3] = -3
+    new[97] = "x"
+    assert round_trip(old, new) == ["list", 100, [[3, -3], [97, "x"]]]
+
+
+def test_list_grows_and_shrinks():
+    old = list(range(10))
+    assert round_trip(old, old + [10, 11]) == ["list", 12, [[10, 10], [11, 11]]]
+    assert round_trip(old, old[:8]) == ["list", 8, []]
+
+
+def test_list_delta_sees_type_changes():
+    old = [1] * 10
+    new = old.copy()
+    new[4] = 1.0
+    assert round_trip(old, new) == ["list", 10, [[4, 1.0]]]
+
+
+def test_list_delta_sees_nested_changes():
+    old = [[i, i] for i in range(10)]
+    new = [item.copy() for item in old]
+    new[2][1] = 99
+    assert round_trip(old, new) == ["list", 10, [[2, [2, 99]]]]
+
+
+def test_large_list_change_sends_the_value():
+    old = list(range(10))
+    new = [-item for item in old]
+    assert round_trip(old, new) == ["value", new]
+
+
+def test_dict_delta():
+    old = {f"k{i}": i for i in range(10)}
+    new = dict(old, k1=-1, extra=[1, 2])
+    del new["k5"]
+    change = round_trip(old, new)
+    assert change[0] == "dict"
+    assert sorted(change[1]) == [["extra", [1, 2]], ["k1", -1]]
+    assert change[2] == ["k5"]
+
+
+def test_dict_delta_respects_max_fraction():
+    old = {i: i for i in range(10)}
+    changed = int(MAX_DELTA_FRACTION * 10) + 1
+    new = {i: (i + 100 if i < changed else i) for i in range(10)}
+    assert round_trip(old, new) == ["value", new]
+
+
+def test_kind_change_sends_the_value():
+    assert round_trip([1, 2], {"a": 1}) == ["value", {"a": 1}]
+
+
+def test_apply_update_leaves_current_untouched():
+    current = [1, 2, 3]
+    assert apply_update(current, ["list", 3, [[0, 9]]]) == [9, 2, 3]
+    assert current == [1, 2, 3]
+
+
+def test_apply_update_rejects_mismatched_delta():
+    with pytest.raises(VersionConflict):
+        apply_update({"a": 1}, ["list", 1, [[0, 1]]])
+    with pytest.raises(VersionConflict):
+        apply_update([1], ["dict", [], []])
+    with pytest.raises(ValueError):
+        apply_update([1], ["nope"])
+
+
+def test_fingerprint_digest_tracks_content():
+    assert fingerprint([1, 2], encode)[0] == fingerprint([1, 2], encode)[0]
+    assert fingerprint([1, 2], encode)[0] != fingerprint([1, 2.0], encode)[0]